@@ -1,7 +1,9 @@
 from flask import Flask, send_from_directory
 from config import Config
-from app.models import db, User, Valve
+from app.models import db, User
 from flask_login import LoginManager, current_user
+from werkzeug.local import LocalProxy
+from app.services.dashboard import pending_valve_count
 import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -30,17 +32,16 @@ def create_app(config_class=Config):
 
     @app.context_processor
     def inject_pending_count():
-        try:
+        def pending_count():
+            # 仅在模板实际引用 pending_count 时才计算，数值来自首页统计缓存
             if current_user.is_authenticated and current_user.role in [
                 "leader",
                 "admin",
             ]:
-                pending_count = Valve.query.filter_by(status="pending").count()
-            else:
-                pending_count = 0
-        except:
-            pending_count = 0
-        return dict(pending_count=pending_count)
+                return pending_valve_count()
+            return 0
+
+        return dict(pending_count=LocalProxy(pending_count))
 
     from app.routes import bp
     from app.routes.auth import auth
@@ -48,6 +49,7 @@ def create_app(config_class=Config):
     from app.routes.valves import valves
     from app.routes.admin import admin
     from app.routes.ledgers import ledgers
+    from app.routes.jobs import jobs
 
     app.register_blueprint(bp)
     app.register_blueprint(auth)
@@ -55,5 +57,6 @@ def create_app(config_class=Config):
     app.register_blueprint(valves)
     app.register_blueprint(admin)
     app.register_blueprint(ledgers)
+    app.register_blueprint(jobs)
 
     return app
@@ -30,6 +30,10 @@ class User(UserMixin, db.Model):
 
 class Ledger(db.Model):
     __tablename__ = "ledgers"
+    __table_args__ = (
+        db.Index("ix_ledgers_created_by", "created_by"),
+        db.Index("ix_ledgers_snapshot_status", "approved_snapshot_status"),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     名称 = db.Column(db.String(100), nullable=False)
@@ -37,8 +41,15 @@ class Ledger(db.Model):
 
     status = db.Column(db.String(20), default="draft")
 
+    # 各状态阀门数量，由 app.services.valve_status 在状态流转时维护
     valve_count = db.Column(db.Integer, default=0)
+    draft_count = db.Column(db.Integer, default=0)
     pending_count = db.Column(db.Integer, default=0)
+    approved_count = db.Column(db.Integer, default=0)
+    rejected_count = db.Column(db.Integer, default=0)
+
+    # 台账内阀门数据版本号，任一阀门写入后递增，用作派生数据缓存的键
+    data_version = db.Column(db.Integer, default=0)
 
     created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     approved_by = db.Column(db.Integer, db.ForeignKey("users.id"))
@@ -51,13 +62,68 @@ class Ledger(db.Model):
     approved_snapshot_status = db.Column(db.String(20), nullable=True)
     approved_snapshot_at = db.Column(db.DateTime, nullable=True)
 
+    # 合集信息版本号（乐观锁）。每次 ORM 更新都会校验，只在修改名称、描述时由调用方
+    # 递增，计数、状态等维护性写入不改变版本号
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {
+        "version_id_col": version,
+        "version_id_generator": lambda current: current or 1,
+    }
+
     creator = db.relationship("User", foreign_keys=[created_by])
     approver = db.relationship("User", foreign_keys=[approved_by])
     valves = db.relationship("Valve", backref="ledger", lazy="dynamic")
 
 
+# 阀门台账数据字段（不含状态、审批等系统字段）
+VALVE_FIELD_NAMES = [
+    "装置名称",
+    "位号",
+    "名称",
+    "设备等级",
+    "型号规格",
+    "生产厂家",
+    "安装位置及用途",
+    "设备编号",
+    "是否联锁",
+    "备注",
+    "工艺条件_介质名称",
+    "工艺条件_设计温度",
+    "工艺条件_阀前压力",
+    "工艺条件_阀后压力",
+    "阀体_公称通径",
+    "阀体_连接方式及规格",
+    "阀体_材质",
+    "阀内件_阀座直径",
+    "阀内件_阀芯材质",
+    "阀内件_阀座材质",
+    "阀内件_阀杆材质",
+    "阀内件_流量特性",
+    "阀内件_泄露等级",
+    "阀内件_Cv值",
+    "执行机构_形式",
+    "执行机构_型号规格",
+    "执行机构_厂家",
+    "执行机构_作用形式",
+    "执行机构_行程",
+    "执行机构_弹簧范围",
+    "执行机构_气源压力",
+    "执行机构_故障位置",
+    "执行机构_关阀时间",
+    "执行机构_开阀时间",
+]
+
+
 class Valve(db.Model):
     __tablename__ = "valves"
+    __table_args__ = (
+        # 覆盖 (ledger_id)、(ledger_id, status) 及审批快照过滤
+        db.Index(
+            "ix_valves_ledger_status_approved", "ledger_id", "status", "approved_at"
+        ),
+        db.Index("ix_valves_status", "status"),
+        db.Index("ix_valves_created_by", "created_by"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ledger_id = db.Column(db.Integer, db.ForeignKey("ledgers.id"), nullable=True)
     # 基本信息
@@ -111,6 +177,10 @@ class Valve(db.Model):
     updated_at = db.Column(
         db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
     )
+    # 行版本号（乐观锁），每次 ORM 更新时由 SQLAlchemy 校验并递增，
+    # 不经过 ORM 的批量 UPDATE 需自行递增
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     creator = db.relationship("User", foreign_keys=[created_by])
     approver = db.relationship("User", foreign_keys=[approved_by])
@@ -130,8 +200,20 @@ class Valve(db.Model):
         ]
 
 
+def snapshot_visible_clause():
+    """已审批快照内的阀门条件（查询需关联 Ledger）"""
+    return db.and_(
+        Valve.status == "approved",
+        db.or_(
+            Ledger.approved_snapshot_at.is_(None),
+            Valve.approved_at <= Ledger.approved_snapshot_at,
+        ),
+    )
+
+
 class ValvePhoto(db.Model):
     __tablename__ = "valve_photos"
+    __table_args__ = (db.Index("ix_valve_photos_valve_id", "valve_id"),)
     id = db.Column(db.Integer, primary_key=True)
     valve_id = db.Column(db.Integer, db.ForeignKey("valves.id"), nullable=False)
     filename = db.Column(db.String(200), nullable=False)
@@ -145,6 +227,9 @@ class ValvePhoto(db.Model):
 
 class MaintenanceRecord(db.Model):
     __tablename__ = "maintenance_records"
+    __table_args__ = (
+        db.Index("ix_maintenance_records_valve_time", "valve_id", "检修时间"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     valve_id = db.Column(db.Integer, db.ForeignKey("valves.id"), nullable=False)
     所属中心 = db.Column(db.String(100))
@@ -163,6 +248,7 @@ class MaintenanceRecord(db.Model):
 
 class ValveAttachment(db.Model):
     __tablename__ = "valve_attachments"
+    __table_args__ = (db.Index("ix_valve_attachments_valve_id", "valve_id"),)
     id = db.Column(db.Integer, primary_key=True)
     valve_id = db.Column(db.Integer, db.ForeignKey("valves.id"), nullable=False)
     名称 = db.Column(db.String(100))
@@ -177,6 +263,12 @@ class ValveAttachment(db.Model):
 
 class ApprovalLog(db.Model):
     __tablename__ = "approval_logs"
+    __table_args__ = (
+        db.Index(
+            "ix_approval_logs_ledger_valve_time", "ledger_id", "valve_id", "timestamp"
+        ),
+        db.Index("ix_approval_logs_valve_id", "valve_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ledger_id = db.Column(db.Integer, db.ForeignKey("ledgers.id"))
     valve_id = db.Column(db.Integer, db.ForeignKey("valves.id"), nullable=False)
@@ -194,3 +286,57 @@ class Setting(db.Model):
     __tablename__ = "settings"
     key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.String(200))
+
+
+class Job(db.Model):
+    """后台任务，由 app.services.jobs 调度执行"""
+
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("ix_jobs_user_created", "user_id", "created_at"),)
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(
+        db.String(20), default="queued"
+    )  # queued/running/done/failed/cancelled
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    message = db.Column(db.String(500))
+    progress = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    # 结果文件的下载文件名与类型，没有结果文件时为空
+    result_name = db.Column(db.String(200))
+    result_mimetype = db.Column(db.String(100))
+    # 执行任务的进程号，用于识别服务重启后中断的任务
+    pid = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship("User")
+
+
+class DraftBuffer(db.Model):
+    """草稿自动保存暂存行，由 app.services.draft_buffer 合并后写入 valves"""
+
+    __tablename__ = "valve_draft_buffers"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "valve_id", name="uq_draft_buffers_user_valve"),
+        db.Index("ix_draft_buffers_valve_id", "valve_id"),
+        db.Index("ix_draft_buffers_created_at", "created_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    valve_id = db.Column(db.Integer, db.ForeignKey("valves.id"), nullable=False)
+    # 暂存时阀门的行版本号，写入时据此检测期间的其他修改
+    base_version = db.Column(db.Integer, nullable=False)
+    form_data = db.Column(db.Text)  # JSON，合并后的台账字段
+    attachments = db.Column(db.Text)  # JSON，最近一次提交的附件列表
+    # 合并的自动保存次数
+    save_count = db.Column(db.Integer, default=1)
+    # 首次暂存时间，超过 DRAFT_FLUSH_SECONDS 秒后写入阀门
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
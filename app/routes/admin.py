@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required, current_user
 from app.models import db, User, Setting
+from app.services.cache import cache_stats
+from app.services.dashboard import invalidate_dashboard
 from functools import wraps
 
 admin = Blueprint("admin", __name__, url_prefix="/admin")
@@ -25,6 +27,13 @@ def index():
     return render_template("admin/index.html", user_count=user_count)
 
 
+@admin.route("/cache-stats")
+@login_required
+@require_admin
+def cache_stats_view():
+    return jsonify(cache_stats())
+
+
 @admin.route("/users", methods=["GET", "POST"])
 @login_required
 @require_admin
@@ -42,6 +51,7 @@ def users():
             user = User(username=username, role=role, real_name=real_name, dept=dept)
             user.set_password(password)
             db.session.add(user)
+            invalidate_dashboard()
             db.session.commit()
             flash("用户添加成功")
 
@@ -71,6 +81,7 @@ def delete_user(id):
         return redirect(url_for("admin.users"))
 
     user.status = "inactive"
+    invalidate_dashboard()
     db.session.commit()
     flash("用户已禁用")
     return redirect(url_for("admin.users"))
@@ -87,6 +98,7 @@ def edit_user(id):
         user.role = request.form.get("role")
         user.real_name = request.form.get("real_name")
         user.dept = request.form.get("dept")
+        invalidate_dashboard()
 
         new_password = request.form.get("new_password")
         if new_password:
@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_required, current_user
-from app.models import db, Ledger, Valve, ApprovalLog
+from app.models import db, Ledger
 from app.routes.valves.permissions import require_leader
-from datetime import datetime
+from app.services.dashboard import pending_valve_count
+from app.services.valve_status import bulk_transition
+from sqlalchemy.orm import joinedload
 
 approvals = Blueprint("approvals", __name__)
 
@@ -12,48 +14,30 @@ approvals = Blueprint("approvals", __name__)
 @require_leader
 def index():
     tab = request.args.get("tab", "pending")
-    pending_count = Valve.query.filter_by(status="pending").count()
+    pending_count = pending_valve_count()
 
+    query = Ledger.query.options(joinedload(Ledger.creator))
     if tab == "pending":
         ledgers = (
-            Ledger.query.join(Valve)
-            .filter(Valve.status == "pending")
-            .distinct()
+            query.filter(Ledger.pending_count > 0)
             .order_by(Ledger.created_at.desc())
             .all()
         )
     elif tab == "approved":
         ledgers = (
-            Ledger.query.filter(Ledger.approved_snapshot_status == "approved")
+            query.filter(Ledger.approved_snapshot_status == "approved")
             .order_by(Ledger.created_at.desc())
             .all()
         )
     elif tab == "rejected":
         ledgers = (
-            Ledger.query.join(Valve)
-            .filter(Valve.status == "rejected")
-            .distinct()
+            query.filter(Ledger.rejected_count > 0)
             .order_by(Ledger.created_at.desc())
             .all()
         )
     else:
         ledgers = []
 
-    for ledger in ledgers:
-        ledger.valve_count = Valve.query.filter_by(ledger_id=ledger.id).count()
-        ledger.pending_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="pending"
-        ).count()
-        ledger.approved_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="approved"
-        ).count()
-        ledger.rejected_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="rejected"
-        ).count()
-        ledger.draft_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="draft"
-        ).count()
-
     return render_template(
         "approvals/index.html", ledgers=ledgers, tab=tab, pending_count=pending_count
     )
@@ -66,42 +50,16 @@ def batch_approve():
     ledger_ids = request.form.getlist("ledger_ids")
     comment = request.form.get("comment", "")
 
-    approved_count = 0
-    for ledger_id in ledger_ids:
-        ledger = Ledger.query.get(ledger_id)
-        if not ledger:
-            continue
-
-        pending_valves = Valve.query.filter_by(
-            ledger_id=ledger_id, status="pending"
-        ).all()
-
-        for valve in pending_valves:
-            valve.status = "approved"
-            valve.approved_by = current_user.id
-            valve.approved_at = datetime.utcnow()
-
-            log = ApprovalLog(
-                ledger_id=ledger.id,
-                valve_id=valve.id,
-                action="approve",
-                user_id=current_user.id,
-                comment=comment,
-            )
-            db.session.add(log)
-            approved_count += 1
-
-        total = Valve.query.filter_by(ledger_id=ledger_id).count()
-        approved = Valve.query.filter_by(ledger_id=ledger_id, status="approved").count()
-
-        if approved == total and total > 0:
-            ledger.status = "approved"
-            ledger.approved_snapshot_status = "approved"
-            ledger.approved_snapshot_at = datetime.utcnow()
-        elif approved > 0:
-            ledger.status = "approved"
-
-        db.session.commit()
+    counts = bulk_transition(
+        ledger_ids,
+        "pending",
+        "approved",
+        user_id=current_user.id,
+        action="approve",
+        comment=comment,
+    )
+    db.session.commit()
+    approved_count = sum(counts.values())
 
     flash(f"已审批 {approved_count} 项台账内容")
     return redirect(url_for("approvals.index"))
@@ -114,31 +72,16 @@ def batch_reject():
     ledger_ids = request.form.getlist("ledger_ids")
     comment = request.form.get("comment", "")
 
-    rejected_count = 0
-    for ledger_id in ledger_ids:
-        ledger = Ledger.query.get(ledger_id)
-        if not ledger:
-            continue
-
-        pending_valves = Valve.query.filter_by(
-            ledger_id=ledger_id, status="pending"
-        ).all()
-
-        for valve in pending_valves:
-            valve.status = "rejected"
-
-            log = ApprovalLog(
-                ledger_id=ledger.id,
-                valve_id=valve.id,
-                action="reject",
-                user_id=current_user.id,
-                comment=comment,
-            )
-            db.session.add(log)
-            rejected_count += 1
-
-        ledger.status = "rejected"
-        db.session.commit()
+    counts = bulk_transition(
+        ledger_ids,
+        "pending",
+        "rejected",
+        user_id=current_user.id,
+        action="reject",
+        comment=comment,
+    )
+    db.session.commit()
+    rejected_count = sum(counts.values())
 
     flash(f"已驳回 {rejected_count} 项台账内容")
     return redirect(url_for("approvals.index"))
@@ -151,32 +94,14 @@ def single_approve(id):
     ledger = Ledger.query.get_or_404(id)
     comment = request.form.get("comment", "")
 
-    pending_valves = Valve.query.filter_by(ledger_id=id, status="pending").all()
-
-    for valve in pending_valves:
-        valve.status = "approved"
-        valve.approved_by = current_user.id
-        valve.approved_at = datetime.utcnow()
-
-        log = ApprovalLog(
-            ledger_id=ledger.id,
-            valve_id=valve.id,
-            action="approve",
-            user_id=current_user.id,
-            comment=comment,
-        )
-        db.session.add(log)
-
-    total = Valve.query.filter_by(ledger_id=id).count()
-    approved = Valve.query.filter_by(ledger_id=id, status="approved").count()
-
-    if approved == total and total > 0:
-        ledger.status = "approved"
-        ledger.approved_snapshot_status = "approved"
-        ledger.approved_snapshot_at = datetime.utcnow()
-    elif approved > 0:
-        ledger.status = "approved"
-
+    bulk_transition(
+        [id],
+        "pending",
+        "approved",
+        user_id=current_user.id,
+        action="approve",
+        comment=comment,
+    )
     db.session.commit()
 
     flash(f"已审批台账合集：{ledger.名称}")
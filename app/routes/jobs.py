@@ -0,0 +1,55 @@
+import os
+
+from flask import Blueprint, jsonify, send_file, url_for
+from flask_login import login_required, current_user
+
+from app.services.jobs import cancel_job, get_job, job_payload, result_path
+
+jobs = Blueprint("jobs", __name__)
+
+
+def job_response(job, status=200):
+    """返回任务状态 JSON，附带查询、取消与下载地址"""
+    payload = job_payload(job)
+    payload["status_url"] = url_for("jobs.status", job_id=job.id)
+    payload["cancel_url"] = url_for("jobs.cancel", job_id=job.id)
+    if job.status == "done" and job.result_name:
+        payload["download_url"] = url_for("jobs.download", job_id=job.id)
+    return jsonify(payload), status
+
+
+@jobs.route("/jobs/<job_id>")
+@login_required
+def status(job_id):
+    job = get_job(job_id, current_user)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return job_response(job)
+
+
+@jobs.route("/jobs/<job_id>/cancel", methods=["POST"])
+@login_required
+def cancel(job_id):
+    job = get_job(job_id, current_user)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    if not cancel_job(job):
+        return jsonify({"error": "任务已结束，无法取消"}), 409
+    return job_response(job)
+
+
+@jobs.route("/jobs/<job_id>/download")
+@login_required
+def download(job_id):
+    job = get_job(job_id, current_user)
+    if job is None or job.status != "done" or not job.result_name:
+        return jsonify({"error": "任务不存在或尚未完成"}), 404
+    path = result_path(job.id)
+    if not os.path.exists(path):
+        return jsonify({"error": "结果文件已过期，请重新提交任务"}), 410
+    return send_file(
+        path,
+        mimetype=job.result_mimetype,
+        as_attachment=True,
+        download_name=job.result_name,
+    )
@@ -8,19 +8,62 @@ from flask import (
     jsonify,
 )
 from flask_login import login_required, current_user
-from app.models import db, Ledger, Valve, ApprovalLog, Setting, ValveAttachment
+from app.models import db, Ledger, Valve, Setting, ValveAttachment, VALVE_FIELD_NAMES
 from app.routes.valves.permissions import (
     can_edit_valve,
     can_delete_valve,
-    can_view_ledger,
+    can_open_ledger_detail,
     can_view_valve,
+    is_ledger_owner,
 )
-from sqlalchemy import or_
-from datetime import datetime
+from app.routes.valves.forms import render_version_conflict
+from app.services.batch_save import (
+    VersionConflict,
+    patch_valve_cells,
+    save_valve_rows,
+    version_conflict,
+)
+from app.services.dashboard import invalidate_dashboard
+from app.services.draft_buffer import discard_drafts, flush_drafts
+from app.services.facets import ledger_facets
+from app.services.loading import load_many, load_permitted
+from app.services.paging import (
+    COUNT_MODES,
+    KeysetPage,
+    clamp_per_page,
+    count_total,
+    keyset_page,
+)
+from app.services.valve_status import (
+    add_valves,
+    delete_valves,
+    bulk_transition,
+    delete_ledgers,
+    ledgers_with_maintenance,
+    valves_with_maintenance,
+    ledger_display_status,
+    set_valve_status,
+    transition_valves,
+    update_ledger_status,
+)
+from app.services.valve_query import (
+    DETAIL_FILTER_ARGS,
+    apply_column_filters,
+    detail_valve_query,
+    filtered_detail_query,
+)
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+import builtins
 import json
 
 ledgers = Blueprint("ledgers", __name__)
 
+DETAIL_PER_PAGE = 20
+DETAIL_MAX_PER_PAGE = 200
+# 估计总数模式下最多统计的条数
+DETAIL_EXACT_COUNT_LIMIT = 10000
+
 
 def get_back_url(from_param):
     if from_param == "mine":
@@ -30,30 +73,6 @@ def get_back_url(from_param):
     return url_for("ledgers.list")
 
 
-def update_ledger_status(ledger):
-    total = Valve.query.filter_by(ledger_id=ledger.id).count()
-    if total == 0:
-        return
-
-    approved = Valve.query.filter_by(ledger_id=ledger.id, status="approved").count()
-    pending = Valve.query.filter_by(ledger_id=ledger.id, status="pending").count()
-    rejected = Valve.query.filter_by(ledger_id=ledger.id, status="rejected").count()
-    draft = Valve.query.filter_by(ledger_id=ledger.id, status="draft").count()
-
-    if pending > 0:
-        ledger.status = "pending"
-    elif rejected > 0:
-        ledger.status = "rejected"
-    elif draft > 0:
-        ledger.status = "draft"
-    elif approved == total:
-        ledger.status = "approved"
-        ledger.approved_at = datetime.utcnow()
-
-        ledger.approved_snapshot_status = "approved"
-        ledger.approved_snapshot_at = datetime.utcnow()
-
-
 def can_edit_ledger(ledger):
     return ledger.created_by == current_user.id or current_user.role in [
         "leader",
@@ -72,6 +91,38 @@ def can_delete_valve(valve):
     return can_edit_valve(valve)
 
 
+def _detail_page_url(id, **overrides):
+    """保留当前筛选条件，替换游标等参数后生成详情页地址"""
+    args = request.args.to_dict(flat=False)
+    args.pop("page", None)
+    for key, value in overrides.items():
+        args.pop(key, None)
+        if value is not None:
+            args[key] = value
+    args.setdefault("paging", "cursor")
+    return url_for("ledgers.detail", id=id, **args)
+
+
+def _detail_export_url(id):
+    """按当前筛选条件导出本合集的地址"""
+    args = {
+        key: request.args.getlist(key)
+        for key in DETAIL_FILTER_ARGS
+        if key in request.args
+    }
+    return url_for("valves.export_data", ledger_id=id, **args)
+
+
+def _valve_json(valve):
+    item = {
+        "id": valve.id,
+        "status": valve.status,
+        "version": valve.version,
+    }
+    item.update((name, getattr(valve, name)) for name in VALVE_FIELD_NAMES)
+    return item
+
+
 @ledgers.route("/ledgers")
 @login_required
 def list():
@@ -87,23 +138,13 @@ def list():
     else:
         query = query.filter(Ledger.approved_snapshot_status == "approved")
 
-    ledgers_list = query.order_by(Ledger.created_at.desc()).all()
+    ledgers_list = (
+        query.options(joinedload(Ledger.creator))
+        .order_by(Ledger.created_at.desc())
+        .all()
+    )
 
     for ledger in ledgers_list:
-        ledger.valve_count = Valve.query.filter_by(ledger_id=ledger.id).count()
-        ledger.pending_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="pending"
-        ).count()
-        ledger.rejected_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="rejected"
-        ).count()
-        ledger.approved_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="approved"
-        ).count()
-        ledger.draft_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="draft"
-        ).count()
-
         if ledger.approved_snapshot_status:
             ledger.display_status = ledger.approved_snapshot_status
         else:
@@ -124,6 +165,7 @@ def new():
         ledger.status = "draft"
 
         db.session.add(ledger)
+        invalidate_dashboard()
         db.session.commit()
 
         flash("台账集合创建成功")
@@ -138,47 +180,17 @@ def detail(id):
     from_param = request.args.get("from", "all")
     ledger = Ledger.query.get_or_404(id)
 
-    if not can_view_ledger(ledger):
-        flash("无权访问")
-        return redirect(url_for("ledgers.list"))
-
-    is_owner = ledger.created_by == current_user.id or current_user.role in [
-        "leader",
-        "admin",
-    ]
-
-    if from_param != "mine" and not is_owner:
+    if not can_open_ledger_detail(ledger, from_param):
         flash("无权访问")
         return redirect(url_for("ledgers.list"))
 
-    ledger.valve_count = Valve.query.filter_by(ledger_id=id).count()
-    ledger.pending_count = Valve.query.filter_by(ledger_id=id, status="pending").count()
-    ledger.rejected_count = Valve.query.filter_by(
-        ledger_id=id, status="rejected"
-    ).count()
-    ledger.approved_count = Valve.query.filter_by(
-        ledger_id=id, status="approved"
-    ).count()
-    ledger.draft_count = Valve.query.filter_by(ledger_id=id, status="draft").count()
-
-    ledger.is_owner = is_owner
+    ledger.is_owner = is_ledger_owner(ledger)
 
     if from_param == "mine" or ledger.approved_snapshot_status == "approved":
-        if ledger.pending_count > 0:
-            ledger.display_status = "pending"
-        elif ledger.rejected_count > 0:
-            ledger.display_status = "rejected"
-        elif ledger.approved_count > 0 and ledger.approved_count == ledger.valve_count:
-            ledger.display_status = "approved"
-        elif ledger.valve_count > 0:
-            ledger.display_status = "draft"
-        else:
-            ledger.display_status = "draft"
+        ledger.display_status = ledger_display_status(ledger)
     else:
         ledger.display_status = ledger.approved_snapshot_status or "draft"
 
-    db.session.commit()
-
     if request.method == "POST":
         if not can_edit_ledger(ledger):
             flash("无权操作")
@@ -188,19 +200,14 @@ def detail(id):
         valve_ids = request.form.getlist("valve_ids")
 
         if action == "submit":
+            # 提交前写入尚在暂存中的自动保存内容
+            flush_drafts(ledger_ids=[ledger.id])
             draft_valves = Valve.query.filter_by(
                 ledger_id=ledger.id, status="draft"
             ).all()
-            for valve in draft_valves:
-                valve.status = "pending"
-                log = ApprovalLog(
-                    ledger_id=ledger.id,
-                    valve_id=valve.id,
-                    action="submit",
-                    user_id=current_user.id,
-                )
-                db.session.add(log)
-            db.session.commit()
+            transition_valves(
+                draft_valves, "pending", user_id=current_user.id, action="submit"
+            )
             update_ledger_status(ledger)
             db.session.commit()
             flash(f"已提交 {len(draft_valves)} 项台账内容审批")
@@ -213,24 +220,17 @@ def detail(id):
                     url_for("ledgers.detail", id=id, **{"from": from_param})
                 )
 
-            approved_count = 0
-            for valve_id in valve_ids:
-                valve = Valve.query.get(int(valve_id))
-                if valve and valve.ledger_id == ledger.id and valve.status == "pending":
-                    valve.status = "approved"
-                    valve.approved_by = current_user.id
-                    valve.approved_at = datetime.utcnow()
-                    log = ApprovalLog(
-                        ledger_id=ledger.id,
-                        valve_id=valve.id,
-                        action="approve",
-                        user_id=current_user.id,
-                        comment=request.form.get("comment", ""),
-                    )
-                    db.session.add(log)
-                    approved_count += 1
-            update_ledger_status(ledger)
+            counts = bulk_transition(
+                [ledger.id],
+                "pending",
+                "approved",
+                user_id=current_user.id,
+                action="approve",
+                comment=request.form.get("comment", ""),
+                valve_ids=valve_ids,
+            )
             db.session.commit()
+            approved_count = counts.get(ledger.id, 0)
             flash(f"已审批 {approved_count} 项台账内容")
             return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
@@ -241,110 +241,62 @@ def detail(id):
                     url_for("ledgers.detail", id=id, **{"from": from_param})
                 )
 
-            rejected_count = 0
-            for valve_id in valve_ids:
-                valve = Valve.query.get(int(valve_id))
-                if valve and valve.ledger_id == ledger.id and valve.status == "pending":
-                    valve.status = "rejected"
-                    log = ApprovalLog(
-                        ledger_id=ledger.id,
-                        valve_id=valve.id,
-                        action="reject",
-                        user_id=current_user.id,
-                        comment=request.form.get("comment", ""),
-                    )
-                    db.session.add(log)
-                    rejected_count += 1
+            counts = bulk_transition(
+                [ledger.id],
+                "pending",
+                "rejected",
+                user_id=current_user.id,
+                action="reject",
+                comment=request.form.get("comment", ""),
+                valve_ids=valve_ids,
+            )
             db.session.commit()
+            rejected_count = counts.get(ledger.id, 0)
             flash(f"已驳回 {rejected_count} 项台账内容")
             return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
-    query = Valve.query.filter_by(ledger_id=id)
-
-    status_filter = request.args.get("status")
-
-    if from_param != "mine" and not status_filter:
-        if ledger.approved_snapshot_at:
-            query = query.filter(
-                Valve.status == "approved",
-                Valve.approved_at <= ledger.approved_snapshot_at,
-            )
-        else:
-            query = query.filter(Valve.status == "approved")
-
-    search = request.args.get("search")
-    if search:
-        search_conditions = []
-        for column in Valve.__table__.columns:
-            if column.name not in [
-                "id",
-                "ledger_id",
-                "created_by",
-                "approved_by",
-                "approved_at",
-                "created_at",
-                "updated_at",
-                "status",
-            ]:
-                col = getattr(Valve, column.name)
-                search_conditions.append(col.contains(search))
-        if search_conditions:
-            query = query.filter(or_(*search_conditions))
-
-    status = request.args.get("status")
-    if status:
-        query = query.filter(Valve.status == status)
-
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 20, type=int)
-
-    filterable_fields = [
-        ("位号", "位号"),
-        ("名称", "名称"),
-        ("装置名称", "装置名称"),
-        ("设备等级", "设备等级"),
-        ("型号规格", "型号规格"),
-        ("生产厂家", "生产厂家"),
-        ("安装位置及用途", "安装位置及用途"),
-        ("设备编号", "设备编号"),
-        ("是否联锁", "是否联锁"),
-    ]
-
-    filter_options = {}
-    for label, field in filterable_fields:
-        if hasattr(Valve, field):
-            values = (
-                db.session.query(getattr(Valve, field))
-                .distinct()
-                .filter(
-                    getattr(Valve, field).isnot(None),
-                    getattr(Valve, field) != "",
-                    Valve.ledger_id == id,
-                )
-                .all()
-            )
-            filter_options[field] = sorted([v[0] for v in values if v[0]], key=str)
-
-    active_filters = {}
-    for label, field in filterable_fields:
-        values = request.args.getlist(field)
-        if values and hasattr(Valve, field):
-            field_filter = getattr(Valve, field).in_(values)
-            query = query.filter(field_filter)
-            active_filters[field] = values
-
-    pagination = query.order_by(Valve.id.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    query, search_rank, scope = detail_valve_query(ledger, from_param, request.args)
+    query, active_filters = apply_column_filters(query, request.args)
+    filter_options, facet_counts = ledger_facets(
+        ledger, scope.query, scope.key, active_filters
     )
-    valves_list = pagination.items
 
-    装置列表 = (
-        db.session.query(Valve.装置名称)
-        .distinct()
-        .filter(Valve.装置名称.isnot(None), Valve.ledger_id == id)
-        .all()
+    per_page = clamp_per_page(
+        request.args.get("per_page", type=int), DETAIL_PER_PAGE, DETAIL_MAX_PER_PAGE
     )
-    装置列表 = [r[0] for r in 装置列表 if r[0]]
+    count_mode = request.args.get("count", "exact")
+    if count_mode not in COUNT_MODES:
+        count_mode = "exact"
+    known_total = None if active_filters else scope.known_total
+
+    if request.args.get("paging") == "cursor" or "after" in request.args:
+        valves_list, next_cursor = keyset_page(
+            query, per_page, request.args.get("after"), search_rank
+        )
+        total, estimated = count_total(
+            query, count_mode, DETAIL_EXACT_COUNT_LIMIT, known_total
+        )
+        pagination = KeysetPage(valves_list, per_page, next_cursor, total, estimated)
+        pagination.first_url = _detail_page_url(id, after=None)
+        pagination.next_url = next_cursor and _detail_page_url(id, after=next_cursor)
+    else:
+        # 页码分页需要总数计算页数，none 模式按估计值处理
+        if count_mode == "none":
+            count_mode = "estimate"
+        query, _ = filtered_detail_query(ledger, from_param, request.args)
+        pagination = query.paginate(
+            page=request.args.get("page", 1, type=int),
+            per_page=per_page,
+            max_per_page=DETAIL_MAX_PER_PAGE,
+            error_out=False,
+            count=False,
+        )
+        pagination.total, pagination.total_is_estimate = count_total(
+            query, count_mode, DETAIL_EXACT_COUNT_LIMIT, known_total
+        )
+        valves_list = pagination.items
+
+    装置列表 = filter_options["装置名称"]
 
     return render_template(
         "valves/list.html",
@@ -354,7 +306,89 @@ def detail(id):
         装置列表=装置列表,
         active_filters=active_filters,
         filter_options=filter_options,
+        facet_counts=facet_counts,
         from_param=from_param,
+        export_url=_detail_export_url(id),
+    )
+
+
+@ledgers.route("/api/ledger/<int:id>/valves")
+@login_required
+def valves_api(id):
+    """合集详情页的 JSON 版本，按游标分页返回阀门"""
+    from_param = request.args.get("from", "all")
+    ledger = Ledger.query.get_or_404(id)
+    if not can_open_ledger_detail(ledger, from_param):
+        return jsonify({"error": "无权访问"}), 403
+
+    query, search_rank, scope = detail_valve_query(ledger, from_param, request.args)
+    query, active_filters = apply_column_filters(query, request.args)
+
+    per_page = clamp_per_page(
+        request.args.get("per_page", type=int), DETAIL_PER_PAGE, DETAIL_MAX_PER_PAGE
+    )
+    count_mode = request.args.get("count", "estimate")
+    if count_mode not in COUNT_MODES:
+        count_mode = "estimate"
+
+    items, next_cursor = keyset_page(
+        query, per_page, request.args.get("after"), search_rank
+    )
+    total, estimated = count_total(
+        query,
+        count_mode,
+        DETAIL_EXACT_COUNT_LIMIT,
+        None if active_filters else scope.known_total,
+    )
+
+    return jsonify(
+        {
+            "items": [_valve_json(valve) for valve in items],
+            "next_cursor": next_cursor,
+            "per_page": per_page,
+            "total": total,
+            "total_is_estimate": estimated,
+        }
+    )
+
+
+@ledgers.route("/api/ledger/<int:id>/valves", methods=["PATCH"])
+@login_required
+def patch_valves_api(id):
+    """按单元格增量保存 [{"id", "field", "value", "base_version"}]
+
+    全部单元格校验通过才一并写入；行版本号不一致时返回 409 及冲突的单元格。
+    成功时返回修改后各行的版本号。
+    """
+    ledger = Ledger.query.get_or_404(id)
+    if not can_edit_ledger(ledger):
+        return jsonify({"error": "无权操作"}), 403
+    if ledger.pending_count:
+        return jsonify({"error": "当前有待审批记录，无法编辑"}), 400
+
+    patches = request.get_json(silent=True)
+    if not isinstance(patches, builtins.list) or not all(
+        isinstance(patch, dict) for patch in patches
+    ):
+        return jsonify({"error": "无效数据格式"}), 400
+
+    try:
+        results, errors = patch_valve_cells(ledger, patches)
+        if errors:
+            return jsonify({"error": "部分单元格无法保存", "errors": errors}), 400
+        db.session.commit()
+    except VersionConflict as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "conflicts": e.conflicts}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify(
+        {
+            "versions": {str(result["id"]): result["version"] for result in results},
+            "results": results,
+        }
     )
 
 
@@ -369,9 +403,20 @@ def edit(id):
         return redirect(get_back_url(from_param))
 
     if request.method == "POST":
+        base_version = request.form.get("version", type=int)
+        if base_version is not None and base_version != ledger.version:
+            flash("合集信息已被其他用户修改，已载入最新内容，请核对后重新保存")
+            return render_template("ledgers/form.html", ledger=ledger), 409
         ledger.名称 = request.form.get("名称")
         ledger.描述 = request.form.get("描述")
-        db.session.commit()
+        # 只有名称、描述的修改递增版本号，计数、状态等维护性写入不递增
+        ledger.version += 1
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            flash("合集信息已被其他用户修改，已载入最新内容，请核对后重新保存")
+            return render_template("ledgers/form.html", ledger=ledger), 409
         flash("更新成功")
         return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
@@ -388,13 +433,15 @@ def delete(id):
         flash("无权删除")
         return redirect(get_back_url(from_param))
 
-    pending_count = Valve.query.filter_by(ledger_id=id, status="pending").count()
-    if pending_count > 0:
-        flash(f"当前有 {pending_count} 条待审批记录，无法删除")
+    if ledger.pending_count:
+        flash(f"当前有 {ledger.pending_count} 条待审批记录，无法删除")
+        return redirect(get_back_url(from_param))
+
+    if ledgers_with_maintenance([ledger.id]):
+        flash("合集中有阀门存在检修记录，无法删除")
         return redirect(get_back_url(from_param))
 
-    Valve.query.filter_by(ledger_id=id).delete()
-    db.session.delete(ledger)
+    delete_ledgers([ledger])
     db.session.commit()
     flash("删除成功")
     return redirect(get_back_url(from_param))
@@ -411,6 +458,8 @@ def submit(id):
         return redirect(get_back_url(from_param))
 
     valve_ids = request.form.getlist("valve_ids")
+    # 提交前写入尚在暂存中的自动保存内容
+    flush_drafts(ledger_ids=[id])
 
     if valve_ids:
         submit_valves = Valve.query.filter(
@@ -423,17 +472,9 @@ def submit(id):
         flash("没有可提交的台账")
         return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
-    for valve in submit_valves:
-        valve.status = "pending"
-        log = ApprovalLog(
-            ledger_id=ledger.id,
-            valve_id=valve.id,
-            action="submit",
-            user_id=current_user.id,
-        )
-        db.session.add(log)
-
-    db.session.commit()
+    transition_valves(
+        submit_valves, "pending", user_id=current_user.id, action="submit"
+    )
     update_ledger_status(ledger)
     db.session.commit()
 
@@ -451,24 +492,17 @@ def approve(id):
 
     ledger = Ledger.query.get_or_404(id)
 
-    pending_valves = Valve.query.filter_by(ledger_id=id, status="pending").all()
-    for valve in pending_valves:
-        valve.status = "approved"
-        valve.approved_by = current_user.id
-        valve.approved_at = datetime.utcnow()
-        log = ApprovalLog(
-            ledger_id=ledger.id,
-            valve_id=valve.id,
-            action="approve",
-            user_id=current_user.id,
-            comment=request.form.get("comment", ""),
-        )
-        db.session.add(log)
-
-    update_ledger_status(ledger)
+    counts = bulk_transition(
+        [ledger.id],
+        "pending",
+        "approved",
+        user_id=current_user.id,
+        action="approve",
+        comment=request.form.get("comment", ""),
+    )
     db.session.commit()
 
-    flash(f"已审批通过，共 {len(pending_valves)} 项台账内容")
+    flash(f"已审批通过，共 {counts.get(ledger.id, 0)} 项台账内容")
     return redirect(get_back_url(from_param))
 
 
@@ -482,21 +516,17 @@ def reject(id):
 
     ledger = Ledger.query.get_or_404(id)
 
-    pending_valves = Valve.query.filter_by(ledger_id=id, status="pending").all()
-    for valve in pending_valves:
-        valve.status = "rejected"
-        log = ApprovalLog(
-            ledger_id=ledger.id,
-            valve_id=valve.id,
-            action="reject",
-            user_id=current_user.id,
-            comment=request.form.get("comment", ""),
-        )
-        db.session.add(log)
-
+    counts = bulk_transition(
+        [ledger.id],
+        "pending",
+        "rejected",
+        user_id=current_user.id,
+        action="reject",
+        comment=request.form.get("comment", ""),
+    )
     db.session.commit()
 
-    flash(f"已驳回，共 {len(pending_valves)} 项台账内容")
+    flash(f"已驳回，共 {counts.get(ledger.id, 0)} 项台账内容")
     return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
 
@@ -542,6 +572,7 @@ def new_valve(id):
 
         try:
             db.session.add(valve)
+            add_valves([valve])
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -573,8 +604,6 @@ def new_valve(id):
                 with open("debug_form.log", "a", encoding="utf-8") as f:
                     f.write(f"DEBUG: JSON decode error: {e}\n")
 
-        ledger.valve_count = Valve.query.filter_by(ledger_id=id).count()
-        db.session.commit()
         flash("添加成功，内容已保存为草稿，请在台账集合详情页提交审批")
         return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
@@ -599,17 +628,17 @@ def edit_valve(ledger_id, id):
         return redirect(url_for("ledgers.detail", id=ledger_id, **{"from": from_param}))
 
     if request.method == "POST":
+        if version_conflict(valve, request.form.get("version")):
+            return render_version_conflict(valve, ledger=ledger, from_param=from_param)
+        discard_drafts(valve.id, current_user.id)
         for key in request.form:
-            if key == "attachments":
+            if key in ("attachments", "version"):
                 continue
             if hasattr(valve, key):
                 setattr(valve, key, request.form.get(key))
 
-        if valve.status == "approved":
-            valve.status = "draft"
-            update_ledger_status(ledger)
-        elif valve.status == "rejected":
-            valve.status = "draft"
+        if valve.status in ["approved", "rejected"]:
+            set_valve_status(valve, "draft")
             update_ledger_status(ledger)
 
         attachments_json = request.form.get("attachments")
@@ -661,10 +690,16 @@ def edit_valve(ledger_id, id):
             except json.JSONDecodeError:
                 pass
 
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            return render_version_conflict(valve, ledger=ledger, from_param=from_param)
         flash("更新成功")
         return redirect(url_for("ledgers.detail", id=ledger_id, **{"from": from_param}))
 
+    # 先写入本人尚未写入的自动保存内容，表单显示最新值
+    flush_drafts(valve_ids=[id], user_id=current_user.id)
+    db.session.commit()
     return render_template(
         "valves/form.html", valve=valve, ledger=ledger, from_param=from_param
     )
@@ -685,7 +720,7 @@ def valve_detail(ledger_id, id):
 def delete_valve(ledger_id, id):
     from_param = request.args.get("from", "all")
     ledger = Ledger.query.get_or_404(ledger_id)
-    valve = Valve.query.get_or_404(id)
+    valve = Valve.query.filter_by(id=id, ledger_id=ledger.id).first_or_404()
 
     if not can_delete_valve(valve):
         flash("无权删除")
@@ -695,12 +730,11 @@ def delete_valve(ledger_id, id):
         flash("当前状态无法删除")
         return redirect(url_for("ledgers.detail", id=ledger_id, **{"from": from_param}))
 
-    db.session.delete(valve)
+    if valves_with_maintenance([valve.id]):
+        flash("该台账有检修记录，无法删除")
+        return redirect(url_for("ledgers.detail", id=ledger_id, **{"from": from_param}))
 
-    ledger.valve_count = Valve.query.filter_by(ledger_id=ledger_id).count()
-    ledger.pending_count = Valve.query.filter_by(
-        ledger_id=ledger_id, status="pending"
-    ).count()
+    delete_valves([valve])
 
     db.session.commit()
     flash("删除成功")
@@ -710,73 +744,44 @@ def delete_valve(ledger_id, id):
 @ledgers.route("/ledger/<int:id>/valve/batch-save", methods=["POST"])
 @login_required
 def batch_save_valve(id):
-    """批量保存台账（JSON 格式）"""
+    """批量保存台账（JSON 格式），只写入有变化的字段，results 返回每行的保存结果
+
+    行带 "version" 时校验行版本号，任一行不一致返回 409 及冲突行的当前值。
+    """
     ledger = Ledger.query.get_or_404(id)
 
     if not can_edit_ledger(ledger):
         return jsonify({"success": False, "message": "无权操作"}), 403
 
-    pending_count = Valve.query.filter_by(ledger_id=id, status="pending").count()
-    if pending_count > 0:
+    if ledger.pending_count:
         return jsonify({"success": False, "message": "当前有待审批记录，无法编辑"}), 400
 
     data = request.get_json()
-    if not data or not isinstance(data, list):
+    if not data or not isinstance(data, builtins.list):
         return jsonify({"success": False, "message": "无效数据格式"})
 
-    saved_ids = []
-    errors = []
-
-    approved_to_draft = False
-
-    for item in data:
-        valve_id = item.get("id")
-        form_data = item.get("data", {})
-
-        if valve_id:
-            valve = Valve.query.get(valve_id)
-            if not valve or valve.ledger_id != id:
-                errors.append({"id": valve_id, "error": "台账不存在"})
-                continue
-
-            if valve.status not in ["draft", "rejected", "approved"]:
-                errors.append({"id": valve_id, "error": "当前状态无法编辑"})
-                continue
-
-            if valve.status == "approved":
-                valve.status = "draft"
-                approved_to_draft = True
-        else:
-            valve = Valve()
-            valve.ledger_id = id
-            valve.created_by = current_user.id
-            valve.status = "draft"
-            db.session.add(valve)
-
-        for key, value in form_data.items():
-            if key == "ledger_id":
-                continue
-            if hasattr(valve, key):
-                setattr(valve, key, value)
-
-        db.session.flush()
-
-        if valve.id:
-            saved_ids.append(valve.id)
-
     try:
+        results, errors = save_valve_rows(ledger, data, current_user.id)
         db.session.commit()
-
-        if approved_to_draft:
-            update_ledger_status(ledger)
+    except VersionConflict as e:
+        # 整批不写入，返回冲突行的当前值供客户端合并后重新提交
+        db.session.rollback()
+        return (
+            jsonify({"success": False, "message": str(e), "conflicts": e.conflicts}),
+            409,
+        )
     except Exception as e:
         db.session.rollback()
         return jsonify({"success": False, "message": str(e)}), 500
 
-    ledger.valve_count = Valve.query.filter_by(ledger_id=id).count()
-    db.session.commit()
-
-    return jsonify({"success": True, "saved_ids": saved_ids, "errors": errors})
+    return jsonify(
+        {
+            "success": True,
+            "saved_ids": [result["id"] for result in results],
+            "results": results,
+            "errors": errors,
+        }
+    )
 
 
 @ledgers.route("/ledger/<int:id>/valve/batch-delete", methods=["POST"])
@@ -789,9 +794,8 @@ def batch_delete_valve(id):
         flash("无权操作")
         return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
-    pending_count = Valve.query.filter_by(ledger_id=id, status="pending").count()
-    if pending_count > 0:
-        flash(f"当前有 {pending_count} 条待审批记录，无法删除")
+    if ledger.pending_count:
+        flash(f"当前有 {ledger.pending_count} 条待审批记录，无法删除")
         return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
     valve_ids = request.form.getlist("valve_ids")
@@ -799,16 +803,20 @@ def batch_delete_valve(id):
         flash("请选择要删除的台账")
         return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
-    deleted_count = Valve.query.filter(
-        Valve.id.in_(valve_ids),
+    deletable = load_many(
+        Valve,
+        valve_ids,
         Valve.ledger_id == id,
         Valve.status.in_(["draft", "rejected"]),
-    ).delete(synchronize_session=False)
-
-    ledger.valve_count = Valve.query.filter_by(ledger_id=id).count()
+    )
+    kept = valves_with_maintenance([valve.id for valve in deletable])
+    deletable = [valve for valve in deletable if valve.id not in kept]
+    delete_valves(deletable)
 
     db.session.commit()
-    flash(f"成功删除 {deleted_count} 项台账")
+    if kept:
+        flash(f"{len(kept)} 项台账有检修记录，未删除")
+    flash(f"成功删除 {len(deletable)} 项台账")
     return redirect(url_for("ledgers.detail", id=id, **{"from": from_param}))
 
 
@@ -821,29 +829,21 @@ def batch_delete_ledgers():
         flash("请选择要删除的合集")
         return redirect(url_for("valves.my_ledgers"))
 
-    deleted_count = 0
-    failed_ledgers = []
-
-    for ledger_id in ledger_ids:
-        ledger = Ledger.query.get(int(ledger_id))
-        if not ledger:
-            continue
-
-        if not can_edit_ledger(ledger):
-            failed_ledgers.append(ledger.名称)
-            continue
+    ledgers_found, denied = load_permitted(Ledger, ledger_ids, can_edit_ledger)
+    failed_ledgers = [ledger.名称 for ledger in denied]
 
-        pending_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="pending"
-        ).count()
-        if pending_count > 0:
+    with_maintenance = ledgers_with_maintenance(ledger.id for ledger in ledgers_found)
+    deletable = []
+    for ledger in ledgers_found:
+        if ledger.pending_count:
             failed_ledgers.append(f"{ledger.名称}(有待审批记录)")
-            continue
-
-        Valve.query.filter_by(ledger_id=ledger.id).delete()
-        db.session.delete(ledger)
-        deleted_count += 1
+        elif ledger.id in with_maintenance:
+            failed_ledgers.append(f"{ledger.名称}(有检修记录)")
+        else:
+            deletable.append(ledger)
 
+    delete_ledgers(deletable)
+    deleted_count = len(deletable)
     db.session.commit()
 
     if failed_ledgers:
@@ -863,34 +863,19 @@ def batch_submit_ledgers():
         flash("请选择要提交的合集")
         return redirect(url_for("valves.my_ledgers"))
 
-    submitted_count = 0
-    failed_ledgers = []
-
-    for ledger_id in ledger_ids:
-        ledger = Ledger.query.get(int(ledger_id))
-        if not ledger:
-            continue
-
-        if not can_edit_ledger(ledger):
-            failed_ledgers.append(ledger.名称)
-            continue
-
-        draft_valves = Valve.query.filter_by(ledger_id=ledger.id, status="draft").all()
-        if not draft_valves:
-            continue
-
-        for valve in draft_valves:
-            valve.status = "pending"
-            log = ApprovalLog(
-                ledger_id=ledger.id,
-                valve_id=valve.id,
-                action="submit",
-                user_id=current_user.id,
-            )
-            db.session.add(log)
-
-        update_ledger_status(ledger)
-        submitted_count += 1
+    ledgers_found, denied = load_permitted(Ledger, ledger_ids, can_edit_ledger)
+    failed_ledgers = [ledger.名称 for ledger in denied]
+
+    # 提交前写入尚在暂存中的自动保存内容
+    flush_drafts(ledger_ids=[ledger.id for ledger in ledgers_found])
+    counts = bulk_transition(
+        [ledger.id for ledger in ledgers_found],
+        "draft",
+        "pending",
+        user_id=current_user.id,
+        action="submit",
+    )
+    submitted_count = len(counts)
 
     db.session.commit()
 
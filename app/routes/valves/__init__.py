@@ -8,10 +8,9 @@ from flask import (
     jsonify,
 )
 from flask_login import login_required, current_user
-from app.models import db, Valve, ApprovalLog, Ledger, ValveAttachment
+from app.models import db, Valve, ApprovalLog, Ledger
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime
-import json
+from sqlalchemy.orm.exc import StaleDataError
 
 from app.routes.valves.permissions import (
     can_edit_valve,
@@ -20,27 +19,47 @@ from app.routes.valves.permissions import (
     require_leader,
     require_edit_permission,
     require_delete_permission,
+    viewable_valve_clause,
 )
 from app.routes.valves.forms import (
     populate_valve_from_form,
+    render_version_conflict,
     process_attachments_create,
     process_attachments_update,
     set_valve_status_after_submit,
     parse_attachments_data,
     create_attachment_from_data,
 )
+from app.services.batch_save import (
+    valve_conflict,
+    valve_fields,
+    version_conflict,
+)
+from app.services.draft_buffer import (
+    accepts_version,
+    apply_draft,
+    buffering_enabled,
+    discard_drafts,
+    draft_due,
+    find_draft,
+    flush_draft,
+    flush_drafts,
+    merge_draft,
+    start_draft,
+)
+from app.services.loading import load_permitted
+from app.services.search import get_search_backend
+from app.services.valve_status import (
+    add_valves,
+    delete_valves,
+    valves_with_maintenance,
+)
 
 valves = Blueprint("valves", __name__)
 
-
-def update_ledger_status(ledger):
-    total = Valve.query.filter_by(ledger_id=ledger.id).count()
-    if total == 0:
-        return
-    approved = Valve.query.filter_by(ledger_id=ledger.id, status="approved").count()
-    if approved == total:
-        ledger.status = "approved"
-        ledger.approved_at = datetime.utcnow()
+SEARCH_API_DEFAULT_LIMIT = 50
+SEARCH_API_MAX_LIMIT = 200
+SEARCH_API_FIELDS = ["位号", "名称", "装置名称", "型号规格", "安装位置及用途"]
 
 
 @valves.route("/valve/check-tag")
@@ -59,6 +78,62 @@ def check_tag():
     return jsonify({"valid": not exists, "message": "位号已存在" if exists else None})
 
 
+@valves.route("/api/valves/search")
+@login_required
+def search_api():
+    """跨合集检索当前用户可见的阀门，按 id 倒序做游标分页"""
+    limit = request.args.get("limit", SEARCH_API_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, SEARCH_API_MAX_LIMIT))
+    after = request.args.get("after", type=int)
+
+    columns = [getattr(Valve, name) for name in SEARCH_API_FIELDS]
+    query = (
+        db.session.query(
+            Valve.id, Valve.ledger_id, Valve.status, Ledger.名称, *columns
+        )
+        .join(Ledger, Ledger.id == Valve.ledger_id)
+        .filter(viewable_valve_clause())
+    )
+
+    q = request.args.get("q", "").strip()
+    if q:
+        query, _ = get_search_backend().apply(query, q)
+
+    ledger_id = request.args.get("ledger_id", type=int)
+    if ledger_id:
+        query = query.filter(Valve.ledger_id == ledger_id)
+
+    status = request.args.get("status")
+    if status:
+        query = query.filter(Valve.status == status)
+
+    if after:
+        query = query.filter(Valve.id < after)
+
+    rows = query.order_by(Valve.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for row in rows:
+        valve_id, row_ledger_id, row_status, ledger_name, *values = row
+        item = {
+            "id": valve_id,
+            "ledger_id": row_ledger_id,
+            "ledger": ledger_name,
+            "status": row_status,
+        }
+        item.update(zip(SEARCH_API_FIELDS, values))
+        items.append(item)
+
+    return jsonify(
+        {
+            "items": items,
+            "next_cursor": rows[-1][0] if has_more else None,
+        }
+    )
+
+
 @valves.route("/valves")
 @login_required
 def list():
@@ -85,6 +160,7 @@ def new():
             valve = Valve.query.get(valve_id)
             if valve and can_edit_valve(valve):
                 populate_valve_from_form(valve, request.form)
+                discard_drafts(valve.id, current_user.id)
                 db.session.commit()
             else:
                 flash("台账不存在或无权编辑")
@@ -106,6 +182,7 @@ def new():
 
             try:
                 db.session.add(valve)
+                add_valves([valve])
                 db.session.commit()
             except IntegrityError:
                 db.session.rollback()
@@ -115,10 +192,11 @@ def new():
                     Valve.created_by == current_user.id,
                 ).first()
                 if draft:
-                    db.session.delete(draft)
+                    delete_valves([draft])
                     db.session.commit()
                     try:
                         db.session.add(valve)
+                        add_valves([valve])
                         db.session.commit()
                     except IntegrityError:
                         db.session.rollback()
@@ -147,15 +225,44 @@ def new():
     return render_template("valves/form.html", valve=None)
 
 
+def _draft_conflict(valve, base_version):
+    """草稿保存时行版本号冲突，返回 409 及库中当前值"""
+    conflict = valve_conflict(valve, base_version)
+    message = "该台账已被其他用户修改"
+    return jsonify({"success": False, "message": message, "conflicts": [conflict]}), 409
+
+
 @valves.route("/valve/draft/save", methods=["POST"])
 @login_required
 def save_draft():
+    """自动保存草稿
+
+    已有阀门的自动保存先合并进暂存表（见 app.services.draft_buffer），返回
+    result="buffered"；距首次暂存超过 DRAFT_FLUSH_SECONDS 秒或请求带 flush 时才写入
+    阀门。新建草稿直接写入，以便返回阀门 ID。
+    """
     data = request.get_json()
     if not data:
         return jsonify({"success": False, "message": "无效数据"})
 
     valve_id = data.get("valve_id")
     ledger_id = data.get("ledger_id")
+    base_version = data.get("version")
+    form_data = valve_fields(data.get("formData"))
+    attachments = data.get("attachments")
+    buffered = buffering_enabled() and not data.get("flush")
+    created = False
+
+    entry = find_draft(current_user.id, valve_id) if valve_id else None
+    if entry is not None and accepts_version(entry, base_version):
+        # 暂存行创建时已校验过权限和版本号，连续的自动保存不再读取阀门
+        merge_draft(entry, form_data, attachments)
+        if buffered and not draft_due(entry):
+            return _draft_buffered(entry)
+    elif entry is not None:
+        # 客户端已按更新的版本号重新打开表单，旧的暂存作废
+        db.session.delete(entry)
+        entry = None
 
     if valve_id:
         valve = Valve.query.get(valve_id)
@@ -163,6 +270,15 @@ def save_draft():
             return jsonify({"success": False, "message": "台账不存在"})
         if not can_edit_valve(valve):
             return jsonify({"success": False, "message": "无权编辑"})
+        if version_conflict(valve, base_version):
+            if entry is not None:
+                # 暂存期间阀门已被其他人修改，暂存的内容不再写入
+                db.session.delete(entry)
+                db.session.commit()
+            return _draft_conflict(valve, base_version)
+        if entry is None and buffered:
+            entry = start_draft(current_user.id, valve, form_data, attachments)
+            return _draft_buffered(entry)
     else:
         if ledger_id:
             valve = Valve.query.filter_by(
@@ -174,81 +290,57 @@ def save_draft():
                 valve.status = "draft"
                 valve.ledger_id = ledger_id
                 db.session.add(valve)
+                add_valves([valve])
                 db.session.flush()
+                created = True
         else:
             valve = Valve()
             valve.created_by = current_user.id
             valve.status = "draft"
             db.session.add(valve)
+            add_valves([valve])
             db.session.flush()
+            created = True
 
-    for key, value in data.get("formData", {}).items():
-        if key == "ledger_id":
-            continue
-        if hasattr(valve, key):
-            setattr(valve, key, value)
+    # 只写入与库中值不同的字段，没有变化时不刷新 updated_at
+    if entry is not None:
+        changed = flush_draft(entry, valve)
+    else:
+        changed = apply_draft(valve, form_data, attachments)
+    if created:
+        result = "created"
+    else:
+        result = "updated" if changed else "unchanged"
 
-    db.session.flush()
+    try:
+        flush_drafts(due_only=True)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        db.session.refresh(valve)
+        return _draft_conflict(valve, base_version)
+    return jsonify(
+        {
+            "success": True,
+            "valve_id": valve.id,
+            "result": result,
+            "version": valve.version,
+        }
+    )
 
-    attachments_json = data.get("attachments")
-    if attachments_json:
-        try:
-            attachments = json.loads(attachments_json)
-            existing_ids = {att.id for att in valve.attachments}
-            submitted_ids = set()
-            for att in attachments:
-                att_type = att.get("attachment_type") or att.get("type")
-                if not att_type:
-                    continue
-                att_id = att.get("id")
-                if att_id:
-                    attachment = ValveAttachment.query.filter(
-                        ValveAttachment.id == att_id,
-                        ValveAttachment.valve_id == valve.id,
-                    ).first()
-                    if attachment:
-                        attachment.type = att_type
-                        attachment.名称 = att.get("name") or att.get("名称", "")
-                        attachment.设备等级 = att.get("device_grade") or att.get(
-                            "设备等级", ""
-                        )
-                        attachment.型号规格 = att.get("model") or att.get(
-                            "型号规格", ""
-                        )
-                        attachment.生产厂家 = att.get("manufacturer") or att.get(
-                            "生产厂家", ""
-                        )
-                        submitted_ids.add(att_id)
-                else:
-                    att_type = att.get("attachment_type") or att.get("type")
-                    att_name = att.get("name") or att.get("名称", "")
-                    att_grade = att.get("device_grade") or att.get("设备等级", "")
-                    att_model = att.get("model") or att.get("型号规格", "")
-                    att_manufacturer = att.get("manufacturer") or att.get(
-                        "生产厂家", ""
-                    )
-                    if att_type:
-                        attachment = ValveAttachment(
-                            valve_id=valve.id,
-                            type=att_type,
-                            名称=att_name,
-                            设备等级=att_grade,
-                            型号规格=att_model,
-                            生产厂家=att_manufacturer,
-                        )
-                        db.session.add(attachment)
-            for att_id in existing_ids - submitted_ids:
-                attachment = ValveAttachment.query.filter(
-                    ValveAttachment.id == att_id,
-                    ValveAttachment.valve_id == valve.id,
-                ).first()
-                if attachment:
-                    db.session.delete(attachment)
-        except json.JSONDecodeError:
-            pass
 
+def _draft_buffered(entry):
+    # 顺带写入其他已到期、但之后没有再自动保存的暂存行
+    flush_drafts(due_only=True)
     db.session.commit()
-    return jsonify({"success": True, "valve_id": valve.id})
+    return jsonify(
+        {
+            "success": True,
+            "valve_id": entry.valve_id,
+            "result": "buffered",
+            "version": entry.base_version,
+        }
+    )
 
 
 @valves.route("/valve/edit/<int:id>", methods=["GET", "POST"])
@@ -262,6 +354,8 @@ def edit(id):
         return redirect(url_for("valves.detail", id=id))
 
     if request.method == "POST":
+        if version_conflict(valve, request.form.get("version")):
+            return render_version_conflict(valve)
         位号 = request.form.get("位号")
         if 位号:
             existing = Valve.query.filter(
@@ -272,13 +366,20 @@ def edit(id):
                 return redirect(url_for("valves.edit", id=id))
 
         populate_valve_from_form(valve, request.form)
+        discard_drafts(valve.id, current_user.id)
 
         process_attachments_update(db, valve, request.form.get("attachments"))
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            return render_version_conflict(valve)
 
         flash("保存成功")
         return redirect(url_for("valves.detail", id=id))
 
+    # 先写入本人尚未写入的自动保存内容，表单显示最新值
+    flush_drafts(valve_ids=[id], user_id=current_user.id)
+    db.session.commit()
     return render_template("valves/form.html", valve=valve)
 
 
@@ -292,7 +393,11 @@ def delete(id):
         flash(error)
         return redirect(url_for("valves.detail", id=id))
 
-    db.session.delete(valve)
+    if valves_with_maintenance([valve.id]):
+        flash("该台账有检修记录，无法删除")
+        return redirect(url_for("valves.detail", id=id))
+
+    delete_valves([valve])
     db.session.commit()
     flash("删除成功")
     return redirect(url_for("valves.list"))
@@ -306,15 +411,17 @@ def batch_delete():
         flash("请选择要删除的记录")
         return redirect(url_for("valves.list"))
 
-    count = 0
-    for id in ids:
-        valve = Valve.query.get(int(id))
-        if valve and valve.status in ["draft", "rejected"] and can_delete_valve(valve):
-            ApprovalLog.query.filter_by(valve_id=valve.id).delete()
-            db.session.delete(valve)
-            count += 1
+    deletable, _ = load_permitted(
+        Valve, ids, can_delete_valve, Valve.status.in_(["draft", "rejected"])
+    )
+    kept = valves_with_maintenance([valve.id for valve in deletable])
+    deletable = [valve for valve in deletable if valve.id not in kept]
+    delete_valves(deletable)
+    count = len(deletable)
 
     db.session.commit()
+    if kept:
+        flash(f"{len(kept)} 条记录有检修记录，未删除")
     flash(f"成功删除 {count} 条记录")
     return redirect(url_for("valves.list"))
 
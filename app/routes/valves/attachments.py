@@ -9,7 +9,12 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from app.models import db, Valve, ValveAttachment, ValvePhoto, MaintenanceRecord
+from app.routes.jobs import job_response
+from app.routes.valves.exports import XLSX_MIMETYPE
 from app.routes.valves.permissions import can_edit_valve
+from app.services.dashboard import invalidate_dashboard
+from app.services.jobs import job_handler, submit_job
+from app.services.valve_status import ledger_display_status
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
@@ -77,6 +82,7 @@ def maintenance(id):
             created_by=current_user.id,
         )
         db.session.add(record)
+        invalidate_dashboard()
         db.session.commit()
         flash("添加成功")
         return redirect(url_for("valves.maintenance", id=id))
@@ -148,6 +154,7 @@ def maintenance_create():
             created_by=current_user.id,
         )
         db.session.add(record)
+        invalidate_dashboard()
         db.session.commit()
         flash("添加成功")
         return redirect(url_for("valves.maintenance_list"))
@@ -202,17 +209,16 @@ def maintenance_batch_delete():
     count = MaintenanceRecord.query.filter(MaintenanceRecord.id.in_(ids)).delete(
         synchronize_session=False
     )
+    invalidate_dashboard()
     db.session.commit()
     flash(f"成功删除 {count} 条记录")
     return redirect(url_for("valves.maintenance_list"))
 
 
-def maintenance_export():
-    """导出维护记录"""
+def write_maintenance_export(target, ids=None):
+    """导出维护记录 Excel 到 target（文件路径或文件对象）"""
     import pandas as pd
-    from io import BytesIO
 
-    ids = request.args.getlist("ids")
     if ids:
         records = MaintenanceRecord.query.filter(MaintenanceRecord.id.in_(ids)).all()
     else:
@@ -234,15 +240,31 @@ def maintenance_export():
     ]
 
     df = pd.DataFrame(data)
+    df.to_excel(target, index=False, engine="openpyxl")
+
+
+@job_handler("maintenance_export")
+def run_maintenance_export_job(ctx, ids=None):
+    write_maintenance_export(ctx.result_path, ids)
+    return {"filename": "maintenance.xlsx", "mimetype": XLSX_MIMETYPE}
+
+
+def maintenance_export():
+    """导出维护记录，async=1 时提交后台任务并立即返回任务状态"""
+    from io import BytesIO
+
+    ids = request.args.getlist("ids")
+    if request.args.get("async") in ("1", "true"):
+        job = submit_job("maintenance_export", current_user.id, {"ids": ids})
+        return job_response(job, 202)
+
     buffer = BytesIO()
-    df.to_excel(buffer, index=False, engine="openpyxl")
+    write_maintenance_export(buffer, ids)
     buffer.seek(0)
 
     output = make_response(buffer.read())
     output.headers["Content-Disposition"] = "attachment; filename=maintenance.xlsx"
-    output.headers["Content-Type"] = (
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    output.headers["Content-Type"] = XLSX_MIMETYPE
     return output
 
 
@@ -304,31 +326,7 @@ def my_ledgers():
     ledgers_list = query.order_by(Ledger.created_at.desc()).all()
 
     for ledger in ledgers_list:
-        ledger.valve_count = Valve.query.filter_by(ledger_id=ledger.id).count()
-        ledger.pending_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="pending"
-        ).count()
-        ledger.rejected_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="rejected"
-        ).count()
-        ledger.approved_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="approved"
-        ).count()
-        ledger.draft_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="draft"
-        ).count()
-
-        if ledger.pending_count > 0:
-            ledger.display_status = "pending"
-        elif ledger.rejected_count > 0:
-            ledger.display_status = "rejected"
-        elif ledger.approved_count > 0 and ledger.approved_count == ledger.valve_count:
-            ledger.display_status = "approved"
-        elif ledger.valve_count > 0:
-            ledger.display_status = "draft"
-        else:
-            ledger.display_status = "draft"
-
+        ledger.display_status = ledger_display_status(ledger)
         ledger.can_edit = True
 
     return render_template("valves/my_ledgers.html", ledgers=ledgers_list)
@@ -338,18 +336,12 @@ def my_ledger_applications():
     """我的审批申请 - 按合集显示"""
     from app.models import Ledger
 
-    ledgers = (
-        Ledger.query.join(Valve, Ledger.id == Valve.ledger_id)
-        .filter(Ledger.created_by == current_user.id, Valve.status == "pending")
-        .distinct()
-        .all()
-    )
+    ledgers = Ledger.query.filter(
+        Ledger.created_by == current_user.id, Ledger.pending_count > 0
+    ).all()
 
     for ledger in ledgers:
-        ledger.pending_count = Valve.query.filter_by(
-            ledger_id=ledger.id, status="pending"
-        ).count()
-        ledger.total_count = Valve.query.filter_by(ledger_id=ledger.id).count()
+        ledger.total_count = ledger.valve_count
 
     return render_template("valves/my_ledger_applications.html", ledgers=ledgers)
 
@@ -1,246 +1,402 @@
-from flask import flash, redirect, url_for, request, render_template, make_response
+from flask import (
+    flash,
+    redirect,
+    url_for,
+    request,
+    render_template,
+    jsonify,
+    Response,
+    send_file,
+    stream_with_context,
+)
 from flask_login import login_required, current_user
-from app.models import db, Valve, Ledger, Setting
-from app.routes.valves.permissions import require_leader
-from app.routes.valves.forms import IMPORT_COLUMN_MAP, get_valve_export_data
-from datetime import datetime
-from io import BytesIO
-import pandas as pd
-
-
-def update_ledger_status(ledger):
-    total = Valve.query.filter_by(ledger_id=ledger.id).count()
-    if total == 0:
-        return
-    approved = Valve.query.filter_by(ledger_id=ledger.id, status="approved").count()
-    if approved == total:
-        ledger.status = "approved"
-        ledger.approved_at = datetime.utcnow()
+from app.models import db, Valve, Ledger, Setting, VALVE_FIELD_NAMES
+from sqlalchemy import select
+from werkzeug.datastructures import MultiDict
+from app.routes.valves.permissions import can_open_ledger_detail, require_leader
+from app.routes.jobs import job_response
+from app.routes.valves.forms import VALVE_EXPORT_COLUMNS
+from app.services.importer import (
+    CONFLICT_MODES,
+    ImportNotFound,
+    discard_import,
+    execute_import,
+    load_manifest,
+    load_progress,
+    stage_workbook,
+)
+from app.services.export_cache import (
+    cached_export,
+    export_cache_key,
+    export_cacheable,
+)
+from app.services.jobs import job_handler, submit_job
+from app.services.loading import chunked, parse_ids
+from app.services.pdf_export import (
+    PDF_MIMETYPES,
+    PDF_MODES,
+    cached_valve_pdf,
+    pdf_cache_key,
+    require_weasyprint,
+    write_pdf_batch,
+)
+from app.services.valve_query import DETAIL_FILTER_ARGS, filtered_detail_query
+from app.services.export_formats import (
+    EXPORT_FORMATS,
+    ExportFormatUnavailable,
+    require_pyarrow,
+    stream_export,
+    write_export,
+)
+from zipfile import BadZipFile
+from openpyxl.utils.exceptions import InvalidFileException
+
+
+XLSX_MIMETYPE = EXPORT_FORMATS["xlsx"][0]
+# 流式导出时每次从数据库读取的行数
+EXPORT_BATCH_SIZE = 1000
+
+
+def _wants_json():
+    accept = request.accept_mimetypes
+    return accept.best == "application/json"
+
+
+def _async_requested():
+    return request.values.get("async") in ("1", "true")
 
 
 def import_data():
-    """导入数据路由"""
+    """导入数据路由：上传后流式解析并暂存，返回预览"""
     if request.method == "POST":
-        if "file" not in request.files:
+        file = request.files.get("file")
+        if not file or file.filename == "":
+            if request.form.get("action") == "preview":
+                return jsonify({"error": "请选择文件"})
             flash("请选择文件")
             return redirect(request.url)
 
-        file = request.files["file"]
-        if file.filename == "":
-            flash("请选择文件")
+        try:
+            manifest = stage_workbook(file.stream, file.filename, current_user.id)
+        except (InvalidFileException, BadZipFile, KeyError, ValueError):
+            if request.form.get("action") == "preview":
+                return jsonify({"error": "无法读取文件，请上传 .xlsx 格式的 Excel 文件"})
+            flash("无法读取文件，请上传 .xlsx 格式的 Excel 文件")
             return redirect(request.url)
 
-        if file:
-            df = pd.read_excel(file)
-            conflicts = []
-            new_records = []
-
-            for _, row in df.iterrows():
-                if pd.isna(row.get("位号")):
-                    continue
-
-                existing = Valve.query.filter_by(位号=row["位号"]).first()
-                if existing:
-                    conflicts.append(
-                        {
-                            "位号": row["位号"],
-                            "existing_id": existing.id,
-                            "existing_name": existing.名称,
-                            "new_data": row.to_dict(),
-                        }
-                    )
-                else:
-                    new_records.append(row.to_dict())
-
-            from flask import session
-
-            session["import_preview"] = {
-                "conflicts": conflicts,
-                "new_records": new_records,
-                "filename": file.filename,
-                "column_map": IMPORT_COLUMN_MAP,
-            }
-
-            return render_template(
-                "valves/import_preview.html",
-                conflicts=conflicts,
-                new_records=new_records,
-                total=len(conflicts) + len(new_records),
+        if request.form.get("action") == "preview":
+            return jsonify(
+                {
+                    "import_id": manifest["import_id"],
+                    "preview": manifest["samples"],
+                    "total_count": manifest["total"],
+                    "conflict_count": manifest["conflict_count"],
+                    "duplicate_count": manifest["duplicate_count"],
+                }
             )
 
+        return render_template(
+            "valves/import_preview.html",
+            import_id=manifest["import_id"],
+            conflicts=manifest["conflicts"],
+            conflict_count=manifest["conflict_count"],
+            new_count=manifest["new_count"],
+            duplicate_count=manifest["duplicate_count"],
+            total=manifest["total"],
+        )
+
     return render_template("valves/import.html")
 
 
-def import_execute():
-    """执行导入"""
-    from flask import session
-    from app.models import Setting, ApprovalLog
+def _import_message(result):
+    if result["cancelled"]:
+        return "存在位号冲突，已取消导入"
+    return (
+        f"成功导入 {result['new_count']} 条新记录，"
+        f"更新 {result['update_count']} 条现有记录"
+    )
+
+
+@job_handler("valve_import")
+def run_import_job(ctx, import_id, conflict_mode, auto_approve=False):
+    """后台执行导入，每处理一块更新一次任务进度"""
+    result = execute_import(
+        import_id,
+        conflict_mode,
+        ctx.user_id,
+        auto_approve=auto_approve,
+        on_progress=ctx.progress,
+    )
+    discard_import(import_id)
+    return dict(result, message=_import_message(result))
+
 
+def import_execute():
+    """执行导入，async=1 时提交后台任务并立即返回任务状态"""
     conflict_mode = request.form.get("conflict_mode", "cancel")
-    preview = session.get("import_preview")
+    if conflict_mode not in CONFLICT_MODES:
+        conflict_mode = "cancel"
+    import_id = request.form.get("import_id", "")
 
-    if not preview:
+    setting = Setting.query.get("auto_approval")
+    auto_approve = bool(setting and setting.value == "true")
+    try:
+        if _async_requested():
+            load_manifest(import_id, current_user.id)
+            job = submit_job(
+                "valve_import",
+                current_user.id,
+                {
+                    "import_id": import_id,
+                    "conflict_mode": conflict_mode,
+                    "auto_approve": auto_approve,
+                },
+            )
+            return job_response(job, 202)
+
+        result = execute_import(
+            import_id, conflict_mode, current_user.id, auto_approve=auto_approve
+        )
+    except ImportNotFound:
+        if _wants_json():
+            return jsonify({"success": False, "error": "请先上传文件预览"}), 404
         flash("请先上传文件预览")
         return redirect(url_for("valves.import_data"))
 
-    new_count = 0
-    update_count = 0
+    if not result["cancelled"]:
+        db.session.commit()
+    discard_import(import_id)
+    message = _import_message(result)
+
+    if _wants_json():
+        return jsonify(dict(result, success=not result["cancelled"], message=message))
+    flash(message)
+    return redirect(url_for("valves.list"))
+
 
-    for record in preview["new_records"]:
-        valve = Valve()
-        for key, value in record.items():
-            if hasattr(valve, key) and pd.notna(value):
-                setattr(valve, key, str(value))
+def import_progress(import_id):
+    """查询导入进度"""
+    try:
+        progress = load_progress(import_id, current_user.id)
+    except ImportNotFound:
+        return jsonify({"error": "导入不存在或已结束"}), 404
+    return jsonify(progress)
+
+
+def parse_export_columns(values):
+    """解析 columns 参数（逗号分隔或重复参数），未指定时返回默认导出列"""
+    columns = [
+        name.strip() for value in values for name in value.split(",") if name.strip()
+    ]
+    if not columns:
+        return list(VALVE_EXPORT_COLUMNS)
+    unknown = [name for name in columns if name not in VALVE_FIELD_NAMES]
+    if unknown:
+        raise ValueError(f"未知的导出列: {', '.join(unknown)}")
+    return list(dict.fromkeys(columns))
+
+
+def iter_valve_export_rows(
+    ids=None, columns=VALVE_EXPORT_COLUMNS, ledger_id=None, filters=None
+):
+    """只查询导出列并逐行读取，不加载 ORM 对象，每次从数据库取 EXPORT_BATCH_SIZE 行
+
+    指定 ledger_id 时按详情页的筛选条件 filters（{参数名: [值, ...]}）导出该合集，
+    顺序与详情页一致；否则导出 ids 指定的阀门，都未指定时导出全部已审批。
+    """
+    selected = [getattr(Valve, name) for name in columns]
+    if ledger_id:
+        ledger = db.session.get(Ledger, ledger_id)
+        args = MultiDict(filters or {})
+        query, _ = filtered_detail_query(ledger, args.get("from", "all"), args)
+        statements = [query.with_entities(*selected).statement]
+    elif ids:
+        statements = (
+            select(*selected).where(Valve.id.in_(chunk)).order_by(Valve.id)
+            for chunk in chunked(parse_ids(ids))
+        )
+    else:
+        statements = [
+            select(*selected).where(Valve.status == "approved").order_by(Valve.id)
+        ]
+    for statement in statements:
+        result = db.session.execute(
+            statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        for row in result:
+            yield tuple(row)
 
-        valve.created_by = current_user.id
 
-        auto_approve = Setting.query.get("auto_approval")
-        if auto_approve and auto_approve.value == "true":
-            valve.status = "approved"
-            valve.approved_by = current_user.id
-            valve.approved_at = datetime.utcnow()
-        else:
-            valve.status = "approved"
+def write_valve_export(
+    path, ids=None, fmt="xlsx", columns=None, ledger_id=None, filters=None
+):
+    """导出阀门台账到文件，参数同 iter_valve_export_rows()"""
+    columns = columns or VALVE_EXPORT_COLUMNS
+    rows = iter_valve_export_rows(ids, columns, ledger_id, filters)
+    write_export(path, fmt, columns, rows)
 
-        db.session.add(valve)
-        new_count += 1
 
-    if conflict_mode == "overwrite":
-        for conflict in preview["conflicts"]:
-            existing = Valve.query.get(conflict["existing_id"])
-            for key, value in conflict["new_data"].items():
-                if hasattr(existing, key) and pd.notna(value):
-                    setattr(existing, key, str(value))
-            update_count += 1
+@job_handler("valve_export")
+def run_export_job(
+    ctx, ids=None, fmt="xlsx", columns=None, ledger_id=None, filters=None
+):
+    write_valve_export(ctx.result_path, ids, fmt, columns, ledger_id, filters)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return {"filename": f"valves.{extension}", "mimetype": mimetype}
 
-    db.session.commit()
-    session.pop("import_preview", None)
 
-    flash(f"成功导入 {new_count} 条新记录，更新 {update_count} 条现有记录")
+def _export_error(message):
+    if _wants_json():
+        return jsonify({"error": message}), 400
+    flash(message)
     return redirect(url_for("valves.list"))
 
 
+def _not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _cached_file_response(path, etag, mimetype, download_name):
+    """发送缓存文件，浏览器每次凭 ETag 重新验证"""
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        etag=etag,
+        conditional=True,
+        max_age=0,
+    )
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 def export_data():
-    """导出数据"""
-    ids = request.args.getlist("ids")
-    if ids:
-        valves = Valve.query.filter(Valve.id.in_(ids)).all()
-    else:
-        valves = Valve.query.filter_by(status="approved").all()
+    """流式导出数据，支持 format=xlsx|csv|parquet 与 columns 列投影
 
-    data = [get_valve_export_data(v) for v in valves]
-    df = pd.DataFrame(data)
+    ledger_id 加上详情页的筛选参数（from、status、search 及表头列筛选）时导出该合集
+    在详情页中可见的阀门，无需传递 ids。async=1 时提交后台任务并立即返回任务状态。
+    """
+    ids = request.args.getlist("ids")
+    fmt = request.args.get("format", "xlsx")
+    if fmt not in EXPORT_FORMATS:
+        return _export_error(f"不支持的导出格式: {fmt}")
+
+    ledger_id = request.args.get("ledger_id", type=int)
+    filters = None
+    if ledger_id:
+        ledger = Ledger.query.get_or_404(ledger_id)
+        if not can_open_ledger_detail(ledger, request.args.get("from", "all")):
+            return _export_error("无权访问")
+        filters = {
+            key: request.args.getlist(key)
+            for key in DETAIL_FILTER_ARGS
+            if key in request.args
+        }
 
-    buffer = BytesIO()
-    df.to_excel(buffer, index=False, engine="openpyxl")
-    buffer.seek(0)
+    try:
+        columns = parse_export_columns(request.args.getlist("columns"))
+        if _async_requested():
+            if fmt == "parquet":
+                require_pyarrow()
+            params = {"ids": ids, "fmt": fmt, "columns": columns}
+            params.update(ledger_id=ledger_id, filters=filters)
+            job = submit_job("valve_export", current_user.id, params)
+            return job_response(job, 202)
+        rows = iter_valve_export_rows(ids, columns, ledger_id, filters)
+        stream = stream_export(fmt, columns, rows)
+    except (ValueError, ExportFormatUnavailable) as e:
+        return _export_error(str(e))
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    if ledger_id and export_cacheable(ledger, filters):
+        # 已审批合集的快照导出缓存到磁盘，内容未变化时浏览器凭 ETag 得到 304
+        etag = export_cache_key(ledger, fmt, columns, filters)
+        if etag in request.if_none_match:
+            return _not_modified(etag)
+        path = cached_export(
+            etag,
+            extension,
+            lambda target: write_valve_export(
+                target, fmt=fmt, columns=columns, ledger_id=ledger_id, filters=filters
+            ),
+        )
+        return _cached_file_response(path, etag, mimetype, f"valves.{extension}")
 
-    output = make_response(buffer.read())
-    output.headers["Content-Disposition"] = "attachment; filename=valves.xlsx"
-    output.headers["Content-Type"] = (
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return Response(
+        stream_with_context(stream),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=valves.{extension}"},
     )
-    return output
 
 
 def export_valve_pdf(id):
-    """导出单个台账为PDF"""
+    """导出单个台账为PDF，排版结果按阀门内容缓存，ETag 未变时返回 304"""
     valve = Valve.query.get_or_404(id)
+    etag = pdf_cache_key(valve)
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+    try:
+        require_weasyprint()
+    except ExportFormatUnavailable as e:
+        flash(str(e))
+        return redirect(url_for("valves.detail", id=id))
+
+    path = cached_valve_pdf(valve, etag)
+    return _cached_file_response(
+        path, etag, "application/pdf", f"valve_{valve.位号}.pdf"
+    )
+
+
+@job_handler("valve_pdf_batch")
+def run_pdf_batch_job(ctx, mode="merged", ids=None, ledger_id=None, filters=None):
+    rows = iter_valve_export_rows(ids, VALVE_FIELD_NAMES, ledger_id, filters)
+    valves = [dict(zip(VALVE_FIELD_NAMES, row)) for row in rows]
+    write_pdf_batch(ctx.result_path, valves, mode, ctx.progress)
+    extension = "pdf" if mode == "merged" else "zip"
+    return {
+        "filename": f"valves.{extension}",
+        "mimetype": PDF_MIMETYPES[mode],
+        "count": len(valves),
+        "message": f"已导出 {len(valves)} 个阀门的PDF",
+    }
+
 
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>台账详情 - {valve.位号}</title>
-        <style>
-            body {{ font-family: SimSun, serif; padding: 20px; }}
-            h1 {{ text-align: center; color: #333; }}
-            table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-            th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-            th {{ background-color: #f5f5f5; }}
-            .section {{ margin: 20px 0; }}
-            .section-title {{ background-color: #4a90d9; color: white; padding: 10px; font-weight: bold; }}
-        </style>
-    </head>
-    <body>
-        <h1>仪表阀门台账</h1>
-        
-        <div class="section">
-            <div class="section-title">基本信息</div>
-            <table>
-                <tr><th>位号</th><td>{valve.位号 or ""}</td><th>名称</th><td>{valve.名称 or ""}</td></tr>
-                <tr><th>装置名称</th><td>{valve.装置名称 or ""}</td><th>设备等级</th><td>{valve.设备等级 or ""}</td></tr>
-                <tr><th>型号规格</th><td>{valve.型号规格 or ""}</td><th>生产厂家</th><td>{valve.生产厂家 or ""}</td></tr>
-                <tr><th>安装位置</th><td colspan="3">{valve.安装位置及用途 or ""}</td></tr>
-                <tr><th>设备编号</th><td>{valve.设备编号 or ""}</td><th>是否联锁</th><td>{valve.是否联锁 or ""}</td></tr>
-            </table>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">工艺条件</div>
-            <table>
-                <tr><th>介质名称</th><td>{valve.工艺条件_介质名称 or ""}</td><th>设计温度</th><td>{valve.工艺条件_设计温度 or ""}</td></tr>
-                <tr><th>阀前压力</th><td>{valve.工艺条件_阀前压力 or ""}</td><th>阀后压力</th><td>{valve.工艺条件_阀后压力 or ""}</td></tr>
-            </table>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">阀体信息</div>
-            <table>
-                <tr><th>公称通径</th><td>{valve.阀体_公称通径 or ""}</td><th>连接方式</th><td>{valve.阀体_连接方式及规格 or ""}</td></tr>
-                <tr><th>阀体材质</th><td colspan="3">{valve.阀体_材质 or ""}</td></tr>
-            </table>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">阀内件信息</div>
-            <table>
-                <tr><th>阀座直径</th><td>{valve.阀内件_阀座直径 or ""}</td><th>阀芯材质</th><td>{valve.阀内件_阀芯材质 or ""}</td></tr>
-                <tr><th>阀座材质</th><td>{valve.阀内件_阀座材质 or ""}</td><th>阀杆材质</th><td>{valve.阀内件_阀杆材质 or ""}</td></tr>
-                <tr><th>流量特性</th><td>{valve.阀内件_流量特性 or ""}</td><th>泄露等级</th><td>{valve.阀内件_泄露等级 or ""}</td></tr>
-                <tr><th>Cv值</th><td colspan="3">{valve.阀内件_Cv值 or ""}</td></tr>
-            </table>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">执行机构信息</div>
-            <table>
-                <tr><th>形式</th><td>{valve.执行机构_形式 or ""}</td><th>型号规格</th><td>{valve.执行机构_型号规格 or ""}</td></tr>
-                <tr><th>厂家</th><td>{valve.执行机构_厂家 or ""}</td><th>作用形式</th><td>{valve.执行机构_作用形式 or ""}</td></tr>
-                <tr><th>行程</th><td>{valve.执行机构_行程 or ""}</td><th>弹簧范围</th><td>{valve.执行机构_弹簧范围 or ""}</td></tr>
-                <tr><th>气源压力</th><td>{valve.执行机构_气源压力 or ""}</td><th>故障位置</th><td>{valve.执行机构_故障位置 or ""}</td></tr>
-                <tr><th>关阀时间</th><td>{valve.执行机构_关阀时间 or ""}</td><th>开阀时间</th><td>{valve.执行机构_开阀时间 or ""}</td></tr>
-            </table>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">备注</div>
-            <p>{valve.备注 or "无"}</p>
-        </div>
-        
-        <p style="text-align: right; color: #666; margin-top: 30px;">
-            导出时间：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-        </p>
-    </body>
-    </html>
+def export_pdf_batch():
+    """批量导出PDF，mode=merged（合并为一个文件）或 zip（每个阀门一个文件）
+
+    与 export_data 相同，通过 ids 或 ledger_id 加详情页筛选参数指定阀门。
+    总是提交后台任务，返回任务状态供前端轮询进度。
     """
+    mode = request.args.get("mode", "merged")
+    if mode not in PDF_MODES:
+        return _export_error(f"不支持的PDF导出方式: {mode}")
+    ids = request.args.getlist("ids")
+    ledger_id = request.args.get("ledger_id", type=int)
+    if not ids and not ledger_id:
+        return _export_error("请指定要导出的合集或阀门")
+
+    filters = None
+    if ledger_id:
+        ledger = Ledger.query.get_or_404(ledger_id)
+        if not can_open_ledger_detail(ledger, request.args.get("from", "all")):
+            return _export_error("无权访问")
+        filters = {
+            key: request.args.getlist(key)
+            for key in DETAIL_FILTER_ARGS
+            if key in request.args
+        }
 
     try:
-        from weasyprint import HTML
-
-        pdf_buffer = BytesIO()
-        HTML(string=html).write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
-        output = make_response(pdf_buffer.read())
-        output.headers["Content-Disposition"] = (
-            f"attachment; filename=valve_{valve.位号}.pdf"
-        )
-        output.headers["Content-Type"] = "application/pdf"
-        return output
-    except ImportError:
-        flash("PDF导出需要安装 WeasyPrint: pip install WeasyPrint")
-        return redirect(url_for("valves.detail", id=id))
+        require_weasyprint()
+    except ExportFormatUnavailable as e:
+        return _export_error(str(e))
+    params = {"mode": mode, "ids": ids, "ledger_id": ledger_id, "filters": filters}
+    job = submit_job("valve_pdf_batch", current_user.id, params)
+    return job_response(job, 202)
 
 
 def register_export_routes(bp):
@@ -251,5 +407,9 @@ def register_export_routes(bp):
     bp.route("/import/execute", methods=["POST"])(
         login_required(require_leader(import_execute))
     )
+    bp.route("/import/<import_id>/progress")(
+        login_required(require_leader(import_progress))
+    )
     bp.route("/export")(login_required(export_data))
+    bp.route("/export/pdf")(login_required(export_pdf_batch))
     bp.route("/valve/<int:id>/export-pdf")(login_required(export_valve_pdf))
@@ -1,6 +1,8 @@
 from flask import flash, redirect, url_for
 from flask_login import current_user
 from functools import wraps
+from sqlalchemy import and_, or_, true
+from app.models import Ledger, snapshot_visible_clause
 
 
 def can_edit_valve(valve):
@@ -38,6 +40,33 @@ def can_view_ledger(ledger):
     return False
 
 
+def is_ledger_owner(ledger):
+    """台账创建人及领导、管理员"""
+    return ledger.created_by == current_user.id or current_user.role in [
+        "leader",
+        "admin",
+    ]
+
+
+def can_open_ledger_detail(ledger, from_param):
+    """非“我的合集”入口只允许台账创建人及领导、管理员查看详情"""
+    if not can_view_ledger(ledger):
+        return False
+    return from_param == "mine" or is_ledger_owner(ledger)
+
+
+def viewable_valve_clause():
+    """当前用户可查看的阀门条件（查询需关联 Ledger），与 can_view_ledger 一致"""
+    if current_user.role in ["leader", "admin"]:
+        return true()
+    return or_(
+        Ledger.created_by == current_user.id,
+        and_(
+            Ledger.approved_snapshot_status == "approved", snapshot_visible_clause()
+        ),
+    )
+
+
 def require_leader(f):
     """装饰器：要求领导权限"""
 
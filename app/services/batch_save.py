@@ -0,0 +1,222 @@
+"""合集表格批量保存
+
+save_valve_rows() 以集合方式保存详情页表格提交的行，替代逐行
+``Valve.query.get`` + setattr + flush：
+
+- 按 ID 分块用 ``id IN (...)`` 预取被编辑阀门的状态、字段值和行版本号；
+- 只写入 VALVE_FIELD_NAMES 中的字段，其他键忽略；
+- 提交的字段与库中值逐个比较，只 UPDATE 有变化的列，没有变化的行不写入、
+  不刷新 updated_at，已审批的阀门也不会退回草稿；
+- 新增行用一条 executemany INSERT ... RETURNING 写入，修改行交给
+  update_valves() 按更新列分组、按主键 executemany UPDATE；提交了版本号的行
+  需逐行确认 UPDATE 命中，改为按主键和版本号逐行 UPDATE；
+- 已审批的阀门有修改时退回草稿，写入后重建一次台账计数、刷新一次合集状态。
+
+每行的保存结果为 created / updated / unchanged，客户端据此缩减下次提交的数据。
+行版本号为 Valve.version，提交的行带 "version" 时与库中值比较，不一致（其他人
+已修改）时抛出 VersionConflict，附带各冲突行的当前值，整批不写入。
+
+patch_valve_cells() 是按单元格增量提交的入口：先校验全部单元格（字段、状态、
+行版本号），全部通过才合并为行交给 save_valve_rows()，否则不写入。
+
+批量 SQL 不经过 flush 事件，台账数据版本号在这里递增。
+"""
+
+from sqlalchemy import insert, select
+
+from app.models import db, Valve, VALVE_FIELD_NAMES
+from app.services.loading import chunked, parse_ids
+from app.services.valve_status import (
+    bump_data_version,
+    rebuild_ledger_counters,
+    update_ledger_status,
+    update_valves,
+)
+
+EDITABLE_STATUSES = ("draft", "rejected", "approved")
+
+_field_names = frozenset(VALVE_FIELD_NAMES)
+_prefetch_columns = [Valve.id, Valve.ledger_id, Valve.status, Valve.version] + [
+    getattr(Valve, name) for name in VALVE_FIELD_NAMES
+]
+
+
+def valve_fields(data):
+    """只保留阀门台账字段"""
+    return {key: value for key, value in (data or {}).items() if key in _field_names}
+
+
+def _normalize(value):
+    # 表单把空值提交为 ""，与库中的 NULL 视为相同
+    return "" if value is None else str(value)
+
+
+def changed_fields(current, fields):
+    """返回与 current（阀门对象或查询行）中已存值不同的字段"""
+    return {
+        key: value
+        for key, value in fields.items()
+        if _normalize(getattr(current, key)) != _normalize(value)
+    }
+
+
+class VersionConflict(Exception):
+    """提交的行版本号与库中不一致，conflicts 为各冲突行的当前值"""
+
+    def __init__(self, conflicts):
+        super().__init__("数据已被其他用户修改")
+        self.conflicts = conflicts
+
+
+def valve_conflict(current, base_version):
+    """冲突描述：提交时的版本号、库中当前版本号与字段值，供客户端合并"""
+    return {
+        "id": current.id,
+        "base_version": base_version,
+        "version": current.version,
+        "values": {name: getattr(current, name) for name in VALVE_FIELD_NAMES},
+    }
+
+
+def version_conflict(current, base_version):
+    """提交的版本号与 current 不一致时返回冲突描述，未提交版本号或一致时返回 None"""
+    if base_version in (None, "") or _int_or_none(base_version) == current.version:
+        return None
+    return valve_conflict(current, base_version)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _prefetch(valve_ids):
+    found = {}
+    for chunk in chunked(parse_ids(valve_ids)):
+        rows = db.session.execute(
+            select(*_prefetch_columns).where(Valve.id.in_(chunk))
+        )
+        found.update((row.id, row) for row in rows)
+    return found
+
+
+def save_valve_rows(ledger, items, user_id, found=None):
+    """保存表格行 [{"id": 可选, "version": 可选, "data": {字段: 值}}]，返回 (results, errors)
+
+    results 按提交顺序排列，每项为 {"id", "result", "version"}，result 为
+    created/updated/unchanged，新增行为插入后的 ID。found 为已预取的行。
+    带 "version" 的行版本号不一致时抛出 VersionConflict，不写入任何行。
+    调用方负责提交事务。
+    """
+    if found is None:
+        found = _prefetch(item.get("id") for item in items if item.get("id"))
+
+    results, created = [], []
+    inserts, errors, conflicts = [], [], []
+    # 按阀门 ID 合并同一行的多次提交
+    updates = {}
+    demoted = False
+    for item in items:
+        valve_id = item.get("id")
+        fields = valve_fields(item.get("data"))
+        if valve_id:
+            row = found.get(_int_or_none(valve_id))
+            if row is None or row.ledger_id != ledger.id:
+                errors.append({"id": valve_id, "error": "台账不存在"})
+                continue
+            if row.status not in EDITABLE_STATUSES:
+                errors.append({"id": valve_id, "error": "当前状态无法编辑"})
+                continue
+            conflict = version_conflict(row, item.get("version"))
+            if conflict:
+                conflicts.append(conflict)
+                continue
+            changes = changed_fields(row, fields)
+            if row.id in updates:
+                updates[row.id].update(changes)
+            elif changes:
+                if row.status == "approved":
+                    changes["status"] = "draft"
+                    demoted = True
+                updates[row.id] = dict(changes, id=row.id)
+            if row.id in updates and item.get("version") not in (None, ""):
+                # 写入时再按版本号确认，预取之后其他人提交的修改不会被覆盖
+                updates[row.id]["version"] = row.version
+            if row.id in updates:
+                result, version = "updated", row.version + 1
+            else:
+                result, version = "unchanged", row.version
+            results.append({"id": row.id, "result": result, "version": version})
+        else:
+            values = {name: fields.get(name) for name in VALVE_FIELD_NAMES}
+            values.update(ledger_id=ledger.id, created_by=user_id, status="draft")
+            inserts.append(values)
+            # ID 在插入后回填
+            created.append({"id": None, "result": "created", "version": 1})
+            results.append(created[-1])
+    if conflicts:
+        raise VersionConflict(conflicts)
+
+    # 预取之后其他事务修改过的行在 UPDATE 时匹配不到版本号，其他行的写入随
+    # 调用方回滚一并撤销
+    stale = update_valves(list(updates.values()))
+    if stale:
+        current = _prefetch(stale)
+        raise VersionConflict(
+            [valve_conflict(current[id], updates[id]["version"]) for id in stale]
+        )
+    if inserts:
+        # SQLite 无可靠的 RETURNING 行序，要求按参数排序时会退化为逐行 INSERT；
+        # 新行的 rowid 按插入顺序递增，排序后即与提交顺序对应
+        new_ids = db.session.scalars(
+            insert(Valve).returning(Valve.id).execution_options(render_nulls=True),
+            inserts,
+        ).all()
+        for result, new_id in zip(created, sorted(new_ids)):
+            result["id"] = new_id
+
+    if inserts or demoted:
+        # 计数与状态按数据库重算一次，同时递增数据版本号
+        rebuild_ledger_counters([ledger.id])
+        update_ledger_status(ledger)
+    elif updates:
+        bump_data_version([ledger.id])
+    return results, errors
+
+
+def patch_valve_cells(ledger, patches):
+    """按单元格修改合集中的阀门 [{"id", "field", "value", "base_version"}]
+
+    返回 (results, errors)，有 errors 时不写入，results 为 None。base_version 与行的
+    当前版本号不一致时抛出 VersionConflict。调用方负责提交事务。
+    """
+    found = _prefetch(patch.get("id") for patch in patches)
+    errors, conflicts = [], []
+    rows = {}
+    for patch in patches:
+        valve_id, field = patch.get("id"), patch.get("field")
+        row = found.get(_int_or_none(valve_id))
+        if row is None or row.ledger_id != ledger.id:
+            errors.append({"id": valve_id, "field": field, "error": "台账不存在"})
+        elif field not in _field_names:
+            errors.append({"id": valve_id, "field": field, "error": "未知字段"})
+        elif row.status not in EDITABLE_STATUSES:
+            errors.append({"id": valve_id, "field": field, "error": "当前状态无法编辑"})
+        elif _int_or_none(patch.get("base_version")) != row.version:
+            conflict = valve_conflict(row, patch.get("base_version"))
+            conflicts.append(dict(conflict, field=field))
+        else:
+            rows.setdefault(row.id, {})[field] = patch.get("value")
+    if errors:
+        return None, errors
+    if conflicts:
+        raise VersionConflict(conflicts)
+
+    items = [
+        {"id": valve_id, "version": found[valve_id].version, "data": fields}
+        for valve_id, fields in rows.items()
+    ]
+    results, _ = save_valve_rows(ledger, items, None, found)
+    return results, []
@@ -0,0 +1,103 @@
+"""进程内缓存
+
+TTLCache 为带过期时间的进程内字典缓存，并记录命中/未命中次数。
+写路径调用 invalidate_on_commit() 标记失效，缓存在当前事务提交后才清空，
+避免其他请求在提交前把旧数据重新写回缓存；回滚时不做清理。
+多进程部署时各进程缓存相互独立，过期时间作为兜底。
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import db
+
+CACHES = {}
+
+
+class TTLCache:
+    def __init__(self, name, max_entries=None):
+        self.name = name
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        CACHES[name] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            now = time.monotonic()
+            if self.max_entries and len(self._data) >= self.max_entries:
+                self._evict(now)
+            self._data[key] = (now + ttl, value)
+
+    def _evict(self, now):
+        """先清除已过期条目，仍超出上限时淘汰最早过期的条目"""
+        for key in [k for k, (expires, _) in self._data.items() if expires <= now]:
+            del self._data[key]
+        overflow = len(self._data) - self.max_entries + 1
+        if overflow > 0:
+            oldest = sorted(self._data, key=lambda k: self._data[k][0])[:overflow]
+            for key in oldest:
+                del self._data[key]
+
+    def get_or_set(self, key, factory, ttl):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def invalidate_on_commit(self):
+        """在当前数据库事务提交后清空缓存"""
+        db.session.info.setdefault("clear_caches", set()).add(self.name)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+def cache_stats():
+    """所有已注册缓存（含磁盘文件缓存）的统计信息"""
+    from app.services.disk_cache import DISK_CACHES
+
+    caches = {**CACHES, **DISK_CACHES}
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_caches_after_commit(session):
+    for name in session.info.pop("clear_caches", ()):
+        CACHES[name].clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_invalidations(session):
+    session.info.pop("clear_caches", None)
@@ -0,0 +1,120 @@
+"""首页统计数据
+
+每项统计都是固定数量的聚合查询，查询次数不随台账、阀门或用户数量增长。
+结果按角色（全局统计）和用户（个人统计）缓存，阀门、合集、检修记录
+写入后由 invalidate_dashboard() 在事务提交时清空，DASHBOARD_CACHE_TTL 兜底。
+"""
+
+from flask import current_app
+from sqlalchemy import and_, case, func
+
+from app.models import (
+    db,
+    Ledger,
+    Valve,
+    MaintenanceRecord,
+    User,
+    snapshot_visible_clause,
+)
+from app.services.cache import TTLCache
+
+dashboard_cache = TTLCache("dashboard")
+
+
+def invalidate_dashboard():
+    """标记首页统计缓存在当前事务提交后失效"""
+    dashboard_cache.invalidate_on_commit()
+
+
+def pending_valve_count():
+    """全部待审批阀门数量（缓存）"""
+    return dashboard_cache.get_or_set(
+        ("pending",),
+        lambda: Valve.query.filter_by(status="pending").count(),
+        current_app.config["DASHBOARD_CACHE_TTL"],
+    )
+
+
+def approved_ledger_totals():
+    """已审批合集数量，以及各合集在快照时间点之前已审批的阀门数量之和"""
+    snapshot_valid = and_(Valve.ledger_id == Ledger.id, snapshot_visible_clause())
+    total_ledgers, total_valves = (
+        db.session.query(func.count(func.distinct(Ledger.id)), func.count(Valve.id))
+        .select_from(Ledger)
+        .outerjoin(Valve, snapshot_valid)
+        .filter(Ledger.approved_snapshot_status == "approved")
+        .one()
+    )
+    return total_ledgers, total_valves
+
+
+def user_ledger_totals(user_id):
+    """用户创建的合集数、其中的阀门数、含待审批内容的合集数"""
+    ledger_count, valve_count, pending_ledgers = (
+        db.session.query(
+            func.count(Ledger.id),
+            func.coalesce(func.sum(Ledger.valve_count), 0),
+            func.coalesce(func.sum(case((Ledger.pending_count > 0, 1), else_=0)), 0),
+        )
+        .filter(Ledger.created_by == user_id)
+        .one()
+    )
+    return ledger_count, valve_count, pending_ledgers
+
+
+def valve_counts_by_user():
+    """在用用户各自创建的阀门数量"""
+    rows = (
+        db.session.query(User.real_name, User.username, func.count(Valve.id))
+        .outerjoin(Valve, Valve.created_by == User.id)
+        .filter(User.status == "active")
+        .group_by(User.id)
+        .order_by(User.id)
+        .all()
+    )
+    return [
+        {"username": real_name or username, "count": count}
+        for real_name, username, count in rows
+    ]
+
+
+def _global_stats(is_leader):
+    total_ledgers, total_valves = approved_ledger_totals()
+    stats = {
+        "total_ledgers": total_ledgers,
+        "total_valves": total_valves,
+        "maintenance_count": MaintenanceRecord.query.count(),
+        "user_stats": [],
+    }
+    if is_leader:
+        stats["pending"] = pending_valve_count()
+        stats["user_stats"] = valve_counts_by_user()
+    return stats
+
+
+def _user_stats(user_id):
+    my_ledger_count, my_valve_count, my_pending_ledgers = user_ledger_totals(user_id)
+    return {
+        "my_ledger_count": my_ledger_count,
+        "my_valve_count": my_valve_count,
+        "my_pending_ledgers": my_pending_ledgers,
+    }
+
+
+def build_dashboard_stats(user):
+    """汇总首页模板所需的统计数据"""
+    ttl = current_app.config["DASHBOARD_CACHE_TTL"]
+    is_leader = user.role in ["leader", "admin"]
+    role_key = "leader" if is_leader else "employee"
+
+    stats = dict(
+        dashboard_cache.get_or_set(
+            ("role", role_key), lambda: _global_stats(is_leader), ttl
+        )
+    )
+    stats.update(
+        dashboard_cache.get_or_set(("user", user.id), lambda: _user_stats(user.id), ttl)
+    )
+    if not is_leader:
+        stats["pending"] = stats["my_pending_ledgers"]
+    return stats
@@ -0,0 +1,106 @@
+"""磁盘文件缓存
+
+DiskCache 把生成代价高的文件（台账导出、PDF 数据表）按缓存键保存在目录中，
+缓存键同时用作 HTTP ETag。总大小超过上限时按文件修改时间（命中时刷新）淘汰
+最久未用的文件。目录与大小上限从应用配置读取，记录命中/未命中/淘汰次数。
+"""
+
+import os
+import threading
+import uuid
+
+from flask import current_app
+
+DISK_CACHES = {}
+
+
+class DiskCache:
+    def __init__(self, name, folder_setting, budget_setting):
+        self.name = name
+        self.folder_setting = folder_setting
+        self.budget_setting = budget_setting
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        DISK_CACHES[name] = self
+
+    def folder(self):
+        folder = current_app.config[self.folder_setting]
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def get_or_create(self, key, extension, produce, is_stale=None):
+        """返回缓存文件路径，未命中时调用 produce(path) 生成文件后写入缓存
+
+        is_stale(文件名) 为真的文件已被新文件取代，写入后删除。
+        """
+        folder = self.folder()
+        path = os.path.join(folder, f"{key}.{extension}")
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+                self.counters["hits"] += 1
+                return path
+            except OSError:
+                # 刚被其他请求淘汰，重新生成
+                pass
+
+        self.counters["misses"] += 1
+        tmp_path = os.path.join(folder, f".{uuid.uuid4().hex}.tmp")
+        try:
+            produce(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if is_stale:
+            for name in os.listdir(folder):
+                if is_stale(name) and not name.startswith(key):
+                    _remove(os.path.join(folder, name))
+        self._evict(folder, keep=path)
+        return path
+
+    def _entries(self, folder):
+        entries = []
+        for name in os.listdir(folder):
+            if name.startswith("."):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self, folder, keep):
+        budget = current_app.config[self.budget_setting]
+        with self._lock:
+            entries = self._entries(folder)
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= budget:
+                    break
+                if path != keep:
+                    _remove(path)
+                    self.counters["evictions"] += 1
+                    total -= size
+
+    def stats(self):
+        entries = self._entries(self.folder())
+        hits, misses = self.counters["hits"], self.counters["misses"]
+        total = hits + misses
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "evictions": self.counters["evictions"],
+        }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,207 @@
+"""草稿自动保存暂存
+
+编辑表单在输入停顿 3 秒后自动保存一次。每次都写入 valves 会递增阀门行版本号和
+台账数据版本号（使导出、筛选缓存失效），并重建附件。已有阀门的自动保存改为先写入
+valve_draft_buffers：
+
+- 同一用户、同一阀门只有一行暂存，后到的字段覆盖先前的值，附件列表整体替换；
+- 暂存行创建时由调用方校验编辑权限和行版本号，之后的自动保存只读写暂存行；
+- 距首次暂存超过 DRAFT_FLUSH_SECONDS 秒、客户端要求立即写入（离开页面），或合集
+  提交审批、打开编辑页时，才由 flush_drafts() 一次写入阀门；
+- 写入时阀门的版本号已变化（期间有其他修改）或已不可编辑的暂存行直接丢弃。
+
+表单正式提交时会带上全部字段，调用 discard_drafts() 丢弃暂存即可。
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.models import db, DraftBuffer, Valve, ValveAttachment
+from app.services.batch_save import EDITABLE_STATUSES, changed_fields
+from app.services.loading import load_many
+
+# 附件列与提交数据中的键，兼容英文键与中文列名
+_ATTACHMENT_KEYS = {
+    "type": ("attachment_type", "type"),
+    "名称": ("name", "名称"),
+    "设备等级": ("device_grade", "设备等级"),
+    "型号规格": ("model", "型号规格"),
+    "生产厂家": ("manufacturer", "生产厂家"),
+}
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def buffering_enabled():
+    """DRAFT_FLUSH_SECONDS 为 0 时自动保存直接写入阀门"""
+    return current_app.config.get("DRAFT_FLUSH_SECONDS", 0) > 0
+
+
+def find_draft(user_id, valve_id):
+    """返回用户对该阀门的暂存行，没有时返回 None"""
+    valve_id = _int_or_none(valve_id)
+    if valve_id is None:
+        return None
+    return DraftBuffer.query.filter_by(user_id=user_id, valve_id=valve_id).first()
+
+
+def start_draft(user_id, valve, form_data, attachments):
+    """为已校验过权限与版本号的阀门新建暂存行"""
+    entry = DraftBuffer(
+        user_id=user_id,
+        valve_id=valve.id,
+        base_version=valve.version,
+        form_data=json.dumps(form_data, ensure_ascii=False),
+        attachments=attachments,
+    )
+    db.session.add(entry)
+    return entry
+
+
+def merge_draft(entry, form_data, attachments):
+    """把一次自动保存合并进暂存行"""
+    merged = json.loads(entry.form_data or "{}")
+    merged.update(form_data)
+    entry.form_data = json.dumps(merged, ensure_ascii=False)
+    if attachments:
+        entry.attachments = attachments
+    entry.save_count = (entry.save_count or 0) + 1
+
+
+def accepts_version(entry, version):
+    """客户端提交的版本号与暂存时一致（或未提交）时可继续合并"""
+    return version in (None, "") or _int_or_none(version) == entry.base_version
+
+
+def draft_due(entry):
+    """暂存行是否已到写入时间"""
+    age = datetime.utcnow() - (entry.created_at or datetime.utcnow())
+    return age >= timedelta(seconds=current_app.config["DRAFT_FLUSH_SECONDS"])
+
+
+def _attachment_values(data):
+    return {
+        column: data.get(key) or data.get(alias) or ""
+        for column, (key, alias) in _ATTACHMENT_KEYS.items()
+    }
+
+
+def sync_attachments(valve, attachments_json):
+    """按提交的附件列表（JSON）同步阀门附件，返回是否有修改
+
+    带 id 的附件按 id 更新；不带 id 的先与内容相同的已有附件匹配，匹配不上才新增，
+    避免每次自动保存都删除后重建全部附件。未提交的已有附件删除。
+    """
+    if not attachments_json:
+        return False
+    try:
+        attachments = json.loads(attachments_json)
+    except json.JSONDecodeError:
+        return False
+
+    # 一次加载阀门的全部附件，不逐个查询
+    unmatched = list(valve.attachments)
+    by_id = {attachment.id: attachment for attachment in unmatched}
+    changed = False
+    for data in attachments:
+        values = _attachment_values(data)
+        if not values["type"]:
+            continue
+        attachment = by_id.get(_int_or_none(data.get("id")))
+        if attachment is None or attachment not in unmatched:
+            attachment = next(
+                (
+                    candidate
+                    for candidate in unmatched
+                    if all(
+                        (getattr(candidate, column) or "") == value
+                        for column, value in values.items()
+                    )
+                ),
+                None,
+            )
+        if attachment is None:
+            db.session.add(ValveAttachment(valve_id=valve.id, **values))
+            changed = True
+            continue
+        unmatched.remove(attachment)
+        for column, value in values.items():
+            if (getattr(attachment, column) or "") != value:
+                setattr(attachment, column, value)
+                changed = True
+    for attachment in unmatched:
+        db.session.delete(attachment)
+        changed = True
+    return changed
+
+
+def apply_draft(valve, form_data, attachments):
+    """把草稿字段与附件写入阀门，只修改有变化的字段，返回是否有修改"""
+    changes = changed_fields(valve, form_data)
+    for key, value in changes.items():
+        setattr(valve, key, value)
+    attachments_changed = sync_attachments(valve, attachments)
+    return bool(changes) or attachments_changed
+
+
+def flush_draft(entry, valve):
+    """把暂存行写入阀门并删除暂存行，返回是否有修改"""
+    changed = apply_draft(valve, json.loads(entry.form_data or "{}"), entry.attachments)
+    db.session.delete(entry)
+    return changed
+
+
+def flush_drafts(valve_ids=None, ledger_ids=None, user_id=None, due_only=False):
+    """把符合条件的暂存行写入阀门，返回写入的行数，调用方负责提交事务
+
+    阀门已删除、不可编辑或版本号已变化的暂存行直接丢弃。
+    """
+    query = DraftBuffer.query
+    if valve_ids is not None:
+        query = query.filter(DraftBuffer.valve_id.in_(valve_ids))
+    if ledger_ids is not None:
+        query = query.join(Valve, Valve.id == DraftBuffer.valve_id).filter(
+            Valve.ledger_id.in_(ledger_ids)
+        )
+    if user_id is not None:
+        query = query.filter(DraftBuffer.user_id == user_id)
+    if due_only:
+        seconds = current_app.config["DRAFT_FLUSH_SECONDS"]
+        cutoff = datetime.utcnow() - timedelta(seconds=seconds)
+        query = query.filter(DraftBuffer.created_at <= cutoff)
+
+    entries = query.all()
+    valves = {
+        valve.id: valve
+        for valve in load_many(Valve, [entry.valve_id for entry in entries])
+    }
+    flushed = 0
+    for entry in entries:
+        valve = valves.get(entry.valve_id)
+        if (
+            valve is None
+            or valve.status not in EDITABLE_STATUSES
+            or valve.version != entry.base_version
+        ):
+            db.session.delete(entry)
+            continue
+        if flush_draft(entry, valve):
+            # 立即递增版本号，其他用户对同一阀门的暂存行随后按版本号丢弃
+            db.session.flush()
+        flushed += 1
+    return flushed
+
+
+def discard_drafts(valve_id, user_id=None):
+    """丢弃阀门的暂存行（表单正式提交时已包含全部字段）"""
+    query = DraftBuffer.query.filter_by(valve_id=valve_id)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    query.delete(synchronize_session=False)
@@ -0,0 +1,66 @@
+"""合集导出文件缓存
+
+只缓存已审批合集的快照视图导出（非“我的合集”入口、未按状态筛选），
+仍在编辑中的草稿视图内容变化频繁，直接流式导出，不写入缓存。
+
+按合集导出的文件缓存在 EXPORT_CACHE_FOLDER 中，文件名为
+``l<合集ID>-v<数据版本>-<摘要>.<扩展名>``，摘要由审批快照时间、导出格式、导出列
+和筛选条件计算，同时用作 HTTP ETag。台账内任一阀门写入都会递增 data_version，
+旧版本文件不再命中，并在写入同一合集的新版本时删除。
+
+缓存总大小超过 EXPORT_CACHE_MAX_BYTES 时按最近使用时间淘汰，见 DiskCache。
+"""
+
+import hashlib
+import json
+
+from app.services.disk_cache import DiskCache
+from app.services.valve_query import is_snapshot_view
+
+EXPORT_CACHE = DiskCache(
+    "ledger_export", "EXPORT_CACHE_FOLDER", "EXPORT_CACHE_MAX_BYTES"
+)
+# 命中/未命中次数
+stats = EXPORT_CACHE.counters
+
+
+def export_cacheable(ledger, filters):
+    """合集已审批且导出的是已审批快照时才缓存，filters 为详情页筛选参数"""
+    filters = filters or {}
+    from_param = (filters.get("from") or ["all"])[0]
+    status = (filters.get("status") or [None])[0]
+    return ledger.approved_snapshot_status == "approved" and is_snapshot_view(
+        from_param, status
+    )
+
+
+def export_cache_key(ledger, fmt, columns, filters):
+    """计算缓存键（同时作为 ETag）"""
+    snapshot_at = ledger.approved_snapshot_at
+    # 含创建时间，数据库重建后同 ID、同版本号的合集不会命中旧文件
+    payload = [
+        ledger.id,
+        ledger.data_version or 0,
+        ledger.created_at.isoformat() if ledger.created_at else None,
+        snapshot_at.isoformat() if snapshot_at else None,
+        fmt,
+        list(columns),
+        sorted((key, sorted(values)) for key, values in (filters or {}).items()),
+    ]
+    digest = hashlib.sha256(
+        json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:32]
+    return f"l{ledger.id}-v{ledger.data_version or 0}-{digest}"
+
+
+def cached_export(key, extension, produce):
+    """返回缓存文件路径，未命中时调用 produce(path) 生成文件后写入缓存"""
+    ledger_part, version_part, _ = key.split("-", 2)
+
+    def is_stale(name):
+        # 同一合集的其他数据版本
+        return name.startswith(f"{ledger_part}-v") and not name.startswith(
+            f"{ledger_part}-{version_part}-"
+        )
+
+    return EXPORT_CACHE.get_or_create(key, extension, produce, is_stale)
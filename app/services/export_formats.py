@@ -0,0 +1,112 @@
+"""台账导出格式
+
+stream_export() 按格式把逐行数据写成字节块的生成器：
+
+- xlsx：见 app.services.xlsx，流式写出 zip 包；
+- csv：UTF-8 带 BOM（与仓库自带的台账实例 CSV 一致，Excel 可直接打开），
+  每 CSV_FLUSH_ROWS 行交出一次；
+- parquet：需要安装 pyarrow，每 PARQUET_ROW_GROUP_SIZE 行写一个行组。
+  Parquet 文件尾部的元数据只能在写完后生成，先写入临时文件再分块读出。
+
+导出列均为文本列，Parquet 中统一使用 string 类型。
+"""
+
+import csv
+import io
+import tempfile
+
+from app.services.xlsx import stream_xlsx
+
+CSV_FLUSH_ROWS = 500
+PARQUET_ROW_GROUP_SIZE = 50000
+READ_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "xlsx",
+    ),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ExportFormatUnavailable(Exception):
+    """导出格式依赖的库未安装"""
+
+
+def stream_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield "\ufeff".encode("utf-8")
+    for number, values in enumerate(rows, 1):
+        writer.writerow(values)
+        if number % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportFormatUnavailable(
+            "Parquet 导出需要安装 pyarrow: pip install pyarrow"
+        )
+    return pyarrow, pyarrow.parquet
+
+
+def write_parquet(target, header, rows):
+    """按行组把数据写入 Parquet 文件（路径或可写文件对象）"""
+    pa, pq = require_pyarrow()
+    schema = pa.schema([(name, pa.string()) for name in header])
+    with pq.ParquetWriter(target, schema) as writer:
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) == PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(_parquet_table(pa, schema, batch))
+                batch = []
+        if batch:
+            writer.write_table(_parquet_table(pa, schema, batch))
+
+
+def _parquet_table(pa, schema, batch):
+    columns = [
+        pa.array([row[i] for row in batch], type=pa.string())
+        for i in range(len(schema))
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def stream_parquet(header, rows):
+    with tempfile.TemporaryFile() as f:
+        write_parquet(f, header, rows)
+        f.seek(0)
+        while True:
+            data = f.read(READ_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+
+def stream_export(fmt, header, rows):
+    """按格式生成导出文件内容；parquet 在未安装 pyarrow 时立即抛出异常"""
+    if fmt == "csv":
+        return stream_csv(header, rows)
+    if fmt == "parquet":
+        # 生成器在首次迭代时才执行，依赖检查需提前完成
+        require_pyarrow()
+        return stream_parquet(header, rows)
+    return stream_xlsx(header, rows)
+
+
+def write_export(path, fmt, header, rows):
+    """把导出内容写入文件"""
+    with open(path, "wb") as f:
+        for data in stream_export(fmt, header, rows):
+            f.write(data)
@@ -0,0 +1,96 @@
+"""合集详情页筛选项统计（分面）
+
+各筛选项的取值及数量在数据库中按列 GROUP BY 统计，各列的统计语句以 UNION ALL
+合并，一次查询取回。某一列的数量按“除该列以外的所有已选筛选条件”统计，
+与常见分面检索面板一致：同一列内多选为“或”，不同列之间为“与”。
+
+只缓存统计结果（{字段: {取值: 数量}}），不缓存阀门行。缓存键为
+(台账 ID, data_version, 可见范围, 已选筛选条件)；带关键字检索时不缓存，
+每次请求现算，避免任意关键字占满缓存。
+阀门写入会递增 Ledger.data_version，旧版本的缓存条目不再命中，FACET_CACHE_TTL 兜底清理。
+"""
+
+from flask import current_app
+from sqlalchemy import func, literal, union_all
+
+from app.models import db, Valve
+from app.services.cache import TTLCache
+
+FACET_FIELDS = [
+    "位号",
+    "名称",
+    "装置名称",
+    "设备等级",
+    "型号规格",
+    "生产厂家",
+    "安装位置及用途",
+    "设备编号",
+    "是否联锁",
+]
+
+facet_cache = TTLCache("facets", max_entries=256)
+
+
+def _selected(active_filters):
+    return {
+        field: values
+        for field, values in active_filters.items()
+        if field in FACET_FIELDS and values
+    }
+
+
+def count_facets(query, active_filters):
+    """在给定查询范围内统计各列取值数量，返回 {字段: {取值: 数量}}
+
+    query 为尚未应用列筛选的阀门查询；每列的统计应用除该列以外的已选筛选条件。
+    """
+    selected = _selected(active_filters)
+    statements = []
+    for i, field in enumerate(FACET_FIELDS):
+        column = getattr(Valve, field)
+        field_query = query.order_by(None)
+        for other, values in selected.items():
+            if other != field:
+                field_query = field_query.filter(getattr(Valve, other).in_(values))
+        statements.append(
+            field_query.filter(column.isnot(None), column != "")
+            .with_entities(literal(i), column, func.count())
+            .group_by(column)
+            .statement
+        )
+
+    counts = {field: {} for field in FACET_FIELDS}
+    for i, value, count in db.session.execute(union_all(*statements)):
+        counts[FACET_FIELDS[i]][value] = count
+    return counts
+
+
+def ledger_facets(ledger, query, scope, active_filters):
+    """返回 (filter_options, facet_counts)
+
+    query 为尚未应用列筛选的阀门查询，scope 描述其可见范围（快照/状态），
+    与台账 ID、数据版本号及已选筛选条件一起组成缓存键；scope 为 None
+    （带关键字检索）时不缓存。
+    """
+    if scope is None:
+        counts = count_facets(query, active_filters)
+    else:
+        filters_key = tuple(
+            (field, tuple(sorted(values, key=str)))
+            for field, values in sorted(_selected(active_filters).items())
+        )
+        key = (ledger.id, ledger.data_version or 0, scope, filters_key)
+        counts = facet_cache.get_or_set(
+            key,
+            lambda: count_facets(query, active_filters),
+            current_app.config["FACET_CACHE_TTL"],
+        )
+
+    filter_options = {}
+    facet_counts = {}
+    for field in FACET_FIELDS:
+        # 已选中但当前数量为 0 的取值仍需展示，便于取消勾选
+        values = set(counts[field]) | set(active_filters.get(field, ()))
+        filter_options[field] = sorted(values, key=str)
+        facet_counts[field] = {value: counts[field].get(value, 0) for value in values}
+    return filter_options, facet_counts
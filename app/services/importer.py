@@ -0,0 +1,321 @@
+"""Excel 台账导入
+
+导入分两步：
+
+1. stage_workbook()：用 openpyxl 只读模式逐行读取工作簿，每 IMPORT_CHUNK_SIZE 行
+   用一条 ``位号 IN (...)`` 查询检测冲突，把解析后的记录写入服务器端暂存文件，
+   返回导入 ID。Cookie 会话中只保存导入 ID，不再保存预览数据。
+2. execute_import()：按块读取暂存记录，提交前再检测一次冲突，
+   新记录批量 INSERT，冲突记录按处理方式批量 UPDATE 或跳过，
+   每处理一块更新一次进度，可通过 load_progress() 查询。
+
+暂存文件位于 IMPORT_STAGING_FOLDER，超过 IMPORT_STAGING_TTL 秒未使用的自动清理。
+"""
+
+import json
+import os
+import time
+import uuid
+from datetime import date, datetime
+
+from flask import current_app
+from openpyxl import load_workbook
+from sqlalchemy import insert
+
+from app.models import db, Valve
+from app.services.dashboard import invalidate_dashboard
+from app.services.loading import chunked
+from app.services.valve_status import rebuild_ledger_counters, update_valves
+
+IMPORT_CHUNK_SIZE = 500
+# 预览页最多展示的冲突 / 样例记录数
+PREVIEW_LIMIT = 200
+
+CONFLICT_MODES = ("cancel", "overwrite", "skip")
+
+# Excel 表头 → 阀门字段
+IMPORT_COLUMN_MAP = {
+    "装置名称": "装置名称",
+    "位号": "位号",
+    "名称": "名称",
+    "设备等级": "设备等级",
+    "型号规格": "型号规格",
+    "生产厂家": "生产厂家",
+    "安装位置及用途": "安装位置及用途",
+    "工艺条件_介质名称": "工艺条件_介质名称",
+    "工艺条件_设计温度": "工艺条件_设计温度",
+    "工艺条件_阀前压力": "工艺条件_阀前压力",
+    "工艺条件_阀后压力": "工艺条件_阀后压力",
+    "阀体_公称通径": "阀体_公称通径",
+    "阀体_连接方式及规格": "阀体_连接方式及规格",
+    "阀体_材质": "阀体_材质",
+    "阀内件_阀座直径": "阀内件_阀座直径",
+    "阀内件_阀芯材质": "阀内件_阀芯材质",
+    "阀内件_阀座材质": "阀内件_阀座材质",
+    "阀内件_阀杆材质": "阀内件_阀杆材质",
+    "阀内件_流量特性": "阀内件_流量特性",
+    "阀内件_泄露等级": "阀内件_泄露等级",
+    "阀内件_Cv值": "阀内件_Cv值",
+    "执行机构_形式": "执行机构_形式",
+    "执行机构_型号规格": "执行机构_型号规格",
+    "执行机构_厂家": "执行机构_厂家",
+    "执行机构_作用形式": "执行机构_作用形式",
+    "执行机构_行程": "执行机构_行程",
+    "执行机构_弹簧范围": "执行机构_弹簧范围",
+    "执行机构_气源压力": "执行机构_气源压力",
+    "执行机构_故障位置": "执行机构_故障位置",
+    "执行机构_关阀时间": "执行机构_关阀时间",
+    "执行机构_开阀时间": "执行机构_开阀时间",
+    "设备编号": "设备编号",
+    "是否联锁": "是否联锁",
+    "备注": "备注",
+}
+
+
+class ImportNotFound(Exception):
+    """导入 ID 不存在、已过期或不属于当前用户"""
+
+
+def _staging_folder():
+    folder = current_app.config["IMPORT_STAGING_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def _paths(import_id):
+    # 导入 ID 为 uuid4().hex，校验格式避免拼接出任意路径
+    if not import_id or len(import_id) != 32 or not import_id.isalnum():
+        raise ImportNotFound(import_id)
+    folder = _staging_folder()
+    return (
+        os.path.join(folder, f"{import_id}.json"),
+        os.path.join(folder, f"{import_id}.jsonl"),
+    )
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _cleanup_expired():
+    folder = _staging_folder()
+    expires_before = time.time() - current_app.config["IMPORT_STAGING_TTL"]
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if os.path.getmtime(path) < expires_before:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _cell_text(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(value, date):
+        value = value.isoformat()
+    text = str(value)
+    return text if text.strip() else None
+
+
+def _row_record(header, values):
+    """把一行单元格转换为阀门字段字典，忽略无法识别的列和空单元格"""
+    record = {}
+    for field, value in zip(header, values):
+        if field is None:
+            continue
+        text = _cell_text(value)
+        if text is None:
+            continue
+        if field == "ledger_id":
+            try:
+                record[field] = int(float(text))
+            except ValueError:
+                continue
+        else:
+            record[field] = text
+    return record
+
+
+def _existing_by_tag(tags):
+    """一次 IN 查询返回 {位号: (id, 名称, ledger_id)}"""
+    if not tags:
+        return {}
+    rows = db.session.query(Valve.位号, Valve.id, Valve.名称, Valve.ledger_id).filter(
+        Valve.位号.in_(tags)
+    )
+    return {tag: (id, name, ledger_id) for tag, id, name, ledger_id in rows}
+
+
+def iter_workbook_records(file):
+    """只读模式逐行读取第一个工作表，首行为表头"""
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header_row = next(rows, None)
+        if header_row is None:
+            return
+        column_map = dict(IMPORT_COLUMN_MAP, ledger_id="ledger_id")
+        header = [
+            column_map.get(str(name).strip()) if name is not None else None
+            for name in header_row
+        ]
+        for values in rows:
+            record = _row_record(header, values)
+            if record.get("位号"):
+                yield record
+    finally:
+        workbook.close()
+
+
+def stage_workbook(file, filename, user_id):
+    """解析工作簿并暂存预览结果，返回清单（含导入 ID 与统计信息）"""
+    _cleanup_expired()
+    import_id = uuid.uuid4().hex
+    manifest_path, rows_path = _paths(import_id)
+
+    manifest = {
+        "import_id": import_id,
+        "filename": filename,
+        "user_id": user_id,
+        "created_at": datetime.utcnow().isoformat(),
+        "total": 0,
+        "new_count": 0,
+        "conflict_count": 0,
+        "duplicate_count": 0,
+        "conflicts": [],
+        "samples": [],
+        "progress": {"state": "staged", "processed": 0, "total": 0},
+    }
+    seen = set()
+    with open(rows_path, "w", encoding="utf-8") as out:
+        for chunk in chunked(iter_workbook_records(file), IMPORT_CHUNK_SIZE):
+            existing = _existing_by_tag([record["位号"] for record in chunk])
+            for record in chunk:
+                tag = record["位号"]
+                # 文件内重复的位号只保留第一行
+                if tag in seen:
+                    manifest["duplicate_count"] += 1
+                    continue
+                seen.add(tag)
+
+                match = existing.get(tag)
+                manifest["total"] += 1
+                if match:
+                    manifest["conflict_count"] += 1
+                    if len(manifest["conflicts"]) < PREVIEW_LIMIT:
+                        manifest["conflicts"].append(
+                            {
+                                "位号": tag,
+                                "existing_id": match[0],
+                                "existing_name": match[1],
+                                "new_data": record,
+                            }
+                        )
+                else:
+                    manifest["new_count"] += 1
+                if len(manifest["samples"]) < PREVIEW_LIMIT:
+                    manifest["samples"].append(dict(record, is_duplicate=bool(match)))
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    _write_json(manifest_path, manifest)
+    return manifest
+
+
+def load_manifest(import_id, user_id=None):
+    manifest_path, _ = _paths(import_id)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        raise ImportNotFound(import_id)
+    if user_id is not None and manifest["user_id"] != user_id:
+        raise ImportNotFound(import_id)
+    return manifest
+
+
+def load_progress(import_id, user_id=None):
+    return load_manifest(import_id, user_id)["progress"]
+
+
+def discard_import(import_id):
+    for path in _paths(import_id):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _iter_staged(rows_path):
+    with open(rows_path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def execute_import(
+    import_id, conflict_mode, user_id, auto_approve=False, on_progress=None
+):
+    """按暂存记录执行导入，调用方负责提交事务
+
+    每处理一块调用一次 on_progress(已处理行数, 总行数)。
+    返回 {"new_count", "update_count", "skip_count", "cancelled"}。
+    """
+    manifest_path, rows_path = _paths(import_id)
+    manifest = load_manifest(import_id, user_id)
+    result = {"new_count": 0, "update_count": 0, "skip_count": 0, "cancelled": False}
+
+    if conflict_mode == "cancel" and manifest["conflict_count"]:
+        result["cancelled"] = True
+        return result
+
+    progress = {"state": "running", "processed": 0, "total": manifest["total"]}
+    manifest["progress"] = progress
+    _write_json(manifest_path, manifest)
+
+    now = datetime.utcnow()
+    status_values = {"status": "approved"}
+    if auto_approve:
+        status_values.update(approved_by=user_id, approved_at=now)
+
+    touched_ledger_ids = set()
+    for chunk in chunked(_iter_staged(rows_path), IMPORT_CHUNK_SIZE):
+        # 预览后可能有其他用户录入了相同位号，执行前重新检测
+        existing = _existing_by_tag([record["位号"] for record in chunk])
+        inserts, updates = [], []
+        for record in chunk:
+            match = existing.get(record["位号"])
+            if match is None:
+                inserts.append(dict(record, created_by=user_id, **status_values))
+                touched_ledger_ids.add(record.get("ledger_id"))
+            elif conflict_mode == "overwrite":
+                updates.append(dict(record, id=match[0]))
+                touched_ledger_ids.update([match[2], record.get("ledger_id")])
+            else:
+                result["skip_count"] += 1
+
+        if inserts:
+            db.session.execute(insert(Valve), inserts)
+        if updates:
+            # 导入按位号覆盖，不校验行版本号
+            update_valves(updates)
+        result["new_count"] += len(inserts)
+        result["update_count"] += len(updates)
+
+        progress["processed"] += len(chunk)
+        _write_json(manifest_path, manifest)
+        if on_progress is not None:
+            on_progress(progress["processed"], progress["total"])
+
+    touched_ledger_ids.discard(None)
+    rebuild_ledger_counters(touched_ledger_ids)
+    invalidate_dashboard()
+
+    progress["state"] = "done"
+    progress.update(result)
+    _write_json(manifest_path, manifest)
+    return result
@@ -0,0 +1,266 @@
+"""后台任务
+
+耗时的导入、导出通过 submit_job() 提交到进程内线程池执行，请求立即返回任务 ID，
+前端轮询任务状态并在完成后下载结果。任务状态保存在 jobs 表中，结果文件写入
+JOB_RESULT_FOLDER，超过 JOB_RESULT_TTL 秒的结果文件自动清理。
+
+任务类型通过 @job_handler(kind) 注册，处理函数签名为 ``handler(ctx, **params)``：
+需要输出文件时写入 ``ctx.result_path``，返回 {"filename", "mimetype"}；
+其余返回值作为任务结果保存。处理函数中的数据库写入与任务完成状态在同一事务提交，
+失败或取消时整体回滚。
+
+执行中的进度保存在执行进程的内存中，避免在 SQLite 写事务进行期间另开连接写库。
+适用于单机部署；JOB_WORKERS 为 0 时在当前线程内同步执行（测试与调试用）。
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app.models import db, Job
+
+JOB_HANDLERS = {}
+FINISHED_STATES = ("done", "failed", "cancelled")
+# 执行中检查数据库取消标记的最小间隔（秒）
+CANCEL_CHECK_INTERVAL = 1.0
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}
+# 本进程内执行中任务的实时进度与取消标记 {job_id: {...}}
+_live = {}
+_live_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """任务在执行中被取消"""
+
+
+def job_handler(kind):
+    """注册任务类型的处理函数"""
+
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+class JobContext:
+    """传给处理函数的执行上下文"""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.result_path = result_path(job.id)
+        self._checked_at = time.monotonic()
+
+    def progress(self, processed, total=None):
+        """更新进度并检查是否已被取消，已取消时抛出 JobCancelled"""
+        with _live_lock:
+            live = _live[self.job_id]
+            live["progress"] = processed
+            if total is not None:
+                live["total"] = total
+            cancelled = live["cancel"]
+        now = time.monotonic()
+        if not cancelled and now - self._checked_at > CANCEL_CHECK_INTERVAL:
+            # 取消请求可能由其他进程写入数据库
+            self._checked_at = now
+            cancelled = db.session.scalar(
+                db.select(Job.cancel_requested).where(Job.id == self.job_id)
+            )
+        if cancelled:
+            raise JobCancelled(self.job_id)
+
+
+def result_path(job_id):
+    folder = current_app.config["JOB_RESULT_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, job_id)
+
+
+def _cleanup_results():
+    folder = current_app.config["JOB_RESULT_FOLDER"]
+    if not os.path.isdir(folder):
+        return
+    expires_before = time.time() - current_app.config["JOB_RESULT_TTL"]
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if os.path.getmtime(path) < expires_before:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config["JOB_WORKERS"], thread_name_prefix="job"
+            )
+        return _executor
+
+
+def submit_job(kind, user_id, params=None):
+    """创建任务并提交执行，返回 Job（调用方无需再提交事务）"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"未知的任务类型: {kind}")
+    _cleanup_results()
+    job = Job(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        status="queued",
+        user_id=user_id,
+        params=json.dumps(params or {}, ensure_ascii=False),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    if app.config["JOB_WORKERS"] <= 0:
+        _run(app, job.id)
+    else:
+        future = _get_executor(app).submit(_run, app, job.id)
+        _futures[job.id] = future
+        future.add_done_callback(lambda _: _futures.pop(job.id, None))
+    return job
+
+
+def _finish(job_id, status, message=None, **values):
+    job = db.session.get(Job, job_id)
+    job.status = status
+    job.message = message
+    job.finished_at = datetime.utcnow()
+    with _live_lock:
+        live = _live.get(job_id)
+        if live:
+            job.progress, job.total = live["progress"], live["total"]
+    for key, value in values.items():
+        setattr(job, key, value)
+    db.session.commit()
+
+
+def _run(app, job_id):
+    # 新的应用上下文使用独立的数据库会话
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        if job is None or job.status != "queued":
+            return
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        job.pid = os.getpid()
+        db.session.commit()
+
+        with _live_lock:
+            _live[job_id] = {"progress": 0, "total": 0, "cancel": False}
+        ctx = JobContext(job)
+        try:
+            handler = JOB_HANDLERS[job.kind]
+            result = handler(ctx, **json.loads(job.params or "{}")) or {}
+        except JobCancelled:
+            db.session.rollback()
+            _remove_result(job_id)
+            _finish(job_id, "cancelled", "任务已取消")
+        except Exception as e:
+            db.session.rollback()
+            _remove_result(job_id)
+            app.logger.exception("后台任务 %s 执行失败", job_id)
+            _finish(job_id, "failed", str(e)[:500] or e.__class__.__name__)
+        else:
+            # 处理函数的写入与任务完成状态一起提交
+            filename = result.pop("filename", None)
+            mimetype = result.pop("mimetype", None)
+            _finish(
+                job_id,
+                "done",
+                result.pop("message", None),
+                result=json.dumps(result, ensure_ascii=False, default=str),
+                result_name=filename,
+                result_mimetype=mimetype,
+            )
+        finally:
+            with _live_lock:
+                _live.pop(job_id, None)
+
+
+def _remove_result(job_id):
+    try:
+        os.remove(result_path(job_id))
+    except OSError:
+        pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_job(job_id, user):
+    """按 ID 读取任务，仅任务提交人与管理员可见，否则返回 None"""
+    job = db.session.get(Job, job_id)
+    if job is None or (job.user_id != user.id and user.role != "admin"):
+        return None
+    # 执行进程已退出（如服务重启）的任务不会再完成
+    if job.status == "running" and job.pid and not _process_alive(job.pid):
+        job.status = "failed"
+        job.message = "执行任务的进程已退出，任务中断"
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    return job
+
+
+def cancel_job(job):
+    """取消任务：排队中的立即取消，执行中的在下一次进度更新时中止"""
+    if job.status in FINISHED_STATES:
+        return False
+    future = _futures.get(job.id)
+    if job.status == "queued" and (future is None or future.cancel()):
+        job.status = "cancelled"
+        job.message = "任务已取消"
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+    with _live_lock:
+        live = _live.get(job.id)
+        if live is not None:
+            live["cancel"] = True
+            return True
+    # 由其他进程执行，写入取消标记
+    job.cancel_requested = True
+    db.session.commit()
+    return True
+
+
+def job_payload(job):
+    """任务状态的 JSON 表示，执行中的任务合并本进程内的实时进度"""
+    progress, total = job.progress, job.total
+    with _live_lock:
+        live = _live.get(job.id)
+        if live is not None:
+            progress, total = live["progress"], live["total"]
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": progress,
+        "total": total,
+        "message": job.message,
+        "result": json.loads(job.result) if job.result else None,
+        "has_file": bool(job.result_name),
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,124 @@
+"""阀门列表分页
+
+- 游标（keyset）分页：按 ``id`` 倒序（检索时按 ``rank, id``）取下一页，
+  不做 OFFSET 扫描，也不需要统计总数；
+- 总数统计模式：``exact`` 精确 COUNT，``estimate`` 最多数到上限条即停止，
+  ``none`` 不统计。超大台账上翻页不再每次全量 COUNT。
+"""
+
+import base64
+import binascii
+import json
+
+from sqlalchemy import and_, func, or_
+
+from app.models import db, Valve
+
+COUNT_MODES = ("exact", "estimate", "none")
+
+
+def clamp_per_page(per_page, default, maximum):
+    """把请求的每页条数限制在 [1, maximum] 内"""
+    if not per_page or per_page < 1:
+        return default
+    return min(per_page, maximum)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游标，格式不正确时返回 None（视为第一页）"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or not values:
+        return None
+    if not all(isinstance(v, (int, float)) for v in values):
+        return None
+    return values
+
+
+class KeysetPage:
+    """一页游标分页结果，属性与 Flask-SQLAlchemy 的 Pagination 保持兼容"""
+
+    page = 1
+    has_prev = False
+    prev_num = None
+    next_num = None
+
+    def __init__(self, items, per_page, next_cursor, total=None, estimated=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_estimate = estimated
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def pages(self):
+        if not self.total:
+            return 0
+        return -(-self.total // self.per_page)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_page(query, per_page, cursor=None, rank=None):
+    """按 id 倒序（有检索排序时按 rank 升序、id 倒序）取游标之后的一页
+
+    返回 (items, next_cursor)。
+    """
+    after = decode_cursor(cursor)
+    if rank is None:
+        if after:
+            query = query.filter(Valve.id < after[-1])
+        rows = query.order_by(Valve.id.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        last = [items[-1].id] if items else None
+    else:
+        if after and len(after) == 2:
+            query = query.filter(
+                or_(rank > after[0], and_(rank == after[0], Valve.id < after[1]))
+            )
+        rows = (
+            query.add_columns(rank)
+            .order_by(rank, Valve.id.desc())
+            .limit(per_page + 1)
+            .all()
+        )
+        items = [valve for valve, _ in rows[:per_page]]
+        last = [rows[len(items) - 1][1], items[-1].id] if items else None
+
+    next_cursor = encode_cursor(last) if len(rows) > per_page else None
+    return items, next_cursor
+
+
+def count_total(query, mode="exact", limit=10000, known_total=None):
+    """按统计模式返回 (总数, 是否为估计值)
+
+    known_total 为调用方已知的精确总数（如台账计数列），有值时直接使用；
+    estimate 模式下最多数到 limit 条，超出时返回 limit 并标记为估计值。
+    """
+    if mode == "none":
+        return None, False
+    if known_total is not None:
+        return known_total, False
+
+    ids = query.order_by(None).with_entities(Valve.id)
+    if mode == "estimate":
+        ids = ids.limit(limit + 1)
+    total = db.session.query(func.count()).select_from(ids.subquery()).scalar()
+    if mode == "estimate" and total > limit:
+        return limit, True
+    return total, False
@@ -0,0 +1,199 @@
+"""阀门台账 PDF 导出
+
+数据表 HTML 由 Jinja 模板 valves/pdf_sheet.html 渲染。模板只编译一次，之后由
+Jinja 环境缓存复用。HTML→PDF 的排版（WeasyPrint，CPU 密集）在进程池中执行，
+每个工作进程启动时加载一次共享样式表和字体配置，见 app.services.pdf_worker。
+
+批量导出支持两种输出：
+
+- zip：每个阀门一个 PDF，逐个提交到进程池并行排版，完成一个更新一次进度；
+- merged：所有数据表合并为一个 PDF。WeasyPrint 对单个文档的排版无法拆分，
+  合并文件作为一个文档在一个工作进程中排版。
+
+PDF_WORKERS 为 0 时在当前进程内排版（测试与调试用）。WeasyPrint 为可选依赖，
+未安装时 require_weasyprint() 抛出 ExportFormatUnavailable。
+
+单个阀门的 PDF 按内容寻址缓存在 PDF_CACHE_FOLDER 中：缓存键由阀门的全部字段、
+updated_at 以及模板和样式表内容计算，任一变化都会得到新的键，同一阀门的旧文件
+在写入新文件时删除。缓存的文件会被重复下发，数据表上只打印阀门的更新时间，
+不打印导出时间。
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from flask import current_app
+
+from app.models import VALVE_FIELD_NAMES
+from app.services import pdf_worker
+from app.services.disk_cache import DiskCache
+from app.services.export_formats import ExportFormatUnavailable
+
+PDF_MODES = ("merged", "zip")
+PDF_MIMETYPES = {"merged": "application/pdf", "zip": "application/zip"}
+# 单次批量导出的阀门数上限
+PDF_BATCH_LIMIT = 5000
+SHEET_TEMPLATE = "valves/pdf_sheet.html"
+
+_pool = None
+_pool_lock = threading.Lock()
+_local_ready = False
+_layout_digest = None
+
+PDF_CACHE = DiskCache("valve_pdf", "PDF_CACHE_FOLDER", "PDF_CACHE_MAX_BYTES")
+
+
+def require_weasyprint():
+    try:
+        import weasyprint  # noqa: F401
+    except ImportError:
+        raise ExportFormatUnavailable("PDF导出需要安装 WeasyPrint: pip install WeasyPrint")
+
+
+def _stylesheet_path():
+    return os.path.join(current_app.static_folder, "css", "pdf_sheet.css")
+
+
+def render_sheets_html(valves, title="仪表阀门台账"):
+    """渲染数据表 HTML，valves 为阀门对象或字段字典"""
+    template = current_app.jinja_env.get_template(SHEET_TEMPLATE)
+    return template.render(valves=valves, title=title)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 进程池与后台任务线程共存，使用 spawn 避免 fork 继承线程锁状态
+            _pool = ProcessPoolExecutor(
+                max_workers=current_app.config["PDF_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=pdf_worker.init_worker,
+                initargs=(_stylesheet_path(), current_app.static_folder),
+            )
+        return _pool
+
+
+def render_pdf_local(html):
+    """在当前进程内排版，首次调用时加载样式表"""
+    global _local_ready
+    if not _local_ready:
+        pdf_worker.init_worker(_stylesheet_path(), current_app.static_folder)
+        _local_ready = True
+    return pdf_worker.render_pdf(html)
+
+
+def _layout_fingerprint():
+    """模板与样式表内容的摘要，修改版式后旧的缓存文件不再命中"""
+    global _layout_digest
+    if _layout_digest is None:
+        env = current_app.jinja_env
+        source = env.loader.get_source(env, SHEET_TEMPLATE)[0]
+        with open(_stylesheet_path(), encoding="utf-8") as f:
+            source += f.read()
+        _layout_digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    return _layout_digest
+
+
+def pdf_cache_key(valve):
+    """单个阀门 PDF 的缓存键（同时作为 ETag）"""
+    payload = [
+        valve.id,
+        valve.updated_at.isoformat() if valve.updated_at else None,
+        [getattr(valve, name) for name in VALVE_FIELD_NAMES],
+        _layout_fingerprint(),
+    ]
+    digest = hashlib.sha256(
+        json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()[:32]
+    return f"v{valve.id}-{digest}"
+
+
+def cached_valve_pdf(valve, key=None):
+    """返回单个阀门 PDF 的缓存文件路径，未命中时在当前进程内排版"""
+    key = key or pdf_cache_key(valve)
+
+    def produce(path):
+        with open(path, "wb") as f:
+            f.write(render_pdf_local(render_sheets_html([valve])))
+
+    return PDF_CACHE.get_or_create(
+        key, "pdf", produce, lambda name: name.startswith(f"v{valve.id}-")
+    )
+
+
+def _sheet_filename(valve, used):
+    name = re.sub(r'[\\/:*?"<>|\s]+', "_", str(valve.get("位号") or "valve"))
+    if name in used:
+        used[name] += 1
+        name = f"{name}_{used[name]}"
+    else:
+        used[name] = 0
+    return f"{name}.pdf"
+
+
+def write_pdf_batch(path, valves, mode, progress=None):
+    """把 valves（字段字典列表）导出为合并 PDF 或 ZIP，写入 path
+
+    progress(已完成数, 总数) 在每完成一个文件后调用，可抛出异常中止导出。
+    """
+    require_weasyprint()
+    if len(valves) > PDF_BATCH_LIMIT:
+        raise ValueError(f"单次最多导出 {PDF_BATCH_LIMIT} 个阀门，请缩小筛选范围")
+    progress = progress or (lambda done, total: None)
+    in_process = current_app.config["PDF_WORKERS"] <= 0
+
+    if mode == "merged":
+        progress(0, 1)
+        html = render_sheets_html(valves)
+        if in_process:
+            data = render_pdf_local(html)
+        else:
+            data = _get_pool().submit(pdf_worker.render_pdf, html).result()
+        with open(path, "wb") as f:
+            f.write(data)
+        progress(1, 1)
+        return
+
+    total = len(valves)
+    used = {}
+    progress(0, total)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        if in_process:
+            for done, valve in enumerate(valves, 1):
+                data = render_pdf_local(render_sheets_html([valve]))
+                archive.writestr(_sheet_filename(valve, used), data)
+                progress(done, total)
+            return
+
+        pool = _get_pool()
+        # 只保留有限个待排版任务，避免一次性把全部 HTML 放进队列
+        window = current_app.config["PDF_WORKERS"] * 4
+        remaining = iter(valves)
+        pending = {}
+        done = 0
+        try:
+            while True:
+                while len(pending) < window:
+                    valve = next(remaining, None)
+                    if valve is None:
+                        break
+                    html = render_sheets_html([valve])
+                    pending[pool.submit(pdf_worker.render_pdf, html)] = valve
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    valve = pending.pop(future)
+                    archive.writestr(_sheet_filename(valve, used), future.result())
+                    done += 1
+                progress(done, total)
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,28 @@
+"""PDF 渲染进程
+
+在 PDF 进程池的每个工作进程中运行：init_worker() 在进程启动时加载一次共享样式表与
+字体配置，之后 render_pdf() 只负责把已渲染好的 HTML 排版为 PDF。
+"""
+
+_stylesheets = None
+_font_config = None
+_base_url = None
+
+
+def init_worker(css_path, base_url):
+    global _stylesheets, _font_config, _base_url
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    _font_config = FontConfiguration()
+    _stylesheets = [CSS(filename=css_path, font_config=_font_config)]
+    _base_url = base_url
+
+
+def render_pdf(html):
+    """把 HTML 排版为 PDF，返回字节"""
+    from weasyprint import HTML
+
+    return HTML(string=html, base_url=_base_url).write_pdf(
+        stylesheets=_stylesheets, font_config=_font_config
+    )
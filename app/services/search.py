@@ -0,0 +1,146 @@
+"""台账内容全文检索
+
+检索后端可插拔，由配置项 VALVE_SEARCH_BACKEND 选择：
+
+- ``like``：在 VALVE_FIELD_NAMES 各列上做 ``LIKE '%关键字%'``，任何数据库可用；
+- ``fts5``：SQLite FTS5 外部内容表 valves_fts，trigram 分词，
+  位号（如 FV-1001）与中文名称均可按任意子串（含前缀）匹配，并按 bm25 排序。
+
+valves_fts 由 valves 表上的触发器同步，批量 SQL 写入同样生效。
+trigram 分词要求关键字至少 3 个字符，更短的关键字回退为 LIKE。
+"""
+
+import logging
+import weakref
+
+from flask import current_app
+from sqlalchemy import event, or_, select, table, column, literal_column, text
+from sqlalchemy.exc import OperationalError
+
+from app.models import db, Valve, VALVE_FIELD_NAMES
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "valves_fts"
+FTS_MIN_TERM_LENGTH = 3
+
+_fts_columns = ", ".join(f'"{name}"' for name in VALVE_FIELD_NAMES)
+_new_values = ", ".join(f'new."{name}"' for name in VALVE_FIELD_NAMES)
+_old_values = ", ".join(f'old."{name}"' for name in VALVE_FIELD_NAMES)
+
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {_fts_columns}, content='valves', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS valves_fts_ai AFTER INSERT ON valves BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_fts_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS valves_fts_ad AFTER DELETE ON valves BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_fts_columns})
+        VALUES ('delete', old.id, {_old_values});
+    END""",
+    # 仅在检索列被修改时触发，状态流转等更新不会重建索引行
+    f"""CREATE TRIGGER IF NOT EXISTS valves_fts_au AFTER UPDATE OF {_fts_columns}
+    ON valves BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_fts_columns})
+        VALUES ('delete', old.id, {_old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {_fts_columns}) VALUES (new.id, {_new_values});
+    END""",
+]
+
+fts_table = table(FTS_TABLE, column("rowid"), column("rank"))
+
+_fts_available_by_engine = weakref.WeakKeyDictionary()
+
+
+def create_fts_index(connection):
+    """创建 FTS5 索引表及同步触发器，SQLite 不支持 FTS5/trigram 时跳过"""
+    if connection.dialect.name != "sqlite":
+        return False
+    try:
+        for statement in FTS_DDL:
+            connection.exec_driver_sql(statement)
+    except OperationalError as e:
+        logger.warning("FTS5 全文索引不可用，检索将使用 LIKE: %s", e)
+        return False
+    return True
+
+
+def rebuild_fts_index(connection):
+    """按 valves 表内容重建全文索引"""
+    connection.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+    )
+
+
+@event.listens_for(Valve.__table__, "after_create")
+def _create_fts_after_valves(target, connection, **kw):
+    create_fts_index(connection)
+
+
+@event.listens_for(Valve.__table__, "before_drop")
+def _drop_fts_before_valves(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class LikeSearchBackend:
+    name = "like"
+
+    def apply(self, query, term):
+        """返回 (过滤后的查询, 排序表达式或 None)"""
+        conditions = [
+            getattr(Valve, name).contains(term) for name in VALVE_FIELD_NAMES
+        ]
+        return query.filter(or_(*conditions)), None
+
+
+class FTS5SearchBackend:
+    name = "fts5"
+
+    def __init__(self):
+        self.fallback = LikeSearchBackend()
+
+    @staticmethod
+    def match_expression(term):
+        # 整体作为短语匹配，与 LIKE '%关键字%' 的子串语义一致
+        return '"' + term.replace('"', '""') + '"'
+
+    def apply(self, query, term):
+        if len(term) < FTS_MIN_TERM_LENGTH:
+            return self.fallback.apply(query, term)
+
+        match = literal_column(FTS_TABLE).op("MATCH")(self.match_expression(term))
+        matches = (
+            select(fts_table.c.rowid, fts_table.c.rank).where(match).subquery()
+        )
+        query = query.join(matches, matches.c.rowid == Valve.id)
+        return query, matches.c.rank
+
+
+BACKENDS = {
+    "like": LikeSearchBackend,
+    "fts5": FTS5SearchBackend,
+}
+
+
+def _fts_available():
+    engine = db.engine
+    available = _fts_available_by_engine.get(engine)
+    if available is None:
+        available = engine.dialect.name == "sqlite" and bool(
+            db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+                {"name": FTS_TABLE},
+            ).scalar()
+        )
+        _fts_available_by_engine[engine] = available
+    return available
+
+
+def get_search_backend():
+    """按配置返回检索后端，FTS5 索引不存在时回退为 LIKE"""
+    name = current_app.config.get("VALVE_SEARCH_BACKEND", "like")
+    if name == "fts5" and not _fts_available():
+        name = "like"
+    return BACKENDS[name]()
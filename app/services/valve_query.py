@@ -0,0 +1,80 @@
+"""合集详情页的阀门查询
+
+详情页、详情 JSON 接口与按合集导出共用同一套筛选规则：可见范围（快照规则）、
+状态、关键字检索以及表头列筛选。筛选条件从请求参数（MultiDict）读取。
+"""
+
+from collections import namedtuple
+
+from app.models import Valve
+from app.services.facets import FACET_FIELDS
+from app.services.search import get_search_backend
+from app.services.valve_status import STATUS_COUNT_COLUMNS
+
+# 与详情页筛选相关的请求参数，导出时按此原样转发
+DETAIL_FILTER_ARGS = ("from", "status", "search") + tuple(FACET_FIELDS)
+
+DetailScope = namedtuple("DetailScope", ["query", "key", "known_total"])
+
+
+def is_snapshot_view(from_param, status):
+    """非“我的合集”入口且未按状态筛选时，详情页只显示已审批快照"""
+    return from_param != "mine" and not status
+
+
+def detail_valve_query(ledger, from_param, args):
+    """按详情页的可见范围、状态和关键字构造阀门查询（不含列筛选）
+
+    返回 (query, search_rank, scope)。scope.query 为用于统计筛选项的查询，
+    scope.key 为筛选项缓存键（带关键字检索时为 None，不缓存），
+    scope.known_total 为可由台账计数列直接得出的总数。
+    """
+    query = Valve.query.filter_by(ledger_id=ledger.id)
+    status = args.get("status")
+    snapshot_only = is_snapshot_view(from_param, status)
+
+    known_total = None
+    if snapshot_only:
+        if ledger.approved_snapshot_at:
+            query = query.filter(
+                Valve.status == "approved",
+                Valve.approved_at <= ledger.approved_snapshot_at,
+            )
+        else:
+            query = query.filter(Valve.status == "approved")
+            known_total = ledger.approved_count
+    elif status:
+        query = query.filter(Valve.status == status)
+        column = STATUS_COUNT_COLUMNS.get(status)
+        known_total = getattr(ledger, column) if column else None
+    else:
+        known_total = ledger.valve_count
+
+    search_rank = None
+    search = args.get("search")
+    if search:
+        query, search_rank = get_search_backend().apply(query, search)
+        known_total = None
+
+    key = None if search else (snapshot_only, ledger.approved_snapshot_at, status)
+    return query, search_rank, DetailScope(query, key, known_total)
+
+
+def apply_column_filters(query, args):
+    """应用表头列筛选（同一列多选为“或”），返回 (query, active_filters)"""
+    active_filters = {}
+    for field in FACET_FIELDS:
+        values = args.getlist(field)
+        if values:
+            query = query.filter(getattr(Valve, field).in_(values))
+            active_filters[field] = values
+    return query, active_filters
+
+
+def filtered_detail_query(ledger, from_param, args):
+    """详情页最终展示的阀门查询，返回 (已按详情页顺序排序的 query, search_rank)"""
+    query, search_rank, _ = detail_valve_query(ledger, from_param, args)
+    query, _ = apply_column_filters(query, args)
+    if search_rank is not None:
+        return query.order_by(search_rank, Valve.id.desc()), search_rank
+    return query.order_by(Valve.id.desc()), search_rank
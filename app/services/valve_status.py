@@ -0,0 +1,599 @@
+"""阀门状态流转与台账计数维护
+
+所有修改阀门状态、向台账添加或删除阀门的写路径都应通过本模块，
+以保证 Ledger 上的各状态计数列与阀门数据在同一事务内保持一致。
+
+Ledger.data_version 在每次刷新（flush）后按写入过的阀门递增，
+不经过 ORM 的批量写入需调用 rebuild_ledger_counters() 或 bump_data_version()。
+"""
+
+import os
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from flask import current_app
+
+from sqlalchemy import (
+    bindparam,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from app.models import (
+    db,
+    Ledger,
+    Valve,
+    ApprovalLog,
+    DraftBuffer,
+    MaintenanceRecord,
+    ValveAttachment,
+    ValvePhoto,
+)
+from app.services.dashboard import invalidate_dashboard
+from app.services.loading import chunked, execute_in_chunks, load_many, parse_ids
+
+VALVE_STATUSES = ("draft", "pending", "approved", "rejected")
+
+STATUS_COUNT_COLUMNS = {
+    "draft": "draft_count",
+    "pending": "pending_count",
+    "approved": "approved_count",
+    "rejected": "rejected_count",
+}
+
+COUNTER_COLUMNS = ["valve_count"] + list(STATUS_COUNT_COLUMNS.values())
+
+# 以 valve_id 引用阀门、随阀门一并删除的表。照片另行删除（同时删除文件），
+# 检修记录是设备历史，有检修记录的阀门不允许删除，见 valves_with_maintenance()
+VALVE_CHILD_MODELS = (ApprovalLog, ValveAttachment)
+
+
+def _status_of(valve):
+    return valve.status or "draft"
+
+
+def _expire_counters(ledger_ids):
+    """使会话中已加载的台账计数属性失效，下次访问时重新读取"""
+    for ledger_id in ledger_ids:
+        ledger = db.session.identity_map.get(identity_key(Ledger, int(ledger_id)))
+        if ledger is not None:
+            db.session.expire(ledger, COUNTER_COLUMNS)
+
+
+def _apply_deltas(deltas):
+    """按增量更新台账计数列
+
+    deltas: {ledger_id: Counter({status: n})}，在数据库端执行
+    ``count = count + n``，避免并发请求互相覆盖。
+    所有台账的增量以一次 executemany 提交。
+    """
+    invalidate_dashboard()
+    params = []
+    for ledger_id, by_status in deltas.items():
+        row = {f"delta_{column}": 0 for column in COUNTER_COLUMNS}
+        for status, n in by_status.items():
+            column = STATUS_COUNT_COLUMNS.get(status)
+            if column:
+                row[f"delta_{column}"] += n
+        row["delta_valve_count"] = sum(by_status.values())
+        if any(row.values()):
+            row["ledger_id"] = ledger_id
+            params.append(row)
+    if not params:
+        return
+
+    ledgers = Ledger.__table__
+    db.session.execute(
+        update(ledgers)
+        .where(ledgers.c.id == bindparam("ledger_id"))
+        .values(
+            {
+                column: ledgers.c[column] + bindparam(f"delta_{column}")
+                for column in COUNTER_COLUMNS
+            }
+        ),
+        params,
+    )
+    _expire_counters([row["ledger_id"] for row in params])
+
+
+def transition_valves(valves, status, user_id=None, action=None, comment=None):
+    """将一组阀门切换到指定状态，同步台账计数并按需写入审批日志
+
+    返回实际发生状态变化的阀门列表。
+    """
+    deltas = defaultdict(Counter)
+    changed = []
+    now = datetime.utcnow()
+
+    for valve in valves:
+        old_status = _status_of(valve)
+        if old_status == status:
+            continue
+
+        valve.status = status
+        if status == "approved":
+            valve.approved_by = user_id
+            valve.approved_at = now
+
+        if valve.ledger_id:
+            deltas[valve.ledger_id][old_status] -= 1
+            deltas[valve.ledger_id][status] += 1
+
+        if action:
+            db.session.add(
+                ApprovalLog(
+                    ledger_id=valve.ledger_id,
+                    valve_id=valve.id,
+                    action=action,
+                    user_id=user_id,
+                    comment=comment,
+                )
+            )
+        changed.append(valve)
+
+    _apply_deltas(deltas)
+    return changed
+
+
+def _update_returning_ids(condition, values):
+    """执行 UPDATE 并返回被修改行的 (id, ledger_id)"""
+    valves = Valve.__table__
+    statement = update(valves).where(condition).values(**values)
+    if db.engine.dialect.update_returning:
+        return db.session.execute(
+            statement.returning(valves.c.id, valves.c.ledger_id)
+        ).all()
+    rows = db.session.execute(
+        select(valves.c.id, valves.c.ledger_id).where(condition)
+    ).all()
+    if rows:
+        db.session.execute(
+            update(valves)
+            .where(valves.c.id.in_([row.id for row in rows]))
+            .values(**values)
+        )
+    return rows
+
+
+def update_valves(updates):
+    """按主键批量更新阀门字段，返回因版本号不一致而未更新的阀门 ID
+
+    updates 每项为 {"id": 阀门 ID, 字段: 值, ...}，行版本号一并递增。按更新列分组，
+    不带 "version" 的组用一条 executemany 写入（ORM 的按主键批量更新遇到版本号列
+    会退化为逐行 UPDATE）；带 "version" 的行只在版本号等于该值时更新，SQLite 的
+    executemany 只返回合计行数，无法区分哪一行未命中，这些行逐行执行并检查 rowcount。
+    """
+    valves = Valve.__table__
+    groups = defaultdict(list)
+    for values in updates:
+        groups[frozenset(values)].append(values)
+
+    stale = []
+    for keys, group in groups.items():
+        columns = sorted(keys - {"id", "version"})
+        condition = valves.c.id == bindparam("valve_id")
+        if "version" in keys:
+            condition &= valves.c.version == bindparam("base_version")
+        statement = (
+            update(valves)
+            .where(condition)
+            .values({column: bindparam(f"new_{column}") for column in columns})
+            .values(version=valves.c.version + 1)
+        )
+        params = []
+        for values in group:
+            row = {f"new_{column}": values[column] for column in columns}
+            row.update(valve_id=values["id"], base_version=values.get("version"))
+            params.append(row)
+        if "version" not in keys:
+            db.session.execute(statement, params)
+            continue
+        for row in params:
+            if db.session.execute(statement, row).rowcount == 0:
+                stale.append(row["valve_id"])
+
+    for values in updates:
+        valve = db.session.identity_map.get(identity_key(Valve, values["id"]))
+        if valve is not None:
+            db.session.expire(valve)
+    return stale
+
+
+def bulk_transition(
+    ledger_ids,
+    from_status,
+    to_status,
+    user_id=None,
+    action=None,
+    comment=None,
+    valve_ids=None,
+):
+    """以集合方式把若干台账中处于 from_status 的阀门切换为 to_status
+
+    阀门状态按 ID 分块用 UPDATE 修改，审批日志用一次批量 INSERT 写入，
+    不逐个加载阀门对象；调用方负责提交事务。valve_ids 不为 None 时只处理其中的阀门。
+    返回 {ledger_id: 切换数量}。
+    """
+    ledger_ids = parse_ids(ledger_ids)
+    if valve_ids is not None:
+        valve_ids = parse_ids(valve_ids)
+    if not ledger_ids or (valve_ids is not None and not valve_ids):
+        return {}
+
+    now = datetime.utcnow()
+    # 集合 UPDATE 不经过 ORM 的版本号机制，这里一并递增行版本号
+    values = {"status": to_status, "version": Valve.__table__.c.version + 1}
+    if to_status == "approved":
+        values.update(approved_by=user_id, approved_at=now)
+
+    db.session.flush()
+    valves = Valve.__table__
+    valve_chunks = [None] if valve_ids is None else list(chunked(valve_ids))
+    changed = []
+    for ledger_chunk in chunked(ledger_ids):
+        for valve_chunk in valve_chunks:
+            condition = valves.c.ledger_id.in_(ledger_chunk) & (
+                valves.c.status == from_status
+            )
+            if valve_chunk is not None:
+                condition &= valves.c.id.in_(valve_chunk)
+            changed.extend(_update_returning_ids(condition, values))
+    if not changed:
+        return {}
+
+    if action:
+        db.session.execute(
+            insert(ApprovalLog.__table__),
+            [
+                {
+                    "ledger_id": row.ledger_id,
+                    "valve_id": row.id,
+                    "action": action,
+                    "user_id": user_id,
+                    "comment": comment,
+                    "timestamp": now,
+                }
+                for row in changed
+            ],
+        )
+
+    counts = Counter(row.ledger_id for row in changed)
+    _apply_deltas(
+        {
+            ledger_id: Counter({from_status: -n, to_status: n})
+            for ledger_id, n in counts.items()
+        }
+    )
+    bump_data_version(counts)
+
+    # 会话中已加载的阀门对象按数据库中的新状态重新读取
+    for row in changed:
+        valve = db.session.identity_map.get(identity_key(Valve, row.id))
+        if valve is not None:
+            db.session.expire(valve)
+
+    update_ledger_statuses(load_many(Ledger, counts))
+    return dict(counts)
+
+
+def set_valve_status(valve, status, user_id=None):
+    """修改单个阀门状态并同步台账计数"""
+    return bool(transition_valves([valve], status, user_id=user_id))
+
+
+def add_valves(valves):
+    """登记新加入台账的阀门（调用方负责 db.session.add）"""
+    deltas = defaultdict(Counter)
+    for valve in valves:
+        if valve.ledger_id:
+            deltas[valve.ledger_id][_status_of(valve)] += 1
+    _apply_deltas(deltas)
+
+
+def valves_with_maintenance(valve_ids):
+    """返回有检修记录的阀门 ID 集合，这些阀门不应删除"""
+    found = set()
+    for chunk in chunked(parse_ids(valve_ids)):
+        found.update(
+            db.session.scalars(
+                select(MaintenanceRecord.valve_id)
+                .where(MaintenanceRecord.valve_id.in_(chunk))
+                .distinct()
+            )
+        )
+    return found
+
+
+def ledgers_with_maintenance(ledger_ids):
+    """返回含有检修记录阀门的台账 ID 集合，这些台账不应删除"""
+    found = set()
+    for chunk in chunked(parse_ids(ledger_ids)):
+        found.update(
+            db.session.scalars(
+                select(Valve.ledger_id)
+                .join(MaintenanceRecord, MaintenanceRecord.valve_id == Valve.id)
+                .where(Valve.ledger_id.in_(chunk))
+                .distinct()
+            )
+        )
+    return found
+
+
+def _delete_photos(condition):
+    """删除满足条件的照片记录，照片文件在事务提交后删除"""
+    photos = ValvePhoto.__table__
+    statement = delete(photos).where(condition)
+    if db.engine.dialect.delete_returning:
+        filenames = db.session.scalars(statement.returning(photos.c.filename)).all()
+    else:
+        filenames = db.session.scalars(
+            select(photos.c.filename).where(condition)
+        ).all()
+        db.session.execute(statement)
+    if filenames:
+        folder = current_app.config["UPLOAD_FOLDER"]
+        session_files = db.session.info.setdefault("files_to_remove", [])
+        session_files.extend(os.path.join(folder, name) for name in filenames)
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_files_after_commit(session):
+    for path in session.info.pop("files_to_remove", ()):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _keep_files_after_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("files_to_remove", None)
+
+
+def delete_valves(valves):
+    """删除阀门及其审批日志、附件和照片，并扣减所属台账计数
+
+    按 ID 分块执行集合 DELETE，不逐个加载关联对象。检修记录不删除，
+    调用方需先用 valves_with_maintenance() 排除有检修记录的阀门。
+    """
+    db.session.flush()
+    valve_ids = [valve.id for valve in valves if valve.id]
+    for model in VALVE_CHILD_MODELS:
+        execute_in_chunks(
+            lambda chunk: delete(model)
+            .where(model.valve_id.in_(chunk))
+            .execution_options(synchronize_session=False),
+            valve_ids,
+        )
+    for chunk in chunked(parse_ids(valve_ids)):
+        _delete_photos(ValvePhoto.__table__.c.valve_id.in_(chunk))
+    execute_in_chunks(
+        lambda chunk: delete(Valve)
+        .where(Valve.id.in_(chunk))
+        .execution_options(synchronize_session=False),
+        valve_ids,
+    )
+    _delete_orphan_drafts()
+
+    deltas = defaultdict(Counter)
+    for valve in valves:
+        if valve.ledger_id:
+            deltas[valve.ledger_id][_status_of(valve)] -= 1
+        db.session.expunge(valve)
+    _apply_deltas(deltas)
+    bump_data_version(deltas)
+
+
+def delete_ledgers(ledgers):
+    """删除台账合集及其全部阀门和关联记录，按台账 ID 分块执行集合 DELETE
+
+    调用方需先用 ledgers_with_maintenance() 排除含有检修记录的台账。
+    """
+    invalidate_dashboard()
+    for chunk in chunked([ledger.id for ledger in ledgers]):
+        valve_ids = select(Valve.id).where(Valve.ledger_id.in_(chunk))
+        for model in VALVE_CHILD_MODELS:
+            db.session.execute(
+                delete(model)
+                .where(model.valve_id.in_(valve_ids))
+                .execution_options(synchronize_session=False)
+            )
+        _delete_photos(ValvePhoto.__table__.c.valve_id.in_(valve_ids))
+        for model, column in (
+            (ApprovalLog, ApprovalLog.ledger_id),
+            (Valve, Valve.ledger_id),
+            (Ledger, Ledger.id),
+        ):
+            db.session.execute(
+                delete(model)
+                .where(column.in_(chunk))
+                .execution_options(synchronize_session=False)
+            )
+    _delete_orphan_drafts()
+    for ledger in ledgers:
+        db.session.expunge(ledger)
+
+
+def _delete_orphan_drafts():
+    # 草稿暂存表很小，阀门删除后用一条语句清理，不随分块重复执行
+    db.session.execute(
+        delete(DraftBuffer)
+        .where(DraftBuffer.valve_id.not_in(select(Valve.id)))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def count_valves_by_status(ledger_ids=None):
+    """用一次 GROUP BY ledger_id, status 查询统计各台账分状态阀门数量
+
+    返回 {ledger_id: Counter({status: n})}，ledger_ids 为 None 时统计全部台账。
+    """
+    query = db.session.query(
+        Valve.ledger_id, Valve.status, func.count(Valve.id)
+    ).filter(Valve.ledger_id.isnot(None))
+    if ledger_ids is not None:
+        ledger_ids = [int(i) for i in ledger_ids]
+        if not ledger_ids:
+            return {}
+        query = query.filter(Valve.ledger_id.in_(ledger_ids))
+
+    counts = defaultdict(Counter)
+    for ledger_id, status, count in query.group_by(
+        Valve.ledger_id, Valve.status
+    ).all():
+        counts[ledger_id][status or "draft"] += count
+    return counts
+
+
+def counters_from_counts(by_status):
+    """把分状态数量转换为台账计数列的取值"""
+    values = {"valve_count": sum(by_status.values())}
+    for status, column in STATUS_COUNT_COLUMNS.items():
+        values[column] = by_status.get(status, 0)
+    return values
+
+
+def rebuild_ledger_counters(ledger_ids=None):
+    """用一次分组查询重建台账计数列，ledger_ids 为 None 时重建全部台账"""
+    ledger_query = Ledger.query
+    if ledger_ids is not None:
+        ledger_ids = [int(i) for i in ledger_ids]
+        if not ledger_ids:
+            return 0
+        ledger_query = ledger_query.filter(Ledger.id.in_(ledger_ids))
+
+    invalidate_dashboard()
+    counts = count_valves_by_status(ledger_ids)
+    ledgers = ledger_query.all()
+    for ledger in ledgers:
+        for column, value in counters_from_counts(
+            counts.get(ledger.id, Counter())
+        ).items():
+            setattr(ledger, column, value)
+    # 批量 SQL 删除/写入不经过 flush 事件，这里一并递增数据版本号
+    bump_data_version([ledger.id for ledger in ledgers])
+    return len(ledgers)
+
+
+def bump_data_version(ledger_ids, session=None):
+    """递增台账数据版本号，使按版本号缓存的派生数据失效"""
+    session = session or db.session
+    ledger_ids = sorted({int(i) for i in ledger_ids if i})
+    if not ledger_ids:
+        return
+    ledgers = Ledger.__table__
+    for chunk in chunked(ledger_ids):
+        session.connection().execute(
+            update(ledgers)
+            .where(ledgers.c.id.in_(chunk))
+            .values(data_version=func.coalesce(ledgers.c.data_version, 0) + 1)
+        )
+    for ledger_id in ledger_ids:
+        ledger = session.identity_map.get(identity_key(Ledger, ledger_id))
+        if ledger is not None:
+            session.expire(ledger, ["data_version", "updated_at"])
+
+
+def _written_ledger_ids(session):
+    ledger_ids = set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Valve):
+            ledger_ids.add(obj.ledger_id)
+    for obj in session.dirty:
+        if isinstance(obj, Valve) and session.is_modified(obj):
+            history = inspect(obj).attrs.ledger_id.history
+            ledger_ids.update(history.deleted or ())
+            ledger_ids.add(obj.ledger_id)
+    ledger_ids.discard(None)
+    return ledger_ids
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_ledgers(session, flush_context):
+    ledger_ids = _written_ledger_ids(session)
+    if ledger_ids:
+        session.info.setdefault("written_ledgers", set()).update(ledger_ids)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _bump_written_ledgers(session, flush_context):
+    ledger_ids = session.info.pop("written_ledgers", None)
+    if ledger_ids:
+        bump_data_version(ledger_ids, session)
+
+
+def ledger_display_status(ledger):
+    """按当前计数推导台账合集的展示状态"""
+    if ledger.pending_count:
+        return "pending"
+    if ledger.rejected_count:
+        return "rejected"
+    if ledger.approved_count and ledger.approved_count == ledger.valve_count:
+        return "approved"
+    return "draft"
+
+
+def _ledger_status_values(ledger):
+    """按计数列推导合集状态相关列的新值，合集没有阀门时返回空字典"""
+    total = ledger.valve_count or 0
+    if total == 0:
+        return {}
+
+    if ledger.pending_count:
+        return {"status": "pending"}
+    if ledger.rejected_count:
+        return {"status": "rejected"}
+    if ledger.draft_count:
+        return {"status": "draft"}
+    if ledger.approved_count == total:
+        now = datetime.utcnow()
+        return {
+            "status": "approved",
+            "approved_at": now,
+            "approved_snapshot_status": "approved",
+            "approved_snapshot_at": now,
+        }
+    return {}
+
+
+def update_ledger_status(ledger):
+    """根据计数列刷新台账合集状态"""
+    for column, value in _ledger_status_values(ledger).items():
+        setattr(ledger, column, value)
+
+
+def update_ledger_statuses(ledgers):
+    """批量刷新多个合集的状态，按更新列分组以 executemany 写入
+
+    Ledger 带版本号列，ORM 刷新时每个合集单独一条 UPDATE，批量操作改用本函数。
+    """
+    groups = defaultdict(list)
+    changed = []
+    for ledger in ledgers:
+        values = _ledger_status_values(ledger)
+        if not values or values == {"status": ledger.status}:
+            continue
+        row = {f"new_{column}": value for column, value in values.items()}
+        row["ledger_id"] = ledger.id
+        groups[tuple(values)].append(row)
+        changed.append((ledger, list(values)))
+
+    ledgers_table = Ledger.__table__
+    for columns, params in groups.items():
+        db.session.execute(
+            update(ledgers_table)
+            .where(ledgers_table.c.id == bindparam("ledger_id"))
+            .values({column: bindparam(f"new_{column}") for column in columns}),
+            params,
+        )
+    for ledger, columns in changed:
+        db.session.expire(ledger, columns + ["updated_at"])
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -13,3 +14,34 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
     TEMPLATES_FOLDER = os.path.join(basedir, "templates")
+    # 首页统计缓存过期时间（秒），写操作会主动清空缓存
+    DASHBOARD_CACHE_TTL = 300
+    # 合集详情页筛选项统计缓存过期时间（秒），键中含台账数据版本号
+    FACET_CACHE_TTL = 600
+    # Excel 导入预览的服务器端暂存目录及保留时间（秒）
+    IMPORT_STAGING_FOLDER = os.environ.get("IMPORT_STAGING_FOLDER") or os.path.join(
+        tempfile.gettempdir(), "valve_imports"
+    )
+    IMPORT_STAGING_TTL = 24 * 3600
+    # 后台任务线程数（0 表示在请求线程内同步执行）、结果文件目录及保留时间（秒）
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS") or 2)
+    JOB_RESULT_FOLDER = os.environ.get("JOB_RESULT_FOLDER") or os.path.join(
+        tempfile.gettempdir(), "valve_jobs"
+    )
+    JOB_RESULT_TTL = 24 * 3600
+    # 合集导出文件缓存目录及总大小上限（字节），超出时按最近使用时间淘汰
+    EXPORT_CACHE_FOLDER = os.environ.get("EXPORT_CACHE_FOLDER") or os.path.join(
+        tempfile.gettempdir(), "valve_export_cache"
+    )
+    EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    # 单个阀门 PDF 数据表缓存目录及总大小上限（字节）
+    PDF_CACHE_FOLDER = os.environ.get("PDF_CACHE_FOLDER") or os.path.join(
+        tempfile.gettempdir(), "valve_pdf_cache"
+    )
+    PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    # PDF 排版进程数（0 表示在当前进程内排版）
+    PDF_WORKERS = int(os.environ.get("PDF_WORKERS") or os.cpu_count() or 2)
+    # 草稿自动保存在暂存表中合并，距首次暂存超过该秒数才写入阀门（0 表示不暂存）
+    DRAFT_FLUSH_SECONDS = int(os.environ.get("DRAFT_FLUSH_SECONDS") or 30)
+    # 台账检索后端：fts5（SQLite 全文索引）或 like
+    VALVE_SEARCH_BACKEND = os.environ.get("VALVE_SEARCH_BACKEND") or "fts5"
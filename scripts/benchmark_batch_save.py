@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""合集表格批量保存基准
+
+在临时 SQLite 数据库中按指定行数（一半修改已有阀门、一半新增）分别测量
+批量保存（save_valve_rows）与旧版逐行 get + setattr + flush 的耗时和 SQL 语句数。
+
+    python scripts/benchmark_batch_save.py --rows 100 1000 10000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert
+
+from app import create_app
+from app.models import db, Ledger, User, Valve
+from app.services.batch_save import save_valve_rows
+from app.services.valve_status import (
+    add_valves,
+    rebuild_ledger_counters,
+    set_valve_status,
+    update_ledger_status,
+)
+from config import Config
+
+
+def seed(rows):
+    """新建合集并写入 rows // 2 个已审批阀门，返回 (合集, 用户 ID, 阀门 ID)"""
+    admin = User.query.filter_by(username="admin").first()
+    if admin is None:
+        admin = User(username="admin", role="admin")
+        admin.set_password("admin123")
+        db.session.add(admin)
+        db.session.flush()
+    ledger = Ledger(名称=f"基准-{time.time_ns()}", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    db.session.execute(
+        insert(Valve),
+        [
+            {
+                "ledger_id": ledger.id,
+                "位号": f"L{ledger.id}-{i:06d}",
+                "status": "approved",
+                "created_by": admin.id,
+            }
+            for i in range(rows // 2)
+        ],
+    )
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    ids = [v.id for v in Valve.query.filter_by(ledger_id=ledger.id)]
+    return ledger, admin.id, ids
+
+
+def make_items(ledger, ids, rows):
+    items = [{"id": i, "data": {"名称": "调节阀", "备注": "批量修改"}} for i in ids]
+    items += [
+        {"data": {"位号": f"N{ledger.id}-{i:06d}", "名称": "新增"}}
+        for i in range(rows - len(ids))
+    ]
+    return items
+
+
+def legacy_save(ledger, user_id, items):
+    approved_to_draft = False
+    for item in items:
+        if item.get("id"):
+            valve = Valve.query.get(item["id"])
+            if valve.status == "approved":
+                set_valve_status(valve, "draft")
+                approved_to_draft = True
+        else:
+            valve = Valve(ledger_id=ledger.id, created_by=user_id, status="draft")
+            db.session.add(valve)
+            add_valves([valve])
+        for key, value in item["data"].items():
+            if hasattr(valve, key):
+                setattr(valve, key, value)
+        db.session.flush()
+    db.session.commit()
+    if approved_to_draft:
+        update_ledger_status(ledger)
+
+
+def bulk_save(ledger, user_id, items):
+    save_valve_rows(ledger, items, user_id)
+    db.session.commit()
+
+
+def measure(name, func, rows):
+    ledger, user_id, ids = seed(rows)
+    items = make_items(ledger, ids, rows)
+    db.session.expunge_all()
+    ledger = db.session.get(Ledger, ledger.id)
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    started = time.perf_counter()
+    func(ledger, user_id, items)
+    elapsed = time.perf_counter() - started
+    event.remove(db.engine, "before_cursor_execute", count)
+    print(f"{name:<8} {rows:>7} rows {elapsed:8.3f}s  {len(statements):>7} statements")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(folder, "bench.db")
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            for rows in args.rows:
+                measure("bulk", bulk_save, rows)
+                if not args.skip_legacy:
+                    measure("legacy", legacy_save, rows)
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
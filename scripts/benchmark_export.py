@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""台账 Excel 导出内存基准
+
+在临时 SQLite 数据库中生成指定行数的已审批台账，分别测量流式导出与旧版
+（ORM 对象 + pandas DataFrame + BytesIO）导出的耗时和 Python 堆内存峰值（tracemalloc）。
+
+    python scripts/benchmark_export.py --rows 200000
+    python scripts/benchmark_export.py --rows 200000 --skip-legacy
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from app import create_app
+from app.models import db, User, Valve
+from app.routes.valves.exports import iter_valve_export_rows
+from app.routes.valves.forms import VALVE_EXPORT_COLUMNS, get_valve_export_data
+from app.services.xlsx import stream_xlsx
+from config import Config
+
+
+def seed(rows):
+    admin = User(username="admin", role="admin")
+    admin.set_password("admin123")
+    db.session.add(admin)
+    db.session.flush()
+    batch = []
+    for i in range(rows):
+        record = {name: f"{name}-{i}" for name in VALVE_EXPORT_COLUMNS}
+        record.update(位号=f"FV-{i:07d}", status="approved", created_by=admin.id)
+        batch.append(record)
+        if len(batch) == 5000:
+            db.session.execute(insert(Valve), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Valve), batch)
+    db.session.commit()
+
+
+def streaming_export():
+    size = 0
+    for data in stream_xlsx(VALVE_EXPORT_COLUMNS, iter_valve_export_rows()):
+        size += len(data)
+    return size
+
+
+def legacy_export():
+    import pandas as pd
+
+    valves = Valve.query.filter_by(status="approved").all()
+    df = pd.DataFrame([get_valve_export_data(v) for v in valves])
+    buffer = BytesIO()
+    df.to_excel(buffer, index=False, engine="openpyxl")
+    buffer.seek(0)
+    return len(buffer.read())
+
+
+def measure(name, func):
+    db.session.expunge_all()
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<10} {elapsed:8.2f}s  peak {peak / 1024 / 1024:8.1f} MiB  "
+        f"file {size / 1024 / 1024:6.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+
+        class BenchmarkConfig(Config):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(folder, "bench.db")
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            print(f"Seeding {args.rows} valves...")
+            seed(args.rows)
+            measure("streaming", streaming_export)
+            if not args.skip_legacy:
+                measure("legacy", legacy_export)
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""为现有数据库创建台账全文索引（valves_fts）及同步触发器，并重建索引内容"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models import db
+from app.services.search import create_fts_index, rebuild_fts_index
+
+
+def build_search_index():
+    app = create_app()
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if not create_fts_index(conn):
+                print("FTS5 unavailable, search will use LIKE")
+                return
+            rebuild_fts_index(conn)
+        print("Search index rebuilt")
+
+
+if __name__ == "__main__":
+    build_search_index()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""为 ledgers 表补齐数据版本号列 data_version（筛选项与导出缓存据此失效），已有行为 0"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text
+
+from app import create_app
+from app.models import db
+
+
+def add_data_version_column():
+    app = create_app()
+    with app.app_context():
+        existing = {col["name"] for col in inspect(db.engine).get_columns("ledgers")}
+        if "data_version" in existing:
+            print("  ledgers.data_version already exists")
+        else:
+            db.session.execute(
+                text("ALTER TABLE ledgers ADD COLUMN data_version INTEGER DEFAULT 0")
+            )
+            print("  Added column ledgers.data_version")
+        db.session.commit()
+        print("Migration complete!")
+
+
+if __name__ == "__main__":
+    add_data_version_column()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""为现有数据库补建 models.py 中声明的索引，并刷新查询优化器统计信息"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from app import create_app
+from app.models import db
+
+
+def migrate_indexes():
+    app = create_app()
+    with app.app_context():
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+                print(f"  Ensured index {index.name} on {table.name}")
+
+        with db.engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        print("Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate_indexes()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""为 valves、ledgers 表补齐行版本号列 version（乐观锁），已有行的版本号为 1"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text
+
+from app import create_app
+from app.models import db
+
+
+def add_version_columns():
+    app = create_app()
+    with app.app_context():
+        inspector = inspect(db.engine)
+        for table in ("valves", "ledgers"):
+            existing = {col["name"] for col in inspector.get_columns(table)}
+            if "version" in existing:
+                print(f"  {table}.version already exists")
+                continue
+            db.session.execute(
+                text(
+                    f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+                )
+            )
+            print(f"  Added column {table}.version")
+        db.session.commit()
+        print("Migration complete!")
+
+
+if __name__ == "__main__":
+    add_version_columns()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""重建台账合集的各状态计数列（valve_count/draft_count/pending_count/approved_count/rejected_count）
+
+旧数据库缺少计数列时会先补齐列，再用一次分组查询重建全部台账的计数。
+缺少 data_version 列时需先运行 scripts/migrate_add_data_version.py。
+使用 --check 只报告计数与实际数据不一致的台账，不做修改。
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text
+
+from app import create_app
+from app.models import db, Ledger
+from app.services.valve_status import (
+    COUNTER_COLUMNS,
+    count_valves_by_status,
+    counters_from_counts,
+    rebuild_ledger_counters,
+)
+
+
+def add_missing_columns():
+    existing = {col["name"] for col in inspect(db.engine).get_columns("ledgers")}
+    if "data_version" not in existing:
+        sys.exit(
+            "ledgers.data_version 列不存在，请先运行 scripts/migrate_add_data_version.py"
+        )
+    for column in COUNTER_COLUMNS:
+        if column not in existing:
+            db.session.execute(
+                text(f"ALTER TABLE ledgers ADD COLUMN {column} INTEGER DEFAULT 0")
+            )
+            print(f"  Added column ledgers.{column}")
+    db.session.commit()
+
+
+def check_counters():
+    counts = count_valves_by_status()
+    drifted = 0
+    for ledger in Ledger.query.all():
+        expected = counters_from_counts(counts.get(ledger.id, {}))
+        actual = {column: getattr(ledger, column) for column in expected}
+        if actual != expected:
+            drifted += 1
+            print(f"  Ledger {ledger.id} ({ledger.名称}): {actual} -> {expected}")
+    print(f"Found {drifted} ledgers with drifted counters")
+
+
+def rebuild_counters(check_only=False):
+    app = create_app()
+    with app.app_context():
+        add_missing_columns()
+        if check_only:
+            check_counters()
+            return
+        count = rebuild_ledger_counters()
+        db.session.commit()
+        print(f"Rebuilt counters for {count} ledgers")
+
+
+if __name__ == "__main__":
+    rebuild_counters(check_only="--check" in sys.argv[1:])
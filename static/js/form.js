@@ -189,7 +189,11 @@ document.getElementById('valveForm').addEventListener('submit', function(e) {
     if (!valid) {
         e.preventDefault();
         alert('请填写所有必填字段');
+        return;
     }
+    // 表单已包含全部字段，服务端会丢弃暂存的自动保存内容
+    formSubmitting = true;
+    if (autoSaveTimeout) clearTimeout(autoSaveTimeout);
 });
 
 document.querySelectorAll('[required]').forEach(field => {
@@ -203,37 +207,72 @@ document.querySelectorAll('[required]').forEach(field => {
 let autoSaveTimeout = null;
 let currentValveId = window.currentValveId;
 let currentLedgerId = window.currentLedgerId;
+let autoSaveDisabled = false;
+// 服务端暂存中还有未写入阀门的自动保存内容
+let draftBuffered = false;
+let formSubmitting = false;
+
+// 行版本号：保存时回传给服务端检测并发修改，自动保存成功后更新，
+// 使随后提交的表单带上最新版本号
+function currentValveVersion() {
+    const input = document.getElementById('valve-version-input');
+    return input ? input.value : null;
+}
+
+function setValveVersion(version) {
+    let input = document.getElementById('valve-version-input');
+    if (!input) {
+        input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = 'version';
+        input.id = 'valve-version-input';
+        document.getElementById('valveForm').appendChild(input);
+    }
+    input.value = version;
+}
+
+function draftPayload(flush) {
+    const formData = {};
+    document.querySelectorAll('#valveForm input, #valveForm textarea, #valveForm select').forEach(field => {
+        if (field.name) {
+            formData[field.name] = field.value;
+        }
+    });
+
+    return JSON.stringify({
+        valve_id: currentValveId,
+        version: currentValveVersion(),
+        ledger_id: currentLedgerId,
+        formData: formData,
+        attachments: collectAttachments(),
+        flush: flush
+    });
+}
 
 function autoSave() {
     if (autoSaveTimeout) clearTimeout(autoSaveTimeout);
+    if (autoSaveDisabled) return;
     
     autoSaveTimeout = setTimeout(function() {
-        const formData = {};
-        document.querySelectorAll('#valveForm input, #valveForm textarea, #valveForm select').forEach(field => {
-            if (field.name) {
-                formData[field.name] = field.value;
-            }
-        });
-        
-        const attachments = collectAttachments();
-        
+        autoSaveTimeout = null;
         fetch(window.saveDraftUrl, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                valve_id: currentValveId,
-                ledger_id: currentLedgerId,
-                formData: formData,
-                attachments: attachments
-            })
+            body: draftPayload(false)
         })
         .then(r => r.json())
         .then(data => {
             if (data.success && data.valve_id) {
                 currentValveId = data.valve_id;
+                setValveVersion(data.version);
+                draftBuffered = data.result === 'buffered';
                 console.log('草稿已自动保存');
+            } else if (data.conflicts) {
+                // 其他用户已修改，停止自动保存，避免覆盖对方的修改
+                autoSaveDisabled = true;
+                alert('该台账已被其他用户修改，草稿未保存，请刷新页面后重新编辑');
             }
         })
         .catch(err => console.error('自动保存失败:', err));
@@ -245,4 +284,19 @@ document.querySelectorAll('#valveForm input, #valveForm textarea, #valveForm sel
     field.addEventListener('keyup', autoSave);
 });
 
+// 离开页面时把暂存的自动保存内容（以及尚未发出的一次）立即写入阀门
+window.addEventListener('pagehide', function() {
+    if (formSubmitting || autoSaveDisabled || !currentValveId) return;
+    if (!draftBuffered && !autoSaveTimeout) return;
+    if (autoSaveTimeout) clearTimeout(autoSaveTimeout);
+    fetch(window.saveDraftUrl, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: draftPayload(true),
+        keepalive: true
+    });
+});
+
 updateProgress();
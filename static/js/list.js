@@ -82,12 +82,14 @@ function showFilterDropdown(event, field) {
         <div class="filter-options" style="max-height: 280px; overflow-y: auto; padding-right: 4px;">`;
     
     const selectedValues = activeFilters[field] || [];
+    const counts = (window.facetCounts || {})[field] || {};
     
     filterOptions[field].forEach(value => {
         const isChecked = selectedValues.includes(value);
+        const count = counts[value] !== undefined ? `<span class="ms-1" style="color: #94a3b8;">(${counts[value]})</span>` : '';
         html += `<div class="form-check d-flex align-items-center py-1" style="min-height: 32px;">
             <input type="checkbox" class="form-check-input filter-option" name="${field}" value="${value}" ${isChecked ? 'checked' : ''} style="width: 16px; height: 16px; margin-right: 8px;">
-            <label class="form-check-label" style="word-break: break-all; font-size: 13px; color: #334155;">${value}</label>
+            <label class="form-check-label" style="word-break: break-all; font-size: 13px; color: #334155;">${value}${count}</label>
         </div>`;
     });
     
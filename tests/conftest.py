@@ -4,16 +4,26 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
 from app import create_app, db
 from app.models import User, Valve, Setting
+from app.services.cache import CACHES
+from config import Config
+
+
+class TestConfig(Config):
+    # 数据库引擎在 create_app 中创建，必须在工厂调用前指定测试库
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    WTF_CSRF_ENABLED = False
 
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
-    app.config["WTF_CSRF_ENABLED"] = False
+    app = create_app(TestConfig)
+    for cache in CACHES.values():
+        cache.clear()
 
     with app.app_context():
         db.create_all()
@@ -46,3 +56,23 @@ def init_database(app):
 
         db.session.remove()
         db.drop_all()
+
+
+@pytest.fixture
+def count_queries(app):
+    """统计代码块内执行的 SQL 语句"""
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    return counter
@@ -3,7 +3,7 @@ def test_login_page(client, init_database):
     """测试登录页面"""
     response = client.get('/login')
     assert response.status_code == 200
-    assert b'登录' in response.data
+    assert '登录'.encode() in response.data
 
 def test_login_success(client, init_database):
     """测试登录成功"""
@@ -20,7 +20,7 @@ def test_login_failure(client, init_database):
         'password': 'wrongpassword'
     }, follow_redirects=True)
     assert response.status_code == 200
-    assert b'用户名或密码错误' in response.data
+    assert '用户名或密码错误'.encode() in response.data
 
 def test_logout(client, init_database):
     """测试登出"""
@@ -0,0 +1,116 @@
+# coding=utf-8
+from app.models import db, Ledger, Valve, User, ApprovalLog, ValvePhoto
+from app.models import MaintenanceRecord
+from app.services.loading import IN_CHUNK_SIZE, load_many
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _make_ledgers(count, valves_per_ledger=1, status="draft"):
+    admin = User.query.filter_by(username="admin").first()
+    ledgers = [Ledger(名称=f"批量合集{i}", created_by=admin.id) for i in range(count)]
+    db.session.add_all(ledgers)
+    db.session.flush()
+    db.session.add_all(
+        Valve(ledger_id=ledger.id, 位号=f"FV-{ledger.id}-{i}", status=status,
+              created_by=admin.id)
+        for ledger in ledgers
+        for i in range(valves_per_ledger)
+    )
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id for ledger in ledgers])
+    db.session.commit()
+    return [ledger.id for ledger in ledgers]
+
+
+def _round_trips(client, count_queries, url, data):
+    # 两次测量前会话状态一致，登录用户等查询次数相同
+    db.session.expire_all()
+    with count_queries() as queries:
+        client.post(url, data=data)
+    return len(queries)
+
+
+def test_load_many_chunks_and_order(app, init_database, count_queries):
+    """测试批量加载按块查询、保持提交顺序并忽略无效 ID"""
+    (ledger_id,) = _make_ledgers(1, IN_CHUNK_SIZE + 10)
+    ids = [v.id for v in Valve.query.filter_by(ledger_id=ledger_id)]
+    submitted = [str(i) for i in reversed(ids)] + ["abc", "999999", str(ids[0])]
+
+    db.session.expunge_all()
+    with count_queries() as queries:
+        valves = load_many(Valve, submitted)
+    assert len(queries) == 2
+    assert [v.id for v in valves] == list(reversed(ids))
+
+
+def test_batch_delete_valves_1000_ids(client, init_database, count_queries):
+    """测试批量删除 1000 条台账的往返次数与提交数量无关"""
+    (ledger_id,) = _make_ledgers(1, 1010)
+    ids = [v.id for v in Valve.query.filter_by(ledger_id=ledger_id)]
+    admin = User.query.filter_by(username="admin").first()
+    db.session.add(
+        ValvePhoto(valve_id=ids[-1], filename="a.jpg", uploaded_by=admin.id)
+    )
+    db.session.add(ApprovalLog(valve_id=ids[-1], ledger_id=ledger_id, action="submit"))
+    db.session.commit()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    url = "/valves/batch-delete"
+    few = _round_trips(client, count_queries, url, {"ids": ids[:10]})
+    many = _round_trips(client, count_queries, url, {"ids": ids[10:]})
+
+    # 1000 个 ID 分为 2 块，每个分块语句多执行一次
+    assert many - few <= 6
+    assert Valve.query.filter_by(ledger_id=ledger_id).count() == 0
+    assert ValvePhoto.query.count() == ApprovalLog.query.count() == 0
+    assert db.session.get(Ledger, ledger_id).valve_count == 0
+
+
+def test_batch_ledger_endpoints_1000_ids(client, init_database, count_queries):
+    """测试批量提交、删除 1000 个合集的往返次数与提交数量无关"""
+    small = _make_ledgers(10)
+    large = _make_ledgers(1000)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    url = "/ledgers/batch-submit"
+    few = _round_trips(client, count_queries, url, {"ledger_ids": small})
+    many = _round_trips(client, count_queries, url, {"ledger_ids": large})
+    assert Valve.query.filter_by(status="pending").count() == 1010
+    assert many - few <= 6
+
+    rebuild_ledger_counters(small + large)
+    Valve.query.update({"status": "draft"})
+    rebuild_ledger_counters(small + large)
+    db.session.commit()
+
+    url = "/ledgers/batch-delete"
+    few = _round_trips(client, count_queries, url, {"ledger_ids": small})
+    many = _round_trips(client, count_queries, url, {"ledger_ids": large})
+    assert many - few <= 10
+    assert Ledger.query.count() == Valve.query.count() == 0
+
+
+def test_delete_keeps_maintenance_history(client, init_database, app, tmp_path):
+    """测试有检修记录的阀门、合集不删除；删除阀门时一并删除照片文件"""
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    kept_ledger, photo_ledger = _make_ledgers(2, 1)
+    kept = Valve.query.filter_by(ledger_id=kept_ledger).one()
+    photo_valve = Valve.query.filter_by(ledger_id=photo_ledger).one()
+    db.session.add(MaintenanceRecord(valve_id=kept.id, 检修内容="更换填料"))
+    db.session.add(ValvePhoto(valve_id=photo_valve.id, filename="p.jpg"))
+    db.session.commit()
+    (tmp_path / "p.jpg").write_bytes(b"jpg")
+
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    client.post("/valves/batch-delete", data={"ids": [kept.id, photo_valve.id]})
+    client.post(
+        "/ledgers/batch-delete", data={"ledger_ids": [kept_ledger, photo_ledger]}
+    )
+
+    db.session.expire_all()
+    assert db.session.get(Valve, kept.id) is not None
+    assert MaintenanceRecord.query.filter_by(valve_id=kept.id).count() == 1
+    assert db.session.get(Ledger, kept_ledger) is not None
+    assert db.session.get(Valve, photo_valve.id) is None
+    assert ValvePhoto.query.count() == 0
+    assert not (tmp_path / "p.jpg").exists()
@@ -0,0 +1,175 @@
+# coding=utf-8
+from app.models import db, Ledger, Valve, User
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _ledger(statuses):
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="批量保存", created_by=admin.id, status="approved")
+    db.session.add(ledger)
+    db.session.flush()
+    valves = [
+        Valve(
+            ledger_id=ledger.id,
+            位号=f"BS-{ledger.id}-{i}",
+            status=status,
+            created_by=admin.id,
+        )
+        for i, status in enumerate(statuses)
+    ]
+    db.session.add_all(valves)
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger.id, [valve.id for valve in valves]
+
+
+def _save(client, ledger_id, items):
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    return client.post(f"/ledger/{ledger_id}/valve/batch-save", json=items)
+
+
+def test_batch_save_response(client, init_database):
+    """测试批量保存的返回值、字段过滤、已审批退回草稿与合集状态"""
+    ledger_id, (approved_id, draft_id) = _ledger(["approved", "draft"])
+    other_id, (other_valve,) = _ledger(["draft"])
+    response = _save(
+        client,
+        ledger_id,
+        [
+            {"data": {"位号": "BS-NEW", "名称": "新阀门"}},
+            {"id": approved_id, "data": {"名称": "改名", "created_by": 999}},
+            {"id": other_valve, "data": {"名称": "越权"}},
+            {"id": str(draft_id), "data": {}},
+        ],
+    ).get_json()
+
+    new_id = Valve.query.filter_by(位号="BS-NEW").one().id
+    versions = [result.pop("version") for result in response["results"]]
+    assert all(versions)
+    assert response == {
+        "success": True,
+        "saved_ids": [new_id, approved_id, draft_id],
+        "results": [
+            {"id": new_id, "result": "created"},
+            {"id": approved_id, "result": "updated"},
+            {"id": draft_id, "result": "unchanged"},
+        ],
+        "errors": [{"id": other_valve, "error": "台账不存在"}],
+    }
+    db.session.expire_all()
+    approved = db.session.get(Valve, approved_id)
+    assert (approved.名称, approved.status) == ("改名", "draft")
+    assert approved.created_by != 999
+    assert db.session.get(Valve, other_valve).名称 is None
+    ledger = db.session.get(Ledger, ledger_id)
+    assert (ledger.valve_count, ledger.draft_count, ledger.approved_count) == (3, 3, 0)
+    assert ledger.status == "draft"
+
+
+def test_batch_save_statement_count(client, init_database, count_queries):
+    """测试批量保存的语句数不随行数增长"""
+    ledger_id, ids = _ledger(["draft", "approved"] * 5)
+
+    def statements(rows):
+        items = [{"id": i, "data": {"备注": f"第{rows}次"}} for i in ids[:rows]]
+        items += [{"data": {"位号": f"NEW-{rows}-{i}"}} for i in range(rows)]
+        with count_queries() as queries:
+            assert _save(client, ledger_id, items).get_json()["success"]
+        return [q for q in queries if "valves" in q]
+
+    assert len(statements(2)) == len(statements(10))
+    db.session.expire_all()
+    assert {v.备注 for v in Valve.query.filter(Valve.id.in_(ids))} == {"第10次"}
+    assert db.session.get(Ledger, ledger_id).valve_count == 22
+
+
+def test_batch_save_writes_only_changed_fields(client, init_database, count_queries):
+    """测试未修改的行不写入、不退回草稿，修改的行只更新变化的列"""
+    ledger_id, (first, second) = _ledger(["approved", "approved"])
+    db.session.get(Valve, first).名称 = "调节阀"
+    db.session.commit()
+    before = db.session.get(Valve, second).updated_at
+
+    row = {"位号": f"BS-{ledger_id}-1", "名称": "", "备注": None}
+    with count_queries() as queries:
+        response = _save(
+            client,
+            ledger_id,
+            [
+                {"id": first, "data": {"位号": f"BS-{ledger_id}-0", "名称": "切断阀"}},
+                {"id": second, "data": row},
+            ],
+        ).get_json()
+    assert [r["result"] for r in response["results"]] == ["updated", "unchanged"]
+    updates = [q for q in queries if q.startswith("UPDATE valves")]
+    assert len(updates) == 1
+    assert '"名称"' in updates[0] and '"位号"' not in updates[0]
+
+    db.session.expire_all()
+    assert db.session.get(Valve, first).status == "draft"
+    unchanged = db.session.get(Valve, second)
+    assert unchanged.status == "approved" and unchanged.updated_at == before
+
+
+def test_save_draft_reports_result(client, init_database):
+    """测试草稿保存返回 created / updated / unchanged"""
+    ledger_id, _ = _ledger(["approved"])
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    def save(valve_id, form):
+        # flush 跳过自动保存暂存，直接写入阀门
+        payload = {"valve_id": valve_id, "ledger_id": ledger_id, "formData": form}
+        payload["flush"] = True
+        return client.post("/valve/draft/save", json=payload).get_json()
+
+    created = save(None, {"位号": "DRAFT-1", "status": "approved"})
+    assert created["result"] == "created"
+    valve_id = created["valve_id"]
+    assert save(valve_id, {"位号": "DRAFT-1", "名称": ""})["result"] == "unchanged"
+    assert save(valve_id, {"位号": "DRAFT-1", "名称": "阀"})["result"] == "updated"
+    valve = db.session.get(Valve, valve_id)
+    assert (valve.名称, valve.status) == ("阀", "draft")
+
+
+def test_patch_cells(client, init_database):
+    """测试按单元格增量保存：返回新版本号，版本冲突时整批不写入"""
+    ledger_id, (first, second) = _ledger(["draft", "approved"])
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    url = f"/api/ledger/{ledger_id}/valves"
+    items = client.get(url + "?from=mine").get_json()["items"]
+    base = {item["id"]: item["version"] for item in items}
+
+    def cell(valve_id, field, value, version=None):
+        version = version or base[valve_id]
+        return {"id": valve_id, "field": field, "value": value, "base_version": version}
+
+    response = client.patch(
+        url,
+        json=[
+            cell(first, "名称", "调节阀"),
+            cell(first, "备注", "更换"),
+            cell(second, "名称", None),
+        ],
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r["result"] for r in body["results"]] == ["updated", "unchanged"]
+    assert body["versions"][str(first)] != base[first]
+    assert body["versions"][str(second)] == base[second]
+    db.session.expire_all()
+    valve = db.session.get(Valve, first)
+    assert (valve.名称, valve.备注) == ("调节阀", "更换")
+    assert db.session.get(Valve, second).status == "approved"
+
+    # 使用旧版本号提交：整批拒绝，另一行的修改也不写入
+    response = client.patch(url, json=[cell(second, "名称", "新"), cell(first, "名称", "旧")])
+    assert response.status_code == 409
+    (conflict,) = response.get_json()["conflicts"]
+    assert conflict["id"] == first
+    assert conflict["version"] == body["versions"][str(first)]
+    db.session.expire_all()
+    assert db.session.get(Valve, second).名称 is None
+
+    response = client.patch(url, json=[cell(first, "status", "approved")])
+    assert response.status_code == 400
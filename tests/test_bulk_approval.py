@@ -0,0 +1,85 @@
+# coding=utf-8
+from app.models import db, Ledger, Valve, User, ApprovalLog
+from app.services.valve_status import bulk_transition, rebuild_ledger_counters
+
+
+def _make_ledgers(ledger_count, valve_count):
+    admin = User.query.filter_by(username="admin").first()
+    ledger_ids = []
+    for n in range(ledger_count):
+        ledger = Ledger(名称=f"审批合集{n}", created_by=admin.id)
+        db.session.add(ledger)
+        db.session.flush()
+        db.session.add_all(
+            Valve(ledger_id=ledger.id, 位号=f"FV-{ledger.id}-{i}", status="pending",
+                  created_by=admin.id)
+            for i in range(valve_count)
+        )
+        ledger_ids.append(ledger.id)
+    db.session.commit()
+    rebuild_ledger_counters(ledger_ids)
+    db.session.commit()
+    return ledger_ids
+
+
+def test_bulk_transition_counts_and_logs(app, init_database):
+    """测试批量审批返回各台账数量并写入审批日志"""
+    ledger_ids = _make_ledgers(2, 3)
+    admin = User.query.filter_by(username="admin").first()
+    valve = Valve.query.filter_by(ledger_id=ledger_ids[0]).first()
+    valve.status = "draft"
+    db.session.commit()
+    rebuild_ledger_counters(ledger_ids)
+    db.session.commit()
+
+    counts = bulk_transition(
+        ledger_ids, "pending", "approved", user_id=admin.id, action="approve"
+    )
+    db.session.commit()
+
+    assert counts == {ledger_ids[0]: 2, ledger_ids[1]: 3}
+    assert ApprovalLog.query.filter_by(action="approve").count() == 5
+    assert valve.status == "draft"
+    approved = Valve.query.filter_by(status="approved").all()
+    assert all(v.approved_by == admin.id and v.approved_at for v in approved)
+
+    first, second = (db.session.get(Ledger, i) for i in ledger_ids)
+    assert (first.pending_count, first.approved_count, first.draft_count) == (0, 2, 1)
+    assert second.status == "approved"
+    assert second.approved_snapshot_status == "approved"
+
+
+def test_batch_approve_constant_queries(client, init_database, count_queries):
+    """测试批量审批的 SQL 语句数量与阀门数量无关"""
+    small = _make_ledgers(2, 2)
+    large = _make_ledgers(2, 50)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    client.post("/approvals/batch-approve", data={"ledger_ids": []})
+
+    with count_queries() as few:
+        client.post("/approvals/batch-approve", data={"ledger_ids": small})
+    with count_queries() as many:
+        client.post("/approvals/batch-approve", data={"ledger_ids": large})
+
+    assert len(many) == len(few)
+    assert Valve.query.filter_by(status="pending").count() == 0
+    assert ApprovalLog.query.count() == 104
+
+
+def test_detail_batch_reject_selected(client, init_database):
+    """测试详情页仅驳回选中的待审批阀门"""
+    (ledger_id,) = _make_ledgers(1, 3)
+    other_id = _make_ledgers(1, 1)[0]
+    valves = Valve.query.filter_by(ledger_id=ledger_id).order_by(Valve.id).all()
+    other = Valve.query.filter_by(ledger_id=other_id).first()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    client.post(
+        f"/ledger/{ledger_id}?from=mine",
+        data={"action": "batch_reject", "valve_ids": [valves[0].id, other.id]},
+    )
+    statuses = [
+        db.session.get(Valve, v.id).status for v in valves + [other]
+    ]
+    assert statuses == ["rejected", "pending", "pending", "pending"]
+    assert db.session.get(Ledger, ledger_id).rejected_count == 1
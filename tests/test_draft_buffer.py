@@ -0,0 +1,93 @@
+# coding=utf-8
+import json
+from datetime import datetime, timedelta
+
+from app.models import db, DraftBuffer, Ledger, Valve, ValveAttachment, User
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _draft_valve():
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="自动保存", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    valve = Valve(ledger_id=ledger.id, 位号="AS-1", status="draft", created_by=admin.id)
+    db.session.add(valve)
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger.id, valve.id
+
+
+def _autosave(client, valve_id, form, **extra):
+    payload = dict({"valve_id": valve_id, "formData": form, "version": 1}, **extra)
+    return client.post("/valve/draft/save", json=payload)
+
+
+def test_autosaves_are_coalesced(client, init_database, count_queries):
+    """测试连续的自动保存只写暂存表，flush 时一次写入阀门，相同附件不重建"""
+    _, valve_id = _draft_valve()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    with count_queries() as queries:
+        for i in range(10):
+            body = _autosave(client, valve_id, {"位号": "AS-1", "名称": f"阀{i}"})
+            assert body.get_json()["result"] == "buffered"
+    assert not [q for q in queries if q.startswith("UPDATE valves")]
+    assert db.session.get(Valve, valve_id).名称 is None
+    assert DraftBuffer.query.one().save_count == 10
+
+    attachments = json.dumps([{"attachment_type": "定位器", "name": "A"}])
+    body = _autosave(
+        client, valve_id, {"备注": "完成"}, attachments=attachments, flush=True
+    ).get_json()
+    assert (body["result"], body["version"]) == ("updated", 2)
+    db.session.expire_all()
+    valve = db.session.get(Valve, valve_id)
+    assert (valve.名称, valve.备注, valve.version) == ("阀9", "完成", 2)
+    assert DraftBuffer.query.count() == 0
+    (attachment,) = ValveAttachment.query.all()
+
+    body = _autosave(
+        client, valve_id, {"备注": "完成"}, version=2, attachments=attachments, flush=True
+    ).get_json()
+    assert body["result"] == "unchanged"
+    assert [a.id for a in ValveAttachment.query] == [attachment.id]
+
+
+def test_drafts_flushed_when_due_or_submitted(client, init_database, app):
+    """测试暂存到期后随下一次自动保存写入，提交合集审批前写入暂存内容"""
+    ledger_id, valve_id = _draft_valve()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    _autosave(client, valve_id, {"名称": "调节阀"})
+    entry = DraftBuffer.query.one()
+    seconds = app.config["DRAFT_FLUSH_SECONDS"]
+    entry.created_at = datetime.utcnow() - timedelta(seconds=seconds + 1)
+    db.session.commit()
+    body = _autosave(client, valve_id, {"备注": "到期"}).get_json()
+    assert body["result"] == "updated"
+
+    _autosave(client, valve_id, {"名称": "切断阀"}, version=2)
+    client.post(f"/ledger/{ledger_id}/submit")
+    db.session.expire_all()
+    valve = db.session.get(Valve, valve_id)
+    assert (valve.名称, valve.备注) == ("切断阀", "到期")
+    assert valve.status in ("pending", "approved")
+    assert DraftBuffer.query.count() == 0
+
+
+def test_stale_draft_is_discarded(client, init_database):
+    """测试暂存期间阀门被其他人修改时，写入返回 409 并丢弃暂存"""
+    ledger_id, valve_id = _draft_valve()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    _autosave(client, valve_id, {"名称": "暂存"})
+    client.post(
+        f"/ledger/{ledger_id}/valve/batch-save",
+        json=[{"id": valve_id, "data": {"名称": "表格修改"}}],
+    )
+
+    response = _autosave(client, valve_id, {"备注": "x"}, flush=True)
+    assert response.status_code == 409
+    assert response.get_json()["conflicts"][0]["values"]["名称"] == "表格修改"
+    assert DraftBuffer.query.count() == 0
+    db.session.expire_all()
+    assert db.session.get(Valve, valve_id).名称 == "表格修改"
@@ -0,0 +1,281 @@
+# coding=utf-8
+import tracemalloc
+from html import unescape
+from io import BytesIO
+from urllib.parse import parse_qs
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import insert
+
+from app.models import db, Valve, User
+from app.routes.valves.exports import iter_valve_export_rows
+from app.routes.valves.forms import VALVE_EXPORT_COLUMNS
+from app.services import export_formats
+from app.services.xlsx import column_letter, stream_xlsx
+
+
+@pytest.fixture(autouse=True)
+def export_cache_folder(app, tmp_path):
+    app.config["EXPORT_CACHE_FOLDER"] = str(tmp_path / "export_cache")
+    return tmp_path / "export_cache"
+
+
+def _seed(count, start=0):
+    admin = User.query.filter_by(username="admin").first()
+    db.session.execute(
+        insert(Valve),
+        [
+            {"位号": f"FV-{i:06d}", "名称": "调节阀", "备注": "a<b&c\x01",
+             "status": "approved", "created_by": admin.id}
+            for i in range(start, start + count)
+        ],
+    )
+    db.session.commit()
+
+
+def _export_peak():
+    db.session.expunge_all()
+    tracemalloc.start()
+    for _ in stream_xlsx(VALVE_EXPORT_COLUMNS, iter_valve_export_rows()):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def test_column_letter():
+    """测试列序号转换为 Excel 列名"""
+    assert [column_letter(i) for i in (0, 25, 26, 701, 702)] == [
+        "A", "Z", "AA", "ZZ", "AAA"
+    ]
+
+
+def test_export_streams_valid_workbook(client, init_database):
+    """测试导出以流式响应返回，内容可被 openpyxl 读取"""
+    _seed(3)
+    db.session.add(Valve(位号="FV-DRAFT", status="draft", created_by=1))
+    db.session.commit()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    response = client.get("/export")
+    assert response.is_streamed
+    sheet = load_workbook(BytesIO(response.data)).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert list(rows[0]) == VALVE_EXPORT_COLUMNS
+    assert [row[1] for row in rows[1:]] == ["FV-000000", "FV-000001", "FV-000002"]
+    assert rows[1][VALVE_EXPORT_COLUMNS.index("备注")] == "a<b&c"
+
+    ids = [v.id for v in Valve.query.order_by(Valve.id).limit(2)]
+    sheet = load_workbook(BytesIO(client.get(f"/export?ids={ids[1]}").data)).active
+    assert [row[1] for row in sheet.iter_rows(min_row=2, values_only=True)] == [
+        "FV-000001"
+    ]
+
+
+def test_export_memory_independent_of_rows(app, init_database):
+    """测试导出内存峰值不随行数增长"""
+    _seed(3000)
+    few = _export_peak()
+    _seed(9000, start=3000)
+    many = _export_peak()
+    assert many < few * 1.5
+
+
+def test_csv_export_projects_columns(client, init_database, count_queries):
+    """测试 CSV 导出只查询请求的列"""
+    _seed(3)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    with count_queries() as queries:
+        response = client.get("/export?format=csv&columns=位号,名称&columns=备注")
+        body = response.get_data()
+    assert response.mimetype == "text/csv"
+    assert response.headers["Content-Disposition"].endswith("valves.csv")
+    lines = body.decode("utf-8-sig").splitlines()
+    assert lines[0] == "位号,名称,备注"
+    assert lines[1] == "FV-000000,调节阀,a<b&c\x01"
+    (select,) = [q for q in queries if q.startswith("SELECT valves.")]
+    assert select.split("FROM")[0].count("valves.") == 3
+
+
+def test_export_rejects_bad_parameters(client, init_database):
+    """测试未知格式与未知列返回错误"""
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    headers = {"Accept": "application/json"}
+    for url in ("/export?format=pdf", "/export?format=csv&columns=password_hash"):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 400 and response.get_json()["error"]
+
+
+def test_parquet_export(client, init_database):
+    """测试 Parquet 导出按列写出，未安装 pyarrow 时返回错误"""
+    _seed(3)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.get(
+        "/export?format=parquet&columns=位号", headers={"Accept": "application/json"}
+    )
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        assert response.status_code == 400
+        assert "pyarrow" in response.get_json()["error"]
+        return
+    table = pq.read_table(BytesIO(response.data))
+    assert table.column_names == ["位号"]
+    assert table.column("位号").to_pylist() == ["FV-000000", "FV-000001", "FV-000002"]
+
+
+def test_parquet_round_trip(monkeypatch):
+    """测试 Parquet 分行组写出后读回内容一致（需安装 pyarrow）"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(export_formats, "PARQUET_ROW_GROUP_SIZE", 2)
+    header = ["位号", "备注"]
+    rows = [[f"FV-{i}", None if i % 2 else "检修"] for i in range(5)]
+
+    data = b"".join(export_formats.stream_export("parquet", header, iter(rows)))
+    parquet_file = pq.ParquetFile(BytesIO(data))
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.column_names == header
+    assert [list(row.values()) for row in table.to_pylist()] == rows
+
+
+def _ledger_with_valves():
+    from app.models import Ledger
+    from app.services.valve_status import rebuild_ledger_counters
+
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="导出合集", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    db.session.add_all(
+        Valve(ledger_id=ledger.id, 位号=f"LV-{i}", 名称=name, status=status,
+              created_by=admin.id)
+        for i, (name, status) in enumerate(
+            [("调节阀", "approved"), ("切断阀", "approved"), ("调节阀", "draft")]
+        )
+    )
+    db.session.add(Valve(位号="OTHER", 名称="调节阀", status="approved"))
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger.id
+
+
+def _exported_tags(client, **params):
+    response = client.get("/export", query_string=dict(params, format="csv"))
+    return [line.split(",")[0] for line in response.data.decode("utf-8-sig").split()]
+
+
+def test_export_ledger_with_detail_filters(client, init_database, count_queries):
+    """测试按合集导出复用详情页的可见范围与筛选条件"""
+    ledger_id = _ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    def tags(**params):
+        return _exported_tags(client, ledger_id=ledger_id, columns="位号", **params)
+
+    # 默认入口只导出已审批快照，顺序与详情页一致
+    assert tags() == ["位号", "LV-1", "LV-0"]
+    assert tags(**{"from": "mine"}) == ["位号", "LV-2", "LV-1", "LV-0"]
+    assert tags(**{"from": "mine", "status": "draft"}) == ["位号", "LV-2"]
+    assert tags(**{"from": "mine", "名称": "调节阀"}) == ["位号", "LV-2", "LV-0"]
+    with count_queries() as queries:
+        tags(**{"from": "mine", "search": "切断"})
+    assert not [q for q in queries if "valves.id IN" in q]
+
+    page = client.get(f"/ledger/{ledger_id}?from=mine&名称=调节阀&page=2")
+    href = page.data.decode().split('href="/export?')[1].split('"')[0]
+    assert parse_qs(unescape(href)) == {
+        "ledger_id": [str(ledger_id)], "from": ["mine"], "名称": ["调节阀"]
+    }
+
+
+def test_export_ledger_requires_detail_access(client, init_database):
+    """测试无权查看合集详情时不能按合集导出"""
+    ledger_id = _ledger_with_valves()
+    client.post("/login", data={"username": "user1", "password": "user123"})
+    response = client.get(
+        f"/export?ledger_id={ledger_id}", headers={"Accept": "application/json"}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "无权访问"
+
+
+def _approved_ledger_with_valves():
+    from app.models import Ledger
+
+    ledger_id = _ledger_with_valves()
+    db.session.get(Ledger, ledger_id).approved_snapshot_status = "approved"
+    db.session.commit()
+    return ledger_id
+
+
+def test_ledger_export_cache(
+    client, init_database, export_cache_folder, count_queries
+):
+    """测试合集导出缓存：命中不查询阀门，ETag 协商，阀门变更后失效"""
+    from app.services.export_cache import stats
+
+    folder = export_cache_folder
+    ledger_id = _approved_ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    url = f"/export?ledger_id={ledger_id}&format=csv"
+
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    with count_queries() as queries:
+        second = client.get(url)
+    assert second.data == first.data and second.headers["ETag"] == etag
+    assert not [q for q in queries if "FROM valves" in q]
+    assert stats["hits"] >= 1
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    valve = Valve.query.filter_by(位号="LV-0").first()
+    valve.名称 = "新名称"
+    db.session.commit()
+    third = client.get(url, headers={"If-None-Match": etag})
+    assert third.status_code == 200 and third.headers["ETag"] != etag
+    assert "新名称" in third.data.decode("utf-8-sig")
+    # 旧版本文件已删除
+    assert len(list(folder.iterdir())) == 1
+
+
+def test_ledger_export_cache_snapshot_only(client, init_database, export_cache_folder):
+    """测试只缓存已审批合集的快照导出，草稿视图与未审批合集直接流式导出"""
+    from app.models import Ledger
+
+    ledger_id = _ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    url = f"/export?ledger_id={ledger_id}&format=csv"
+    assert "ETag" not in client.get(url).headers
+
+    db.session.get(Ledger, ledger_id).approved_snapshot_status = "approved"
+    db.session.commit()
+    for params in ("&from=mine", "&status=approved"):
+        response = client.get(url + params)
+        assert response.status_code == 200 and "ETag" not in response.headers
+    assert not export_cache_folder.exists() or not list(export_cache_folder.iterdir())
+    assert "ETag" in client.get(url).headers
+
+
+def test_ledger_export_cache_lru_budget(
+    client, init_database, app, export_cache_folder
+):
+    """测试缓存超出大小上限时淘汰最久未用的文件"""
+    import os
+
+    folder = export_cache_folder
+    ledger_id = _approved_ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    url = f"/export?ledger_id={ledger_id}&format=csv&columns="
+    client.get(url + "位号")
+    (oldest,) = folder.iterdir()
+    app.config["EXPORT_CACHE_MAX_BYTES"] = oldest.stat().st_size * 2 + 10
+    os.utime(oldest, (1, 1))
+    client.get(url + "名称")
+    client.get(url + "备注")
+    names = [p.name for p in folder.iterdir()]
+    assert len(names) == 2 and oldest.name not in names
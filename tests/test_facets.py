@@ -0,0 +1,91 @@
+# coding=utf-8
+import json
+import re
+
+from app.models import db, Ledger, Valve, User
+from app.services.facets import count_facets, facet_cache
+
+
+def _setup():
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="分面合集", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    for tag, unit, level in [
+        ("FV-1", "常减压", "A"),
+        ("FV-2", "常减压", "B"),
+        ("FV-3", "催化", "A"),
+        ("FV-4", "催化", "A"),
+    ]:
+        db.session.add(
+            Valve(ledger_id=ledger.id, 位号=tag, 装置名称=unit, 设备等级=level,
+                  created_by=admin.id)
+        )
+    db.session.commit()
+    return ledger.id
+
+
+def _facet_counts(response):
+    match = re.search(r"window\.facetCounts = (.*);", response.get_data(as_text=True))
+    return json.loads(match.group(1))
+
+
+def test_count_facets_excludes_own_filter(app, init_database):
+    """测试每列数量按其他列的筛选条件统计"""
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="分面统计", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    for unit, level in [("常减压", "A"), ("常减压", "B"), ("催化", "A"), ("催化", "")]:
+        db.session.add(
+            Valve(ledger_id=ledger.id, 装置名称=unit, 设备等级=level,
+                  created_by=admin.id)
+        )
+    db.session.commit()
+    query = Valve.query.filter_by(ledger_id=ledger.id)
+
+    counts = count_facets(query, {"装置名称": ["催化"]})
+    assert counts["装置名称"] == {"常减压": 2, "催化": 2}
+    assert counts["设备等级"] == {"A": 1}
+
+    counts = count_facets(query, {"装置名称": ["催化"], "设备等级": ["B"]})
+    assert counts["装置名称"] == {"常减压": 1}
+    assert counts["设备等级"] == {"A": 1}
+
+
+def test_detail_facets_cached_per_data_version(client, init_database, count_queries):
+    """测试筛选项统计按数据版本缓存，阀门写入后失效"""
+    ledger_id = _setup()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    url = f"/ledger/{ledger_id}?from=mine&设备等级=A"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert _facet_counts(response)["装置名称"] == {"催化": 2, "常减压": 1}
+
+    hits = facet_cache.hits
+    with count_queries() as queries:
+        client.get(url)
+    assert facet_cache.hits == hits + 1
+    assert not [q for q in queries if "DISTINCT" in q]
+
+    version = db.session.get(Ledger, ledger_id).data_version
+    valve = Valve.query.filter_by(位号="FV-2").first()
+    valve.设备等级 = "A"
+    db.session.commit()
+    assert db.session.get(Ledger, ledger_id).data_version == version + 1
+
+    response = client.get(url)
+    assert _facet_counts(response)["装置名称"] == {"催化": 2, "常减压": 2}
+
+
+def test_search_facets_not_cached(client, init_database):
+    """测试带关键字检索时筛选项统计每次现算，不写入缓存"""
+    ledger_id = _setup()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    stats = facet_cache.stats()
+    for term in ("FV-3", "FV-4"):
+        response = client.get(f"/ledger/{ledger_id}?from=mine&search={term}")
+        assert _facet_counts(response)["装置名称"] == {"催化": 1}
+    after = facet_cache.stats()
+    assert (after["entries"], after["misses"]) == (stats["entries"], stats["misses"])
@@ -0,0 +1,148 @@
+# coding=utf-8
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook
+
+from app.models import db, Ledger, Valve, User
+from app.services import importer
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _workbook(rows, header=("位号", "名称", "型号规格", "ledger_id")):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(list(header))
+    for row in rows:
+        sheet.append(list(row))
+    buffer = BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def staging(app, tmp_path):
+    app.config["IMPORT_STAGING_FOLDER"] = str(tmp_path)
+    return tmp_path
+
+
+def _setup_existing():
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="导入合集", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    db.session.add(
+        Valve(ledger_id=ledger.id, 位号="FV-001", 名称="旧名称", status="approved",
+              created_by=admin.id)
+    )
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger.id
+
+
+def _preview(client, rows):
+    response = client.post(
+        "/import",
+        data={"file": (_workbook(rows), "valves.xlsx"), "action": "preview"},
+        content_type="multipart/form-data",
+    )
+    return response.get_json()
+
+
+def _execute(client, import_id, conflict_mode):
+    return client.post(
+        "/import/execute",
+        data={"import_id": import_id, "conflict_mode": conflict_mode},
+        headers={"Accept": "application/json"},
+    ).get_json()
+
+
+def test_preview_stages_on_server(client, init_database, staging):
+    """测试预览结果暂存在服务器端，会话中不保存预览数据"""
+    ledger_id = _setup_existing()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    data = _preview(
+        client,
+        [
+            ("FV-001", "新名称", "DN50", ledger_id),
+            ("FV-002", "调节阀", None, ledger_id),
+            ("FV-002", "重复行", None, ledger_id),
+            (None, "无位号", None, None),
+        ],
+    )
+
+    assert data["total_count"] == 2
+    assert (data["conflict_count"], data["duplicate_count"]) == (1, 1)
+    assert [row["位号"] for row in data["preview"]] == ["FV-001", "FV-002"]
+    assert data["preview"][0]["is_duplicate"]
+    assert (staging / f"{data['import_id']}.jsonl").exists()
+    with client.session_transaction() as session:
+        assert "import_preview" not in session
+
+
+@pytest.mark.parametrize(
+    "mode, names, counts",
+    [
+        ("overwrite", ["新名称", "调节阀"], (1, 1)),
+        ("skip", ["旧名称", "调节阀"], (1, 0)),
+        ("cancel", ["旧名称"], (0, 0)),
+    ],
+)
+def test_execute_conflict_modes(client, init_database, staging, mode, names, counts):
+    """测试三种冲突处理方式"""
+    ledger_id = _setup_existing()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    data = _preview(
+        client,
+        [("FV-001", "新名称", "DN50", ledger_id), ("FV-002", "调节阀", None, ledger_id)],
+    )
+    result = _execute(client, data["import_id"], mode)
+
+    assert (result["new_count"], result["update_count"]) == counts
+    assert result["success"] == (mode != "cancel")
+    valves = Valve.query.order_by(Valve.位号).all()
+    assert [v.名称 for v in valves] == names
+    assert db.session.get(Ledger, ledger_id).valve_count == len(names)
+    # 暂存文件在执行后删除，不能重复导入
+    assert not list(staging.iterdir())
+    assert _execute(client, data["import_id"], mode)["success"] is False
+
+
+def test_import_chunks_constant_queries(
+    client, init_database, staging, monkeypatch, count_queries
+):
+    """测试每块只做一次位号冲突查询并逐块更新进度"""
+    monkeypatch.setattr(importer, "IMPORT_CHUNK_SIZE", 10)
+    ledger_id = _setup_existing()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    rows = [(f"FV-{i:03d}", "调节阀", None, ledger_id) for i in range(1, 46)]
+
+    with count_queries() as queries:
+        data = _preview(client, rows)
+    assert len([q for q in queries if '"位号" IN' in q]) == 5
+
+    admin = User.query.filter_by(username="admin").first()
+    with count_queries() as queries:
+        result = importer.execute_import(data["import_id"], "overwrite", admin.id)
+    db.session.commit()
+    assert len([q for q in queries if '"位号" IN' in q]) == 5
+    assert (result["new_count"], result["update_count"]) == (44, 1)
+
+    progress = importer.load_progress(data["import_id"])
+    assert progress["state"] == "done"
+    assert progress["processed"] == progress["total"] == 45
+    assert Valve.query.count() == 45
+    assert db.session.get(Ledger, ledger_id).valve_count == 45
+
+
+def test_import_rejects_invalid_file(client, init_database, staging):
+    """测试上传非 Excel 文件时返回错误"""
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.post(
+        "/import",
+        data={"file": (BytesIO(b"not a workbook"), "valves.xlsx"), "action": "preview"},
+        content_type="multipart/form-data",
+    )
+    assert "error" in response.get_json()
@@ -7,4 +7,66 @@ def test_index_with_login(client, init_database):
     client.post('/login', data={'username': 'admin', 'password': 'admin123'})
     response = client.get('/')
     assert response.status_code == 200
-    assert b'台账' in response.data
+    assert '台账'.encode() in response.data
+
+def _add_data(prefix, ledgers, users):
+    from app.models import db, Ledger, Valve, User
+
+    admin = User.query.filter_by(username='admin').first()
+    for i in range(users):
+        user = User(username=f'{prefix}-user{i}', role='employee')
+        user.set_password('123456')
+        db.session.add(user)
+    for i in range(ledgers):
+        ledger = Ledger(名称=f'{prefix}-{i}', created_by=admin.id,
+                        approved_snapshot_status='approved')
+        db.session.add(ledger)
+        db.session.flush()
+        db.session.add(Valve(ledger_id=ledger.id, 位号=f'{prefix}-FV-{i}',
+                             status='approved', created_by=admin.id))
+    db.session.commit()
+
+def test_index_constant_queries(client, init_database, count_queries):
+    """测试首页统计的 SQL 数量不随合集和用户数量增长"""
+    from app.models import db
+
+    from app.services.dashboard import dashboard_cache
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    _add_data('a', 2, 2)
+    dashboard_cache.clear()
+    db.session.expire_all()
+    with count_queries() as small:
+        assert client.get('/').status_code == 200
+
+    _add_data('b', 30, 30)
+    dashboard_cache.clear()
+    db.session.expire_all()
+    with count_queries() as large:
+        response = client.get('/')
+    assert response.status_code == 200
+    assert len(large) == len(small)
+
+def test_index_cache_invalidated_by_writes(client, init_database):
+    """测试首页统计缓存命中及写操作后失效"""
+    from app.services.dashboard import dashboard_cache
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    client.get('/')
+    hits = dashboard_cache.hits
+    client.get('/')
+    assert dashboard_cache.hits > hits
+
+    client.post('/ledger/new', data={'名称': '新合集'})
+    assert dashboard_cache.stats()['entries'] == 0
+    response = client.get('/admin/cache-stats')
+    assert response.get_json()['dashboard']['invalidations'] >= 1
+
+def test_pending_badge_served_from_cache(client, init_database, count_queries):
+    """测试导航栏待审批数量不在每次渲染时查询数据库"""
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    client.get('/ledgers')
+    with count_queries() as statements:
+        response = client.get('/ledgers')
+    assert response.status_code == 200
+    assert not [s for s in statements if 'count(' in s.lower() and 'valves' in s]
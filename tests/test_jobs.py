@@ -0,0 +1,156 @@
+# coding=utf-8
+import time
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+from app import create_app
+from app.models import db, Job, Ledger, Valve, User
+from app.services import jobs as job_service
+from tests.conftest import TestConfig
+
+
+@pytest.fixture
+def inline_jobs(app, tmp_path):
+    app.config["JOB_WORKERS"] = 0
+    app.config["JOB_RESULT_FOLDER"] = str(tmp_path / "jobs")
+    app.config["IMPORT_STAGING_FOLDER"] = str(tmp_path / "imports")
+    return app
+
+
+@pytest.fixture
+def failing_handler():
+    @job_service.job_handler("test_fail")
+    def fail(ctx):
+        db.session.add(Ledger(名称="不应保存", created_by=ctx.user_id))
+        db.session.flush()
+        raise RuntimeError("导出出错")
+
+    @job_service.job_handler("test_cancel")
+    def cancel_midway(ctx):
+        db.session.add(Ledger(名称="不应保存", created_by=ctx.user_id))
+        ctx.progress(1, 2)
+        job_service.cancel_job(db.session.get(Job, ctx.job_id))
+        ctx.progress(2, 2)
+
+    yield
+    job_service.JOB_HANDLERS.pop("test_fail")
+    job_service.JOB_HANDLERS.pop("test_cancel")
+
+
+def _add_valves(count):
+    admin = User.query.filter_by(username="admin").first()
+    db.session.add_all(
+        Valve(位号=f"FV-{i:03d}", status="approved", created_by=admin.id)
+        for i in range(count)
+    )
+    db.session.commit()
+
+
+def test_async_export_download(client, init_database, inline_jobs):
+    """测试异步导出返回任务 ID，完成后可下载结果"""
+    _add_valves(3)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    response = client.get("/export?async=1")
+    assert response.status_code == 202
+    job = response.get_json()
+    status = client.get(job["status_url"]).get_json()
+    assert status["status"] == "done" and status["download_url"]
+
+    download = client.get(status["download_url"])
+    assert download.headers["Content-Disposition"].endswith("valves.xlsx")
+    sheet = load_workbook(BytesIO(download.data)).active
+    assert sheet.max_row == 4
+
+
+def test_async_import_job(client, init_database, inline_jobs):
+    """测试导入以后台任务执行并记录导入结果"""
+    from tests.test_import import _workbook
+
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    preview = client.post(
+        "/import",
+        data={
+            "file": (_workbook([("FV-100", "调节阀", None, None)]), "a.xlsx"),
+            "action": "preview",
+        },
+        content_type="multipart/form-data",
+    ).get_json()
+    job = client.post(
+        "/import/execute",
+        data={"import_id": preview["import_id"], "conflict_mode": "skip", "async": 1},
+    ).get_json()
+
+    status = client.get(job["status_url"]).get_json()
+    assert status["status"] == "done"
+    assert status["result"]["new_count"] == 1
+    assert (status["progress"], status["total"]) == (1, 1)
+    assert Valve.query.filter_by(位号="FV-100").count() == 1
+
+
+def test_failed_and_cancelled_jobs_roll_back(
+    client, init_database, inline_jobs, failing_handler
+):
+    """测试任务失败或被取消时回滚处理函数的写入"""
+    admin = User.query.filter_by(username="admin").first()
+    failed = job_service.submit_job("test_fail", admin.id)
+    cancelled = job_service.submit_job("test_cancel", admin.id)
+
+    db.session.expire_all()
+    assert (failed.status, failed.message) == ("failed", "导出出错")
+    assert (cancelled.status, cancelled.progress) == ("cancelled", 2)
+    assert Ledger.query.count() == 0
+
+
+def test_job_visible_to_owner_only(client, init_database, inline_jobs):
+    """测试仅任务提交人与管理员可查询任务"""
+    user = User.query.filter_by(username="user1").first()
+    job = job_service.submit_job("maintenance_export", user.id)
+
+    client.post("/login", data={"username": "user1", "password": "user123"})
+    assert client.get(f"/jobs/{job.id}").get_json()["status"] == "done"
+    assert client.post(f"/jobs/{job.id}/cancel").status_code == 409
+    client.get("/logout")
+
+    other = User(username="other", role="employee")
+    other.set_password("other123")
+    db.session.add(other)
+    db.session.commit()
+    client.post("/login", data={"username": "other", "password": "other123"})
+    assert client.get(f"/jobs/{job.id}").status_code == 404
+    assert client.get(f"/jobs/{job.id}/download").status_code == 404
+
+
+def test_background_thread_execution(tmp_path):
+    """测试线程池模式下请求立即返回，任务在后台完成"""
+
+    class ThreadConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'jobs.db'}"
+        JOB_WORKERS = 1
+        JOB_RESULT_FOLDER = str(tmp_path / "jobs")
+
+    app = create_app(ThreadConfig)
+    with app.app_context():
+        db.create_all()
+        admin = User(username="admin", role="admin")
+        admin.set_password("admin123")
+        db.session.add(admin)
+        db.session.commit()
+        _add_valves(5)
+
+    client = app.test_client()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.get("/export?async=1")
+    assert response.status_code == 202
+    job = response.get_json()
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        status = client.get(job["status_url"]).get_json()
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    assert status["status"] == "done"
+    assert client.get(status["download_url"]).status_code == 200
@@ -0,0 +1,116 @@
+# coding=utf-8
+from app.models import db, ApprovalLog, Ledger, MaintenanceRecord, Valve, User
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _counts(ledger_id):
+    ledger = db.session.get(Ledger, ledger_id)
+    db.session.refresh(ledger)
+    return (
+        ledger.valve_count,
+        ledger.draft_count,
+        ledger.pending_count,
+        ledger.approved_count,
+        ledger.rejected_count,
+    )
+
+
+def _make_ledger(valve_count):
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="测试合集", created_by=admin.id, status="draft")
+    db.session.add(ledger)
+    db.session.commit()
+    for i in range(valve_count):
+        db.session.add(
+            Valve(
+                ledger_id=ledger.id,
+                位号=f"FV-{ledger.id}-{i}",
+                status="draft",
+                created_by=admin.id,
+            )
+        )
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger.id
+
+
+def test_counters_follow_submit_approve(client, init_database):
+    """测试提交、审批时计数同步更新"""
+    ledger_id = _make_ledger(3)
+    assert _counts(ledger_id) == (3, 3, 0, 0, 0)
+
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    client.post(f"/ledger/{ledger_id}/submit")
+    assert _counts(ledger_id) == (3, 0, 3, 0, 0)
+
+    client.post(f"/ledger/{ledger_id}/approve")
+    assert _counts(ledger_id) == (3, 0, 0, 3, 0)
+    assert db.session.get(Ledger, ledger_id).status == "approved"
+
+
+def test_counters_follow_reject_and_delete(client, init_database):
+    """测试驳回、删除时计数同步更新"""
+    ledger_id = _make_ledger(2)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    client.post(f"/ledger/{ledger_id}/submit")
+    client.post(f"/ledger/{ledger_id}/reject")
+    assert _counts(ledger_id) == (2, 0, 0, 0, 2)
+
+    valve = Valve.query.filter_by(ledger_id=ledger_id).first()
+    client.post(f"/ledger/{ledger_id}/valve/delete/{valve.id}")
+    assert _counts(ledger_id) == (1, 0, 0, 0, 1)
+
+
+def test_ledger_batch_delete_uses_delete_valves(client, init_database):
+    """测试合集内批量删除：保留有检修记录的阀门，同时删除审批日志并扣减计数；
+    单条删除不能跨合集"""
+    ledger_id = _make_ledger(3)
+    other_ledger_id = _make_ledger(1)
+    kept, removed, _ = Valve.query.filter_by(ledger_id=ledger_id).all()
+    other = Valve.query.filter_by(ledger_id=other_ledger_id).one()
+    db.session.add(MaintenanceRecord(valve_id=kept.id, 检修内容="更换填料"))
+    db.session.add(ApprovalLog(valve_id=removed.id, action="submit"))
+    db.session.commit()
+    kept_id, removed_id, other_id = kept.id, removed.id, other.id
+
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    client.post(
+        f"/ledger/{ledger_id}/valve/batch-delete",
+        data={"valve_ids": [kept_id, removed_id, other_id]},
+    )
+    db.session.expire_all()
+    assert db.session.get(Valve, kept_id) is not None
+    assert db.session.get(Valve, removed_id) is None
+    assert db.session.get(Valve, other_id) is not None
+    assert ApprovalLog.query.filter_by(valve_id=removed_id).count() == 0
+    assert _counts(ledger_id) == (2, 2, 0, 0, 0)
+
+    response = client.post(f"/ledger/{ledger_id}/valve/delete/{other_id}")
+    assert response.status_code == 404
+    assert db.session.get(Valve, other_id) is not None
+
+
+def test_counters_follow_batch_save(client, init_database):
+    """测试批量保存新增阀门时计数同步更新"""
+    ledger_id = _make_ledger(1)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.post(
+        f"/ledger/{ledger_id}/valve/batch-save",
+        json=[{"data": {"位号": "FV-NEW-1"}}, {"data": {"位号": "FV-NEW-2"}}],
+    )
+    assert response.get_json()["success"]
+    assert _counts(ledger_id) == (3, 3, 0, 0, 0)
+
+
+def test_rebuild_repairs_drift(client, init_database):
+    """测试重建命令修正计数偏差"""
+    ledger_id = _make_ledger(2)
+    ledger = db.session.get(Ledger, ledger_id)
+    ledger.valve_count = 99
+    ledger.draft_count = 0
+    db.session.commit()
+
+    rebuild_ledger_counters()
+    db.session.commit()
+    assert _counts(ledger_id) == (2, 2, 0, 0, 0)
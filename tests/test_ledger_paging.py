@@ -0,0 +1,86 @@
+# coding=utf-8
+from app.models import db, Ledger, Valve, User
+from app.routes import ledgers as ledger_routes
+
+
+def _setup(count):
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="分页合集", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    db.session.add_all(
+        Valve(ledger_id=ledger.id, 位号=f"FV-{i:03d}", 名称="调节阀",
+              status="draft", created_by=admin.id)
+        for i in range(count)
+    )
+    ledger.valve_count = ledger.draft_count = count
+    db.session.commit()
+    return ledger.id
+
+
+def _walk(client, url, **params):
+    params.setdefault("from", "mine")
+    tags, cursor = [], None
+    while True:
+        if cursor:
+            params["after"] = cursor
+        data = client.get(url, query_string=params).get_json()
+        tags.extend(item["位号"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            return tags, data
+
+
+def test_valves_api_cursor_pages(client, init_database):
+    """测试 JSON 游标分页不重复、不遗漏，并使用台账计数作为总数"""
+    ledger_id = _setup(25)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    tags, last = _walk(client, f"/api/ledger/{ledger_id}/valves", per_page=10)
+    assert tags == [f"FV-{i:03d}" for i in reversed(range(25))]
+    assert last["total"] == 25 and not last["total_is_estimate"]
+
+
+def test_valves_api_search_cursor(client, init_database):
+    """测试按检索相关度排序时的游标分页"""
+    ledger_id = _setup(12)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    tags, _ = _walk(
+        client, f"/api/ledger/{ledger_id}/valves", per_page=5, search="调节阀"
+    )
+    assert sorted(tags) == [f"FV-{i:03d}" for i in range(12)]
+
+
+def test_per_page_ceiling_and_estimate(client, init_database, monkeypatch):
+    """测试每页条数上限与估计总数模式"""
+    ledger_id = _setup(30)
+    monkeypatch.setattr(ledger_routes, "DETAIL_MAX_PER_PAGE", 8)
+    monkeypatch.setattr(ledger_routes, "DETAIL_EXACT_COUNT_LIMIT", 20)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    data = client.get(
+        f"/api/ledger/{ledger_id}/valves?from=mine&per_page=100000&名称=调节阀"
+    ).get_json()
+    assert data["per_page"] == 8 and len(data["items"]) == 8
+    assert data["total"] == 20 and data["total_is_estimate"]
+
+    response = client.get(f"/ledger/{ledger_id}?from=mine&per_page=100000&count=exact")
+    assert response.data.count(b'name="ids"') == 8
+    assert "共 30 条记录".encode() in response.data
+
+
+def test_detail_cursor_mode_skips_count(client, init_database, count_queries):
+    """测试详情页游标模式不做 COUNT"""
+    ledger_id = _setup(5)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    with count_queries() as queries:
+        response = client.get(
+            f"/ledger/{ledger_id}?from=mine&paging=cursor&per_page=2&count=none"
+        )
+    assert response.status_code == 200
+    assert "下一页".encode() in response.data
+    # 筛选项统计按列 GROUP BY 计数，不属于分页总数查询
+    valve_queries = [
+        q for q in queries if "valves.ledger_id = ?" in q and "GROUP BY" not in q
+    ]
+    assert valve_queries
+    assert not [q for q in valve_queries if "count(" in q.lower()]
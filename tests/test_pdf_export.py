@@ -0,0 +1,170 @@
+# coding=utf-8
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+
+from app.models import db, Ledger, Valve, User
+from app.services.pdf_export import PDF_CACHE, pdf_cache_key, render_sheets_html
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _weasyprint_installed():
+    try:
+        import weasyprint  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@pytest.fixture
+def inline_pdf(app, tmp_path):
+    app.config["JOB_WORKERS"] = 0
+    app.config["PDF_WORKERS"] = 0
+    app.config["JOB_RESULT_FOLDER"] = str(tmp_path / "jobs")
+    return app
+
+
+@pytest.fixture
+def pdf_cache_folder(app, tmp_path):
+    app.config["PDF_CACHE_FOLDER"] = str(tmp_path / "pdf_cache")
+    return tmp_path / "pdf_cache"
+
+
+def _ledger_with_valves():
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="PDF合集", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    db.session.add_all(
+        Valve(ledger_id=ledger.id, 位号=tag, 名称=name, status="approved",
+              created_by=admin.id)
+        for tag, name in [("PV-1", "调节阀"), ("PV-2", "切断阀"), ("PV-3", "调节阀")]
+    )
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger.id
+
+
+def test_pdf_sheet_template(app):
+    """测试数据表模板每个阀门一节，字段内容经过转义；只打印阀门更新时间，
+    不打印会随缓存复用而过时的导出时间"""
+    updated_at = datetime(2024, 5, 1, 8, 30)
+    html = render_sheets_html(
+        [
+            {"位号": "PV-<1>", "备注": None},
+            {"位号": "PV-2", "备注": "检修", "updated_at": updated_at},
+        ]
+    )
+    assert html.count('<section class="sheet">') == 2
+    assert "PV-&lt;1&gt;" in html and "PV-<1>" not in html
+    assert "检修" in html and "无" in html
+    assert "更新时间：2024-05-01 08:30:00" in html and "导出时间" not in html
+
+
+def test_pdf_batch_rejects_bad_parameters(client, init_database, inline_pdf):
+    """测试未指定阀门或未知导出方式时返回错误"""
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    headers = {"Accept": "application/json"}
+    for url in ("/export/pdf", "/export/pdf?ids=1&mode=docx"):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 400 and response.get_json()["error"]
+
+
+def test_pdf_batch_export_zip(client, init_database, inline_pdf):
+    """测试按合集筛选批量导出 PDF 压缩包，未安装 WeasyPrint 时返回错误"""
+    ledger_id = _ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.get(
+        f"/export/pdf?ledger_id={ledger_id}&mode=zip&名称=调节阀",
+        headers={"Accept": "application/json"},
+    )
+    if not _weasyprint_installed():
+        assert response.status_code == 400
+        assert "WeasyPrint" in response.get_json()["error"]
+        return
+
+    assert response.status_code == 202
+    status = client.get(response.get_json()["status_url"]).get_json()
+    assert status["status"] == "done"
+    download = client.get(status["download_url"])
+    with zipfile.ZipFile(BytesIO(download.data)) as archive:
+        assert sorted(archive.namelist()) == ["PV-1.pdf", "PV-3.pdf"]
+        assert archive.read("PV-1.pdf").startswith(b"%PDF")
+
+
+def test_single_pdf_without_weasyprint(client, init_database):
+    """测试单个阀门导出在未安装 WeasyPrint 时提示并返回详情页"""
+    if _weasyprint_installed():
+        pytest.skip("已安装 WeasyPrint")
+    admin = User.query.filter_by(username="admin").first()
+    valve = Valve(位号="PV-9", status="approved", created_by=admin.id)
+    db.session.add(valve)
+    db.session.commit()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.get(f"/valve/{valve.id}/export-pdf")
+    assert response.status_code == 302
+    assert f"/valve/{valve.id}" in response.headers["Location"]
+
+
+def test_pdf_cache_key_follows_content(client, init_database, pdf_cache_folder):
+    """测试 PDF 缓存键随阀门内容变化，ETag 未变时直接返回 304"""
+    admin = User.query.filter_by(username="admin").first()
+    valve = Valve(位号="PV-7", 名称="调节阀", status="approved", created_by=admin.id)
+    db.session.add(valve)
+    db.session.commit()
+    etag = pdf_cache_key(valve)
+    assert pdf_cache_key(valve) == etag
+
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    url = f"/valve/{valve.id}/export-pdf"
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304 and response.headers["ETag"] == f'"{etag}"'
+
+    valve.名称 = "切断阀"
+    db.session.commit()
+    assert pdf_cache_key(valve) != etag
+    if _weasyprint_installed():
+        response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+        assert response.status_code == 200 and response.data.startswith(b"%PDF")
+        assert client.get(url).headers["ETag"] == f'"{pdf_cache_key(valve)}"'
+
+
+def test_pdf_cache_eviction_and_stats(client, init_database, app, pdf_cache_folder):
+    """测试 PDF 缓存替换旧版本、超出上限时按最近使用淘汰并统计命中率"""
+    import os
+
+    def produce(content):
+        def write(path):
+            with open(path, "wb") as f:
+                f.write(content)
+
+        return write
+
+    def stale(valve_id):
+        return lambda name: name.startswith(f"v{valve_id}-")
+
+    before = dict(PDF_CACHE.counters)
+    app.config["PDF_CACHE_MAX_BYTES"] = 250
+    old = PDF_CACHE.get_or_create("v1-a", "pdf", produce(b"1" * 100), stale(1))
+    PDF_CACHE.get_or_create("v1-b", "pdf", produce(b"1" * 100), stale(1))
+    assert not os.path.exists(old)
+
+    PDF_CACHE.get_or_create("v2-a", "pdf", produce(b"2" * 100), stale(2))
+    os.utime(pdf_cache_folder / "v2-a.pdf", (1, 1))
+    assert PDF_CACHE.get_or_create("v1-b", "pdf", produce(b"x"), stale(1))
+    PDF_CACHE.get_or_create("v3-a", "pdf", produce(b"3" * 100), stale(3))
+    assert sorted(p.name for p in pdf_cache_folder.iterdir()) == [
+        "v1-b.pdf",
+        "v3-a.pdf",
+    ]
+    assert (pdf_cache_folder / "v1-b.pdf").read_bytes() == b"1" * 100
+    assert PDF_CACHE.counters["hits"] - before["hits"] == 1
+    assert PDF_CACHE.counters["misses"] - before["misses"] == 4
+    assert PDF_CACHE.counters["evictions"] - before["evictions"] == 1
+
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    stats = client.get("/admin/cache-stats").get_json()["valve_pdf"]
+    assert stats["entries"] == 2 and 0 < stats["hit_rate"] < 1
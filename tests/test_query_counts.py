@@ -0,0 +1,64 @@
+# coding=utf-8
+import pytest
+
+from app.models import db, Ledger, Valve, User
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _add_ledgers(count, start):
+    admin = User.query.filter_by(username="admin").first()
+    for i in range(start, start + count):
+        ledger = Ledger(
+            名称=f"合集{i}",
+            created_by=admin.id,
+            status="pending",
+            approved_snapshot_status="approved",
+        )
+        db.session.add(ledger)
+        db.session.flush()
+        for status in ["draft", "pending", "approved", "rejected"]:
+            db.session.add(
+                Valve(
+                    ledger_id=ledger.id,
+                    位号=f"FV-{i}-{status}",
+                    status=status,
+                    created_by=admin.id,
+                )
+            )
+    db.session.flush()
+    rebuild_ledger_counters()
+    db.session.commit()
+
+
+def _queries_for(client, count_queries, url):
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/ledgers",
+        "/approvals?tab=pending",
+        "/approvals?tab=approved",
+        "/approvals?tab=rejected",
+        "/my-ledgers",
+        "/my-ledger-applications",
+    ],
+)
+def test_ledger_pages_use_constant_queries(
+    client, init_database, count_queries, url
+):
+    """测试合集列表页面的 SQL 数量不随合集数量增长"""
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+
+    _add_ledgers(2, 0)
+    small = _queries_for(client, count_queries, url)
+
+    _add_ledgers(20, 2)
+    large = _queries_for(client, count_queries, url)
+
+    assert large == small
@@ -0,0 +1,100 @@
+# coding=utf-8
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func
+
+from app.models import (
+    db,
+    Ledger,
+    Valve,
+    ApprovalLog,
+    MaintenanceRecord,
+    ValvePhoto,
+    ValveAttachment,
+)
+
+
+def _query_plan(query):
+    statement = query.statement if hasattr(query, "statement") else query
+    compiled = statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    # 执行计划与参数取值无关，全部以 NULL 代入即可
+    params = tuple(None for _ in compiled.positiontup or ())
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + str(compiled), params
+        ).fetchall()
+    return [row[-1] for row in rows]
+
+
+def _full_scans(plan, table):
+    return [
+        line
+        for line in plan
+        if line.startswith(f"SCAN {table}") and "USING" not in line
+    ]
+
+
+HOT_QUERIES = {
+    "ledger_status": (
+        "valves",
+        lambda: Valve.query.filter_by(ledger_id=1, status="pending"),
+    ),
+    "ledger_snapshot": (
+        "valves",
+        lambda: Valve.query.filter(
+            Valve.ledger_id == 1,
+            Valve.status == "approved",
+            Valve.approved_at <= datetime.utcnow(),
+        ),
+    ),
+    "global_pending": (
+        "valves",
+        lambda: db.session.query(func.count(Valve.id)).filter(
+            Valve.status == "pending"
+        ),
+    ),
+    "created_by": ("valves", lambda: Valve.query.filter_by(created_by=1)),
+    "status_counts": (
+        "valves",
+        lambda: db.session.query(Valve.ledger_id, Valve.status, func.count(Valve.id))
+        .filter(Valve.ledger_id.in_([1, 2, 3]))
+        .group_by(Valve.ledger_id, Valve.status),
+    ),
+    "my_ledgers": ("ledgers", lambda: Ledger.query.filter_by(created_by=1)),
+    "approved_ledgers": (
+        "ledgers",
+        lambda: Ledger.query.filter(Ledger.approved_snapshot_status == "approved"),
+    ),
+    "approval_logs": (
+        "approval_logs",
+        lambda: ApprovalLog.query.filter_by(ledger_id=1, valve_id=1).order_by(
+            ApprovalLog.timestamp
+        ),
+    ),
+    "approval_logs_by_valve": (
+        "approval_logs",
+        lambda: ApprovalLog.query.filter(ApprovalLog.valve_id.in_([1, 2])),
+    ),
+    "maintenance": (
+        "maintenance_records",
+        lambda: MaintenanceRecord.query.filter_by(valve_id=1).order_by(
+            MaintenanceRecord.检修时间.desc()
+        ),
+    ),
+    "photos": ("valve_photos", lambda: ValvePhoto.query.filter_by(valve_id=1)),
+    "attachments": (
+        "valve_attachments",
+        lambda: ValveAttachment.query.filter_by(valve_id=1),
+    ),
+}
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_index(app, name):
+    """测试热点查询走索引而不是全表扫描"""
+    table, build = HOT_QUERIES[name]
+    plan = _query_plan(build())
+    assert not _full_scans(plan, table), plan
@@ -0,0 +1,64 @@
+# coding=utf-8
+from app.models import db, Ledger, Valve, User
+from app.services.search import FTS5SearchBackend, get_search_backend
+
+
+def _setup(app):
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="检索合集", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    for fields in [
+        {"位号": "FV-1001", "名称": "进料调节阀"},
+        {"位号": "FV-2002", "名称": "出料切断阀"},
+        {"位号": "PV-3003", "备注": "FV-1001 旁路"},
+    ]:
+        db.session.add(Valve(ledger_id=ledger.id, created_by=admin.id, **fields))
+    db.session.commit()
+    return ledger.id
+
+
+def _search(ledger_id, term):
+    query = Valve.query.filter_by(ledger_id=ledger_id)
+    query, rank = get_search_backend().apply(query, term)
+    if rank is not None:
+        query = query.order_by(rank, Valve.id.desc())
+    return [v.位号 for v in query.all()]
+
+
+def test_fts_backend_selected(app, init_database):
+    """测试默认启用 FTS5 检索后端"""
+    assert isinstance(get_search_backend(), FTS5SearchBackend)
+
+
+def test_search_tag_and_chinese(app, init_database):
+    """测试位号子串与中文名称检索"""
+    ledger_id = _setup(app)
+    assert set(_search(ledger_id, "V-100")) == {"FV-1001", "PV-3003"}
+    assert _search(ledger_id, "切断阀") == ["FV-2002"]
+    assert _search(ledger_id, "fv-2") == ["FV-2002"]
+    # 不足 3 个字符回退为 LIKE
+    assert _search(ledger_id, "调节") == ["FV-1001"]
+
+
+def test_search_index_follows_writes(app, init_database):
+    """测试阀门修改、删除后全文索引同步"""
+    ledger_id = _setup(app)
+    valve = Valve.query.filter_by(位号="FV-2002").first()
+    valve.名称 = "出料止回阀"
+    db.session.commit()
+    assert _search(ledger_id, "切断阀") == []
+    assert _search(ledger_id, "止回阀") == ["FV-2002"]
+
+    db.session.delete(valve)
+    db.session.commit()
+    assert _search(ledger_id, "止回阀") == []
+
+
+def test_ledger_detail_search(client, init_database):
+    """测试合集详情页检索"""
+    ledger_id = _setup(client.application)
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    response = client.get(f"/ledger/{ledger_id}?from=mine&search=切断阀")
+    assert response.status_code == 200
+    assert "FV-2002".encode() in response.data
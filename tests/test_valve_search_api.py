@@ -0,0 +1,83 @@
+# coding=utf-8
+from datetime import datetime, timedelta
+
+from app.models import db, Ledger, Valve, User
+
+
+def _setup():
+    admin = User.query.filter_by(username="admin").first()
+    user = User.query.filter_by(username="user1").first()
+    snapshot_at = datetime.utcnow()
+
+    approved = Ledger(
+        名称="已审批合集",
+        created_by=admin.id,
+        approved_snapshot_status="approved",
+        approved_snapshot_at=snapshot_at,
+    )
+    draft = Ledger(名称="草稿合集", created_by=admin.id)
+    mine = Ledger(名称="我的合集", created_by=user.id)
+    db.session.add_all([approved, draft, mine])
+    db.session.flush()
+
+    before = snapshot_at - timedelta(hours=1)
+    after = snapshot_at + timedelta(hours=1)
+    for i in range(5):
+        db.session.add(
+            Valve(ledger_id=approved.id, 位号=f"FV-A{i}", status="approved",
+                  approved_at=before, created_by=admin.id)
+        )
+    db.session.add_all(
+        [
+            Valve(ledger_id=approved.id, 位号="FV-LATE", status="approved",
+                  approved_at=after, created_by=admin.id),
+            Valve(ledger_id=approved.id, 位号="FV-PEND", status="pending",
+                  created_by=admin.id),
+            Valve(ledger_id=draft.id, 位号="FV-DRAFT", status="draft",
+                  created_by=admin.id),
+            Valve(ledger_id=mine.id, 位号="FV-MINE", status="draft",
+                  created_by=user.id),
+        ]
+    )
+    db.session.commit()
+
+
+def _all_tags(client, **params):
+    tags, cursor = [], None
+    while True:
+        if cursor:
+            params["after"] = cursor
+        data = client.get("/api/valves/search", query_string=params).get_json()
+        tags.extend(item["位号"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            return tags
+
+
+def test_search_api_respects_visibility(client, init_database):
+    """测试员工只能检索自己的合集和已审批快照内的阀门"""
+    _setup()
+    client.post("/login", data={"username": "user1", "password": "user123"})
+    tags = _all_tags(client, limit=2)
+    assert sorted(tags) == ["FV-A0", "FV-A1", "FV-A2", "FV-A3", "FV-A4", "FV-MINE"]
+
+
+def test_search_api_keyset_pagination(client, init_database):
+    """测试游标分页不重复、不遗漏"""
+    _setup()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    first = client.get("/api/valves/search?limit=3").get_json()
+    assert len(first["items"]) == 3
+    ids = [item["id"] for item in first["items"]]
+    assert ids == sorted(ids, reverse=True)
+    assert first["next_cursor"] == ids[-1]
+
+    tags = _all_tags(client, limit=3)
+    assert len(tags) == len(set(tags)) == 9
+
+
+def test_search_api_query(client, init_database):
+    """测试关键字检索"""
+    _setup()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    assert _all_tags(client, q="FV-A") == ["FV-A4", "FV-A3", "FV-A2", "FV-A1", "FV-A0"]
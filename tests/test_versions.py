@@ -0,0 +1,125 @@
+# coding=utf-8
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.models import db, Ledger, Valve, User
+from app.services.batch_save import VersionConflict, _prefetch, save_valve_rows
+from app.services.valve_status import rebuild_ledger_counters
+
+
+def _ledger_with_valves(count=2):
+    admin = User.query.filter_by(username="admin").first()
+    ledger = Ledger(名称="版本号", created_by=admin.id)
+    db.session.add(ledger)
+    db.session.flush()
+    valves = [
+        Valve(ledger_id=ledger.id, 位号=f"VER-{ledger.id}-{i}", created_by=admin.id)
+        for i in range(count)
+    ]
+    db.session.add_all(valves)
+    db.session.commit()
+    rebuild_ledger_counters([ledger.id])
+    db.session.commit()
+    return ledger, valves
+
+
+def test_row_versions(app, init_database):
+    """测试阀门每次 ORM 更新递增版本号，并发修改时抛出 StaleDataError；
+    合集计数写入不改变合集版本号"""
+    ledger, (valve, _) = _ledger_with_valves()
+    assert (valve.version, ledger.version) == (1, 1)
+    valve.名称 = "调节阀"
+    db.session.commit()
+    assert valve.version == 2
+    assert db.session.get(Ledger, ledger.id).version == 1
+
+    # 模拟另一个会话已提交的修改
+    db.session.execute(
+        Valve.__table__.update()
+        .where(Valve.__table__.c.id == valve.id)
+        .values(version=3)
+    )
+    valve.名称 = "切断阀"
+    with pytest.raises(StaleDataError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_batch_save_conflict(client, init_database):
+    """测试批量保存的行版本号冲突：返回 409 与库中当前值，整批不写入"""
+    ledger, (first, second) = _ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    url = f"/ledger/{ledger.id}/valve/batch-save"
+    body = client.post(
+        url, json=[{"id": first.id, "version": 1, "data": {"名称": "调节阀"}}]
+    ).get_json()
+    assert body["results"][0]["version"] == 2
+
+    response = client.post(
+        url,
+        json=[
+            {"id": second.id, "version": 1, "data": {"名称": "新"}},
+            {"id": first.id, "version": 1, "data": {"名称": "旧"}},
+        ],
+    )
+    assert response.status_code == 409
+    (conflict,) = response.get_json()["conflicts"]
+    assert (conflict["id"], conflict["base_version"], conflict["version"]) == (
+        first.id,
+        1,
+        2,
+    )
+    assert conflict["values"]["名称"] == "调节阀"
+    db.session.expire_all()
+    assert db.session.get(Valve, second.id).名称 is None
+
+
+def test_edit_forms_reject_stale_version(client, init_database):
+    """测试阀门、合集编辑表单提交旧版本号时返回 409 并显示最新内容"""
+    ledger, (valve, _) = _ledger_with_valves()
+    client.post("/login", data={"username": "admin", "password": "admin123"})
+    valve.名称 = "已被修改"
+    db.session.commit()
+
+    form = {"位号": valve.位号, "名称": "覆盖", "version": "1"}
+    for url in (
+        f"/valve/edit/{valve.id}",
+        f"/ledger/{ledger.id}/valve/edit/{valve.id}",
+    ):
+        response = client.post(url, data=form)
+        assert response.status_code == 409
+        assert "已被修改" in response.get_data(as_text=True)
+    db.session.expire_all()
+    assert db.session.get(Valve, valve.id).名称 == "已被修改"
+
+    url = f"/ledger/{ledger.id}/edit"
+    response = client.post(url, data={"名称": "改名", "version": "1"})
+    assert response.status_code == 302
+    assert client.post(url, data={"名称": "再改", "version": "1"}).status_code == 409
+    db.session.expire_all()
+    ledger = db.session.get(Ledger, ledger.id)
+    assert (ledger.名称, ledger.version) == ("改名", 2)
+
+
+def test_concurrent_edit_after_prefetch(app, init_database):
+    """测试预取之后其他人提交一次修改（版本号恰为 base + 1）时仍判定为冲突"""
+    ledger, (valve, _) = _ledger_with_valves()
+    found = _prefetch([valve.id])
+
+    # 模拟另一个会话在预取之后、写入之前提交的修改
+    valves = Valve.__table__
+    db.session.execute(
+        valves.update()
+        .where(valves.c.id == valve.id)
+        .values(名称="对方的修改", version=valves.c.version + 1)
+    )
+    db.session.commit()
+
+    items = [{"id": valve.id, "version": 1, "data": {"名称": "我的修改"}}]
+    with pytest.raises(VersionConflict) as raised:
+        save_valve_rows(ledger, items, None, found)
+    db.session.rollback()
+    (conflict,) = raised.value.conflicts
+    assert (conflict["version"], conflict["values"]["名称"]) == (2, "对方的修改")
+    db.session.expire_all()
+    assert db.session.get(Valve, valve.id).名称 == "对方的修改"